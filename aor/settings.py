@@ -99,3 +99,50 @@ STATIC_URL = '/aor/static/'
 STATIC_ROOT = os.path.join(BASE_DIR,'static')
 
 TEMPLATE_DIRS = [os.path.join(BASE_DIR,'templates')]
+
+# Cache of encoded getInfo responses (game.cache.InfoCache)
+# Keys include Game.generation, so each uwsgi process may keep its own copy.
+# To share it between processes, use a cache from CACHES instead:
+#   'BACKEND': 'game.cache.DjangoCacheBackend', 'OPTIONS': { 'alias': 'default' }
+GAME_INFO_CACHE = {
+    'BACKEND': 'game.cache.LocalLRUBackend',
+    'OPTIONS': {
+        'max_entries': 1024,
+    }
+}
+
+# Identity provider for player.tokeninfo.TokenInfoClient
+# For load tests, 'player.tokeninfo.StubProvider' accepts any token 'stub-<user_id>'.
+TOKEN_INFO = {
+    'PROVIDER': 'player.tokeninfo.IizsNetProvider',
+    'OPTIONS': {
+        'connect_timeout': 2,
+        'read_timeout': 5,
+        'pool_size': 10,
+    }
+}
+
+# Verify GameInfo's derived counters (GameInfo.check_invariants) after every applied log
+GAME_CHECK_INVARIANTS = DEBUG
+
+# Let clients ask ('sync': true) for their action to be applied in the web request when
+# nothing else is pending; otherwise, and whenever this is False, celery applies it.
+GAME_SYNC_APPLY = True
+
+# Try actions on a copy of the current GameInfo and reject the ones that would fail
+# before they get an lsn (only when nothing is pending, see game.engine.dry_run)
+GAME_VALIDATE_ACTIONS = True
+
+# getInfo?wait_for_lsn= blocks a uwsgi worker while it waits, so it waits MAX_TIMEOUT seconds
+# at most. Keep it short with the sync workers of aor_uwsgi.ini (see game.notify).
+GAME_WAIT_FOR_LSN = {
+    'MAX_TIMEOUT': 3,
+}
+
+# process_action metrics (game.metrics); the web process serves them at /api/v1/game/metrics/
+# to ALLOWED_IPS, and celery pool process i serves them on WORKER_PORT + i if WORKER_PORT is set.
+GAME_METRICS = {
+    'HOST': '127.0.0.1',
+    'WORKER_PORT': None,
+    'ALLOWED_IPS': ('127.0.0.1',),
+}
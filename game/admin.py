@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from game.models import Game, GameLog
+from game.models import Game, GameLog, GameSnapshot
 
 admin.site.register(Game)
 admin.site.register(GameLog)
+admin.site.register(GameSnapshot)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+''' benchmark of the stages that apply a log
+
+A game record is a dict
+    { 'game_id', 'edition', 'num_players', 'initial_info' (GameInfoCodec text),
+      'logs' : [ { 'lsn', 'user_id', 'log' }, ... ] }
+as written by 'manage.py export_logs', or made from random play by synthetic_records(),
+whose records also have 'stopped'.
+
+measure() replays records in memory and times, for every log,
+    dispatch.<GameState subclass>   GameState.action
+    encode.codec, encode.json       GameInfoCodec.encode, GameInfoEncoder
+    decode.codec, decode.json       GameInfoCodec.decode, GameInfoDecoder
+    mask.player, mask.observer      GameInfo.mask, once per viewer
+and measure_process_action() times process_action on a throwaway database.
+'''
+from timeit import default_timer as clock
+import copy
+import json
+import os
+import random
+import uuid
+
+from django.db import connection, transaction
+from django.core.management import call_command
+
+from game.models import Game, GameLog, GameState, GameInfoCodec, GameInfoEncoder, GameInfoDecoder
+from game.engine import Engine, RandomAgent, FAILURES, play
+from game.tasks import process_action
+from player.models import Player
+from rule.models import Edition
+
+class Timings(object):
+    ''' samples in seconds by stage name '''
+    def __init__(self):
+        self.samples = {}
+        # [ (game_id, lsn, error), ... ] of the records which could not be replayed to the end
+        self.errors = []
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        ''' { name : { count, total, mean, p50, p95, max } }, times in microseconds '''
+        d = {}
+        for (name, samples) in self.samples.iteritems():
+            s = sorted(samples)
+            d[name] = {
+                'count' : len(s),
+                'total' : sum(s) * 1e6,
+                'mean' : sum(s) * 1e6 / len(s),
+                'p50' : _percentile(s, 50) * 1e6,
+                'p95' : _percentile(s, 95) * 1e6,
+                'max' : s[-1] * 1e6,
+            }
+        return d
+
+def _percentile(s, p):
+    ''' nearest rank of sorted s '''
+    return s[max(0, int(round(p / 100.0 * len(s))) - 1)]
+
+def export_game(g):
+    ''' game record of g '''
+    logs = GameLog.objects.filter(game=g).select_related('player').order_by('lsn')
+    return {
+        'game_id' : g.hashkey,
+        'edition' : g.edition.name,
+        'num_players' : g.num_players,
+        'initial_info' : g.initial_info,
+        'logs' : [ {
+                'lsn' : l.lsn,
+                'user_id' : l.player.user_id if l.player != None else None,
+                'log' : l.get_log_as_dict(),
+            } for l in logs ],
+    }
+
+def load_records(path):
+    ''' game records of the *.json files in directory path '''
+    records = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.json'):
+            with open(os.path.join(path, name)) as f:
+                records.append(json.load(f))
+    return records
+
+def synthetic_records(catalog, games, num_players, seed=0, max_actions=1000):
+    ''' game records of games played by game.engine.RandomAgent; the same seed gives the same records
+
+    The logs are the actions the engine accepted, so a game that stopped on an exception
+    replays like any other. Its record has 'stopped' : { 'lsn', 'error' }, the action
+    which raised and why; it is None for a game played to the end.
+    '''
+    records = []
+    for i in range(games):
+        engine = Engine(catalog, num_players, seed=seed + i)
+        (attempts, accepted, error) = play(engine, RandomAgent(random.Random(seed + i)), max_actions)
+        records.append({
+            'game_id' : 'synthetic-' + str(seed + i),
+            'edition' : catalog.edition,
+            'num_players' : num_players,
+            'initial_info' : GameInfoCodec.encode(engine.initial_info),
+            'logs' : [ {
+                    'lsn' : n + 1,
+                    'user_id' : u,
+                    'log' : a,
+                } for (n, (u, a)) in enumerate(engine.log) ],
+            'stopped' : {
+                    'lsn' : len(engine.log) + 1,
+                    'error' : error.strip().splitlines()[-1],
+                } if error != None else None,
+        })
+    return records
+
+def measure(records, timings):
+    for r in records:
+        _replay(r, timings)
+    return timings
+
+def _replay(record, t):
+    info = GameInfoCodec.decode(record['initial_info'])
+    players = [ h.user_id for h in info.house_bidding_log ]
+
+    for entry in record['logs']:
+        params = copy.deepcopy(entry['log'])
+        state = GameState.getInstance(info)
+        if state == None:
+            t.errors.append( (record['game_id'], entry['lsn'], "no handler for state '" + info.state + "'") )
+            return
+
+        start = clock()
+        try:
+            state.action(params['action'], user_id=entry['user_id'], params=params)
+        except FAILURES:
+            pass
+        except Exception as e:
+            t.errors.append( (record['game_id'], entry['lsn'], type(e).__name__ + ': ' + str(e)) )
+            return
+        t.add('dispatch.' + type(state).__name__, clock() - start)
+        info = state.info
+
+        start = clock()
+        s = GameInfoCodec.encode(info)
+        t.add('encode.codec', clock() - start)
+
+        start = clock()
+        j = json.dumps(info, cls=GameInfoEncoder)
+        t.add('encode.json', clock() - start)
+
+        start = clock()
+        GameInfoCodec.decode(s)
+        t.add('decode.codec', clock() - start)
+
+        start = clock()
+        json.loads(j, cls=GameInfoDecoder)
+        t.add('decode.json', clock() - start)
+
+        # mask 는 info 를 바꾸므로 viewer 마다 새로 decode 한 것을 가린다.
+        for viewer in players + [ None ]:
+            masked = GameInfoCodec.decode(s)
+            start = clock()
+            masked.mask(viewer)
+            t.add('mask.player' if viewer != None else 'mask.observer', clock() - start)
+
+def measure_process_action(records, fixture, timings):
+    ''' time process_action log by log on a test database, which is in memory for SQLite
+
+    Logs are submitted one at a time and applied with replay=True, so the queued
+    actions recorded in the logs are not queued again.
+    '''
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        call_command('loaddata', fixture, verbosity=0)
+        for r in records:
+            _process(r, timings)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return timings
+
+def _process(record, t):
+    info = GameInfoCodec.decode(record['initial_info'])
+    g = Game(
+            hashkey=uuid.uuid4().hex,
+            num_players=record['num_players'],
+            edition=Edition.objects.get(name=record['edition']),
+            status=Game.IN_PROGRESS,
+            initial_info=record['initial_info'],
+            current_info=record['initial_info'],
+        )
+    g.save()
+    players = {}
+    for h in info.house_bidding_log:
+        (players[h.user_id], created) = Player.objects.get_or_create(user_id=h.user_id, defaults={ 'name' : h.user_id })
+        g.players.add(players[h.user_id])
+
+    for entry in record['logs']:
+        start = clock()
+        with transaction.atomic():
+            Game.objects.filter(pk=g.pk).update(last_lsn=entry['lsn'])
+            GameLog.objects.create(
+                    game=g,
+                    player=players.get(entry['user_id'], None),
+                    lsn=entry['lsn'],
+                    log=json.dumps(entry['log']),
+                )
+        t.add('process_action.submit', clock() - start)
+
+        # worker 와 같은 경로를 재되, celery 는 거치지 않는다.
+        start = clock()
+        try:
+            process_action(g.hashkey, entry['lsn'], replay=True)
+        except Exception as e:
+            t.errors.append( (record['game_id'], entry['lsn'], type(e).__name__ + ': ' + str(e)) )
+            return
+        t.add('process_action.apply', clock() - start)
+
+def compare(stages, baseline, threshold, key='p50'):
+    ''' [ (name, baseline, current) ] of the stages slower than baseline by more than threshold (0.2 = 20%) '''
+    regressions = []
+    for (name, b) in sorted(baseline.iteritems()):
+        if name not in stages:
+            continue
+        if stages[name][key] > b[key] * (1 + threshold):
+            regressions.append( (name, b[key], stages[name][key]) )
+    return regressions
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+class LocalLRUBackend(object):
+    ''' in-process cache that drops the least recently used entry beyond max_entries '''
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value != None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class DjangoCacheBackend(object):
+    ''' one of settings.CACHES (memcached, locmem, ...); eviction is left to the cache itself '''
+    def __init__(self, alias='default', timeout=3600):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+class InfoCache(object):
+    ''' encoded getInfo responses, keyed by (game, generation, applied_lsn, last_lsn, viewer[, since_lsn]),
+    and getLegalActions responses, keyed by (game, generation, applied_lsn, viewer)
+
+    Applying or submitting a log changes the lsn part of the key, so nothing has to
+    be invalidated on the normal path. Rollback reuses lsns, but it also increments
+    Game.generation, which is stored in the database and read in the same query as
+    the lsns, so no process can hit an entry made before the rollback. This is why a
+    process-local backend is safe; a shared one only saves memory and warm-up.
+    '''
+    DEFAULT_BACKEND = 'game.cache.LocalLRUBackend'
+
+    def __init__(self, backend=None, options=None):
+        if backend == None:
+            conf = getattr(settings, 'GAME_INFO_CACHE', {})
+            backend = conf.get('BACKEND', InfoCache.DEFAULT_BACKEND)
+            options = conf.get('OPTIONS', {})
+        self.backend = import_string(backend)(**(options or {}))
+
+    def make_key(self, game_id, generation, applied_lsn, last_lsn, viewer, since_lsn=None):
+        key = 'aor:info:%s:%d:%d:%d:%s' % (game_id, generation, applied_lsn, last_lsn, viewer)
+        if since_lsn != None:
+            key += ':since:%d' % since_lsn
+        return key
+
+    def make_legal_key(self, game_id, generation, applied_lsn, viewer):
+        ''' getLegalActions responses depend on the applied state only '''
+        return 'aor:legal:%s:%d:%d:%s' % (game_id, generation, applied_lsn, viewer)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, content):
+        self.backend.set(key, content)
+
+info_cache = InfoCache()
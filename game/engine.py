@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+''' headless game engine
+
+Engine drives GameState.getInstance(info).action(...) the way process_action does,
+but keeps everything in memory: no Game, GameLog or celery, and rule data comes from
+a RuleCatalog (which can be built from a fixture with RuleCatalog.from_fixture).
+RandomAgent plays random legal actions, and simulate() plays many games with it.
+dry_run() checks actions on a copy of a game's info before they are logged.
+'''
+from collections import deque
+import copy
+import random
+import time
+import traceback
+
+from game.models import GameInfo, GameState, HouseBiddingLog, Action
+from rule.catalog import register_catalog
+
+# exceptions that make process_action mark a log as FAILED
+FAILURES = (
+    GameState.NotSupportedAction,
+    GameState.InvalidAction,
+    Action.InvalidParameter,
+    Action.WarNotResolved,
+)
+
+class Engine(object):
+    ''' one game in memory; log is the list of applied (user_id, action) like GameLog rows
+
+    initial_info is a copy of the info before the first log, like Game.initial_info.
+    '''
+    # queue_action 이 끝없이 이어지는 것을 막는다. (process_action 의 MAX_QUEUED_STEPS 와 같은 역할)
+    MAX_QUEUED_STEPS = 50
+
+    def __init__(self, catalog, num_players, seed=None, user_ids=None):
+        register_catalog(catalog)
+
+        if user_ids == None:
+            user_ids = [ 'p' + str(i + 1) for i in range(num_players) ]
+        info = GameInfo()
+        info.edition = catalog.edition
+        info.game_id = 'headless-' + str(seed)
+        info.num_players = num_players
+        if seed != None:
+            info.seed = seed
+        for user_id in user_ids:
+            h = HouseBiddingLog()
+            h.user_id = user_id
+            info.house_bidding_log.append(h)
+
+        self.initial_info = info.copy()
+        self.info = info
+        self.user_ids = list(user_ids)
+        self.log = []
+        self.apply(None, { 'action': Action.DEAL_CARDS })
+
+    def apply(self, user_id, action):
+        ''' apply a log and every system action it queues; False if the log itself failed
+
+        As in process_action, a failed action may have changed info partially;
+        use try_apply() to leave info untouched on failure.
+        '''
+        pending = deque([ (user_id, dict(action)) ])
+        accepted = None
+        steps = 0
+        while pending and steps <= Engine.MAX_QUEUED_STEPS:
+            (u, a) = pending.popleft()
+            state = GameState.getInstance(self.info)
+            try:
+                if state == None:
+                    raise GameState.NotSupportedAction("no handler for state '" + self.info.state + "'")
+                result = state.action(a['action'], user_id=u, params=a)
+            except FAILURES:
+                if accepted == None:
+                    accepted = False
+                steps += 1
+                continue
+
+            self.info = state.info
+            if 'queue_action' in result.keys():
+                q = result['queue_action']
+                pending.append( (q['_player'] if '_player' in q else None, q) )
+            self.log.append( (u, a) )
+            if accepted == None:
+                accepted = True
+            steps += 1
+        return accepted
+
+    def try_apply(self, user_id, action):
+        ''' apply on a copy of info and keep the result only if the action is accepted '''
+        saved = (self.info, len(self.log))
+        self.info = saved[0].copy()
+        if self.apply(user_id, action):
+            return True
+        (self.info, n) = saved
+        del self.log[n:]
+        return False
+
+    def get_actors(self):
+        ''' user_ids who may act in the current state '''
+        (actor, name, params) = self.info.get_state()
+        if actor == GameState.AUTO:
+            return []
+        if actor == GameState.ALL:
+            return list(self.user_ids)
+        return [ actor ]
+
+class RandomAgent(object):
+    ''' proposes random actions of the right shape; the engine decides whether they are legal '''
+    def __init__(self, rng):
+        self.rng = rng
+
+    def candidates(self, info, user_id):
+        (actor, name, params) = info.get_state()
+        actions = []
+        if name == GameState.HOUSE_BIDDING:
+            for h in info.house_bidding_log:
+                if h.user_id != user_id:
+                    continue
+                if h.discard_card == None:
+                    actions += [ { 'action': Action.DISCARD, 'card': c } for c in h.draw_cards ]
+                elif h.bid == None:
+                    actions.append({ 'action': Action.BID, 'bid': self.rng.randint(0, 10) })
+        elif name == GameState.CHOOSE_CAPITAL:
+            actions += [ { 'action': Action.CHOOSE, 'choice': h } for h in GameInfo.HOUSES[0:info.num_players] ]
+        elif name == GameState.TOKEN_BIDDING:
+            if user_id in info.houses and info.getTurnLog(user_id).tokens == None:
+                actions.append({ 'action': Action.BID, 'bid': self.rng.randint(0, info.getHouseInfo(user_id).cash) })
+        elif name == GameState.TIE_BREAKING:
+            actions += [ { 'action': Action.CHOOSE, 'choice': i + 1 } for i in range(info.num_players) ]
+        elif name == GameState.PLAY_CARD:
+            actions.append({ 'action': Action.PASS })
+            for card in info.getHouseInfo(user_id).hands:
+                actions += self._card_actions(info, card)
+        elif name == GameState.RESOLVE_CIVIL_WAR:
+            actions += [ { 'action': Action.CHOOSE, 'choice': c } for c in ('token', 'cash') ]
+        elif name == GameState.POST_WAR:
+            available = list(info.war['available_provinces'])
+            n = min(info.war['difference'], len(available))
+            actions.append({ 'action': Action.CHOOSE, 'choice': self.rng.sample(available, n) })
+        self.rng.shuffle(actions)
+        return actions
+
+    def _card_actions(self, info, card):
+        catalog = info.catalog
+        actions = [ { 'action': Action.PLAY_CARD, 'card': card } ]
+        if card in catalog.commodity_cards:
+            for c in catalog.commodity_cards[card].commodities:
+                actions.append({ 'action': Action.PLAY_CARD, 'card': card, 'choice': catalog.commodities[c].full_name })
+        elif card in catalog.event_cards:
+            provinces = sorted(info.provinces.keys())
+            actions += [ { 'action': Action.PLAY_CARD, 'card': card, 'target': key } for key in info.houses ]
+            actions += [ { 'action': Action.PLAY_CARD, 'card': card, 'target': str(i) } for i in range(1, 9) ]
+            actions.append({ 'action': Action.PLAY_CARD, 'card': card, 'target': self.rng.choice(provinces) })
+            actions.append({ 'action': Action.PLAY_CARD, 'card': card,
+                            'targets': self.rng.sample(provinces, min(info.epoch, len(provinces))) })
+        return actions
+
+def dry_run(info, actions):
+    ''' try [ (user_id, action), ... ] on a copy of info, as process_action would apply them
+
+    Raises the exception of the first submitted action that would fail: one of FAILURES,
+    or GameState.InvalidAction for any other exception, for which process_action would
+    fail the log as well.
+
+    The queued actions are followed with the semantics of process_action: the submitted
+    actions are applied first, then the actions they queued, round by round. A queued
+    action that fails is not an error of the submitted ones; it leaves a partial change
+    for FAILURES and no change for any other exception, and queues nothing. Checking
+    stops after Engine.MAX_QUEUED_STEPS queued actions, which process_action would
+    apply in a later transaction.
+    '''
+    info = info.copy()
+    pending = [ (user_id, copy.deepcopy(action), True) for (user_id, action) in actions ]
+    steps = 0
+    while pending:
+        queued = []
+        for (u, a, submitted) in pending:
+            saved = info.copy() if not submitted else None
+            state = GameState.getInstance(info)
+            try:
+                if state == None:
+                    raise GameState.NotSupportedAction("no handler for state '" + info.state + "'")
+                result = state.action(a.get('action', None), user_id=u, params=a)
+            except FAILURES:
+                if submitted:
+                    raise
+                if state != None:
+                    info = state.info
+                continue
+            except Exception as e:
+                if submitted:
+                    raise GameState.InvalidAction('unable to apply the action: ' + type(e).__name__)
+                info = saved
+                continue
+
+            info = state.info
+            if 'queue_action' in result.keys():
+                q = result['queue_action']
+                queued.append( (q['_player'] if '_player' in q else None, q, False) )
+
+        steps += len(queued)
+        if steps >= Engine.MAX_QUEUED_STEPS:
+            return
+        pending = queued
+
+def play(engine, agent, max_actions=1000):
+    ''' let agent play until nobody can act
+
+    Returns (number of attempted actions, number of accepted ones, error or None);
+    the rest of engine.log are the actions the accepted ones queued.
+    '''
+    attempts = 0
+    accepted = 0
+    while len(engine.log) < max_actions:
+        moved = False
+        actors = engine.get_actors()
+        agent.rng.shuffle(actors)
+        for user_id in actors:
+            for a in agent.candidates(engine.info, user_id):
+                attempts += 1
+                try:
+                    if engine.try_apply(user_id, a):
+                        accepted += 1
+                        moved = True
+                        break
+                except Exception:
+                    return (attempts, accepted, traceback.format_exc())
+            if moved:
+                break
+        if not moved:
+            break
+    return (attempts, accepted, None)
+
+def simulate(catalog, games, num_players, seed=0, max_actions=1000):
+    ''' play games with RandomAgent; returns a dict of counts and rates
+
+    'actions' are the agents' accepted actions, 'queued' the system actions applied
+    with them (the first deal_cards included), and 'attempts' every action an agent tried.
+    A game that stops on an exception other than FAILURES is counted in stopped_games,
+    with the exception in errors.
+    '''
+    stats = {
+        'games': games,
+        'num_players': num_players,
+        'actions': 0,
+        'queued': 0,
+        'attempts': 0,
+        'final_states': {},
+        'errors': {},
+        'stopped_games': 0,
+    }
+    started = time.time()
+    for i in range(games):
+        engine = Engine(catalog, num_players, seed=seed + i)
+        agent = RandomAgent(random.Random(seed + i))
+        (attempts, accepted, error) = play(engine, agent, max_actions)
+
+        stats['actions'] += accepted
+        stats['queued'] += len(engine.log) - accepted
+        stats['attempts'] += attempts
+        (actor, name, params) = engine.info.get_state()
+        stats['final_states'][name] = stats['final_states'].get(name, 0) + 1
+        if error != None:
+            key = error.strip().splitlines()[-1]
+            stats['errors'][key] = stats['errors'].get(key, 0) + 1
+            stats['stopped_games'] += 1
+    elapsed = time.time() - started
+
+    stats['seconds'] = elapsed
+    stats['games_per_sec'] = games / elapsed if elapsed > 0 else None
+    stats['actions_per_sec'] = stats['actions'] / elapsed if elapsed > 0 else None
+    return stats
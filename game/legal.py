@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+''' legal actions of a player in the current state of a game
+
+legal_actions(info, user_id) returns the actions user_id may send now, as a list of dicts
+like the action body itself, where a parameter is either a fixed value or one of the domains
+    { 'one_of' : [ value, ... ] }
+    { 'min' : n, 'max' : m }                        an integer in [n, m]
+    { 'subset_of' : [ value, ... ], 'size' : n }    a list of n distinct values
+    { 'keys' : [ key, ... ], 'values' : [ ... ] }   a dict that maps every key to one of values
+e.g. { 'action': 'play_card', 'card': 'E24_reb', 'target': { 'one_of': [ 'Ven', ... ] } }.
+
+The rules are not written down twice: every candidate is tried on a copy of info by the
+GameState handler itself, and only the ones it accepts are returned. A range is tried at
+both ends and narrowed to the values accepted; domains that are too large to try value by
+value (subsets, dicts) are checked with one representative.
+'''
+from game.models import GameInfo, HouseInfo, GameState, Action
+from rule.models import AREA_FAR_EAST, AREA_NEW_WORLD
+
+# event card 의 'target' 으로 시도해 볼 값 중 province 가 아닌 것
+EVENT_TARGETS = [ 1, 2, 3, 4, 5, 6, 7, 8, 'Science', 'Religion', 'Exploration' ]
+
+# 'targets' (province 의 list) 를 받는 event card
+MULTI_TARGET_CARDS = ( 'E23_vik', )
+
+def legal_actions(info, user_id):
+    ''' [ action, ... ] that user_id may send in the current state of info, which is not changed '''
+    (actor, name, params) = info.get_state()
+    players = [ h.user_id for h in info.house_bidding_log ]
+    if user_id not in players or actor == GameState.AUTO:
+        return []
+    if actor != GameState.ALL and actor != user_id:
+        return []
+
+    candidates = _CANDIDATES.get(name, None)
+    if candidates == None:
+        return []
+
+    actions = []
+    for (fixed, domains) in candidates(info, user_id):
+        a = _check(info, user_id, fixed, domains)
+        if a != None:
+            actions.append(a)
+    return actions
+
+def _accepts(info, user_id, action):
+    ''' True if the handler applies action without raising; info is not changed '''
+    copied = info.copy()
+    state = GameState.getInstance(copied)
+    if state == None:
+        return False
+    try:
+        state.action(action['action'], user_id=user_id, params=dict(action))
+    except Exception:
+        # FAILURES 가 아닌 예외는 process_action 도 적용하지 못한다.
+        return False
+    return True
+
+def _check(info, user_id, fixed, domains):
+    ''' fixed params plus the parts of domains the handler accepts, or None '''
+    a = dict(fixed)
+    for (param, domain) in domains.items():
+        if 'one_of' in domain:
+            values = [ v for v in domain['one_of'] if _accepts(info, user_id, dict(fixed, **{ param: v })) ]
+            if not values:
+                return None
+            a[param] = { 'one_of': values }
+        elif 'min' in domain:
+            a[param] = _check_range(info, user_id, fixed, param, domain)
+            if a[param] == None:
+                return None
+        else:
+            if not _accepts(info, user_id, dict(fixed, **{ param: _representative(domain) })):
+                return None
+            a[param] = domain
+    if not domains and not _accepts(info, user_id, fixed):
+        return None
+    return a
+
+def _check_range(info, user_id, fixed, param, domain):
+    ''' the part of [min, max] the handler accepts, or None
+
+    The accepted values are taken to be an interval which contains min or max;
+    when only one end is accepted, the other end is found by bisection.
+    '''
+    def accepts(v):
+        return _accepts(info, user_id, dict(fixed, **{ param: v }))
+
+    (low, high) = (domain['min'], domain['max'])
+    if low > high:
+        return None
+    low_ok = accepts(low)
+    high_ok = accepts(high)
+    if low_ok and high_ok:
+        return domain
+    if not low_ok and not high_ok:
+        return None
+
+    (ok, bad) = (low, high) if low_ok else (high, low)
+    while abs(bad - ok) > 1:
+        mid = (ok + bad) // 2
+        if accepts(mid):
+            ok = mid
+        else:
+            bad = mid
+    return { 'min': low, 'max': ok } if low_ok else { 'min': ok, 'max': high }
+
+def _representative(domain):
+    if 'subset_of' in domain:
+        return domain['subset_of'][:domain['size']]
+    return dict([ (k, domain['values'][0]) for k in domain['keys'] ])
+
+# 상태별 후보: [ (fixed params, { param: domain }), ... ]
+
+def _house_bidding(info, user_id):
+    for h in info.house_bidding_log:
+        if h.user_id == user_id:
+            if h.discard_card == None:
+                yield ({ 'action': Action.DISCARD }, { 'card': { 'one_of': list(h.draw_cards) } })
+            # house 를 고르기 전이므로 남은 자금은 시작 자금이다. 입찰한 만큼 빠진다.
+            yield ({ 'action': Action.BID }, { 'bid': { 'min': 0, 'max': HouseInfo.STARTING_CASH } })
+
+def _choose_capital(info, user_id):
+    yield ({ 'action': Action.CHOOSE }, { 'choice': { 'one_of': list(GameInfo.HOUSES[0:info.num_players]) } })
+
+def _token_bidding(info, user_id):
+    if user_id in info.houses:
+        yield ({ 'action': Action.BID }, { 'bid': { 'min': 0, 'max': info.getTurnLog(user_id).cash } })
+
+def _tie_breaking(info, user_id):
+    yield ({ 'action': Action.CHOOSE }, { 'choice': { 'one_of': range(1, info.num_players + 1) } })
+
+def _play_card(info, user_id):
+    yield ({ 'action': Action.PASS }, {})
+
+    catalog = info.catalog
+    targets = None
+    for card in sorted(set(info.getHouseInfo(user_id).hands)):
+        fixed = { 'action': Action.PLAY_CARD, 'card': card }
+        if card in catalog.commodity_cards and len(catalog.commodity_cards[card].commodities) > 1:
+            names = sorted([ catalog.commodities[c].full_name for c in catalog.commodity_cards[card].commodities ])
+            yield (fixed, { 'choice': { 'one_of': names } })
+        elif card in MULTI_TARGET_CARDS:
+            # dominance marker 가 있는 해안 province (Far East 와 New World 는 해안이 아니어도 된다)
+            marked = sorted([ k for (k, p) in info.provinces.iteritems() if 'color-marker' in p
+                    and ( catalog.is_coastal(k) or catalog.provinces[k].area in (AREA_FAR_EAST, AREA_NEW_WORLD) ) ])
+            yield (fixed, { 'targets': { 'subset_of': marked, 'size': info.epoch } })
+        elif card in catalog.event_cards and not _accepts(info, user_id, fixed):
+            if targets == None:
+                targets = sorted(info.houses.keys()) + EVENT_TARGETS + sorted(catalog.provinces.keys())
+            yield (fixed, { 'target': { 'one_of': targets } })
+        else:
+            yield (fixed, {})
+
+def _post_war(info, user_id):
+    yield ({ 'action': Action.CHOOSE }, { 'choice': {
+        'subset_of': sorted(info.war['available_provinces']),
+        'size': info.war['difference'],
+    } })
+
+def _resolve_civil_war(info, user_id):
+    yield ({ 'action': Action.CHOOSE }, { 'choice': { 'one_of': [ 'token', 'cash' ] } })
+
+def _remove_marker(info, user_id):
+    yield ({ 'action': Action.CHOOSE }, { 'choice': {
+        'keys': sorted(info.marker_removal.get(user_id, [])),
+        'values': [ 'empty', 'stock', 'expansion' ],
+    } })
+
+_CANDIDATES = {
+    GameState.HOUSE_BIDDING     : _house_bidding,
+    GameState.CHOOSE_CAPITAL    : _choose_capital,
+    GameState.TOKEN_BIDDING     : _token_bidding,
+    GameState.TIE_BREAKING      : _tie_breaking,
+    GameState.PLAY_CARD         : _play_card,
+    GameState.POST_WAR          : _post_war,
+    GameState.RESOLVE_CIVIL_WAR : _resolve_civil_war,
+    GameState.REMOVE_MARKER     : _remove_marker,
+}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from optparse import make_option
+
+import datetime
+import json
+import os
+import platform
+
+from game.benchmark import Timings, load_records, synthetic_records, measure, measure_process_action, compare
+from rule.catalog import RuleCatalog, get_catalog, register_catalog
+from rule.models import Edition
+
+class Command(BaseCommand):
+    help = 'Times decode, dispatch, encode, mask and process_action over recorded and synthetic game logs.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--logs', dest='logs', default=None,
+            help='Directory of game records written by export_logs.'),
+        make_option('--synthetic', type='int', dest='synthetic', default=10,
+            help='Number of games played by random agents to add to the records.'),
+        make_option('--players', type='int', dest='players', default=3,
+            help='Number of players of the synthetic games.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='Seed of the first synthetic game.'),
+        make_option('--max-actions', type='int', dest='max_actions', default=1000,
+            help='Length limit of a synthetic game.'),
+        make_option('--edition', dest='edition', default='european',
+            help='Edition of the synthetic games.'),
+        make_option('--fixture', dest='fixture', default=None,
+            help='Rule data fixture. The in-memory stages use the database when not given; '
+                 'process_action always loads a fixture (rule/init_data.json by default).'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Number of times every record is replayed.'),
+        make_option('--no-process-action', action='store_false', dest='process_action', default=True,
+            help='Skip the end-to-end process_action stage.'),
+        make_option('--output', dest='output', default=None,
+            help='Write the results as JSON to this file.'),
+        make_option('--baseline', dest='baseline', default=None,
+            help='Compare with the results in this file and fail on regressions.'),
+        make_option('--threshold', type='float', dest='threshold', default=0.2,
+            help='Allowed slowdown of the median against the baseline, 0.2 = 20%%.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['process_action'] and connection.vendor != 'sqlite':
+            raise CommandError('process_action is measured on an in-memory SQLite database; '
+                               'use SQLite settings or --no-process-action')
+        fixture = options['fixture'] or os.path.join(settings.BASE_DIR, 'rule', 'init_data.json')
+
+        records = load_records(options['logs']) if options['logs'] != None else []
+        editions = set([ r['edition'] for r in records ] + [ options['edition'] ])
+        try:
+            for edition in editions:
+                if options['fixture'] != None:
+                    register_catalog(RuleCatalog.from_fixture(options['fixture'], edition))
+                else:
+                    get_catalog(edition)
+        except Edition.DoesNotExist:
+            raise CommandError("edition '" + edition + "' not found")
+
+        t = Timings()
+        if options['synthetic'] > 0:
+            records += synthetic_records(get_catalog(options['edition']), options['synthetic'],
+                    options['players'], seed=options['seed'], max_actions=options['max_actions'])
+        if not records:
+            raise CommandError('no game records; give --logs or --synthetic')
+
+        for i in range(options['repeat']):
+            measure(records, t)
+        if options['process_action']:
+            measure_process_action(records, fixture, t)
+        stages = t.summary()
+
+        self.stdout.write('%d game(s), %d log(s), repeated %d time(s); microseconds per call' % (
+                len(records), sum([ len(r['logs']) for r in records ]), options['repeat']))
+        self.stdout.write('%-36s %8s %10s %10s %10s %10s' % ('stage', 'count', 'mean', 'p50', 'p95', 'max'))
+        for (name, s) in sorted(stages.items()):
+            self.stdout.write('%-36s %8d %10.1f %10.1f %10.1f %10.1f' % (
+                    name, s['count'], s['mean'], s['p50'], s['p95'], s['max']))
+        # random agent 가 예외로 멈춘 game 도 받아들여진 log 만 있으므로 그대로 replay 된다.
+        stopped = [ (r['game_id'], r['stopped']['lsn'], r['stopped']['error']) for r in records if r.get('stopped') ]
+        if stopped:
+            self.stdout.write('%d synthetic game(s) stopped early, their logs up to there are measured:' % len(stopped))
+            for (game_id, lsn, error) in stopped:
+                self.stdout.write('  %s at lsn %d: %s' % (game_id, lsn, error))
+        # 같은 record 가 repeat 만큼 반복되므로 중복은 한 번만 보여준다.
+        errors = sorted(set(t.errors))
+        for (game_id, lsn, error) in errors:
+            self.stdout.write('replay of %s stopped at lsn %d: %s' % (game_id, lsn, error))
+
+        if options['output'] != None:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created' : datetime.datetime.now().isoformat(),
+                    'python' : platform.python_version(),
+                    'options' : dict([ (k, options[k]) for k in (
+                            'logs', 'synthetic', 'players', 'seed', 'max_actions', 'edition', 'repeat') ]),
+                    'stages' : stages,
+                    'stopped' : stopped,
+                    'errors' : errors,
+                }, f, indent=2, sort_keys=True)
+
+        if options['baseline'] != None:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['stages']
+            regressions = compare(stages, baseline, options['threshold'])
+            for (name, before, after) in regressions:
+                self.stdout.write('REGRESSION %-36s p50 %10.1f -> %10.1f' % (name, before, after))
+            if regressions:
+                raise CommandError('%d stage(s) slower than the baseline by more than %d%%' % (
+                        len(regressions), options['threshold'] * 100))
+            self.stdout.write('no regression against ' + options['baseline'])
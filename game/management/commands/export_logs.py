@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+import json
+import os
+
+from game.models import Game
+from game.benchmark import export_game
+
+class Command(BaseCommand):
+    args = '<game_id game_id ...>'
+    help = 'Writes the GameLog sequence of games as <dir>/<game_id>.json, the input of the benchmark command.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', dest='dir', default='.',
+            help='Directory to write to.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Export every game that has been started.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            games = Game.objects.exclude(initial_info=None).select_related('edition')
+        elif args:
+            games = Game.objects.filter(hashkey__in=args).select_related('edition')
+        else:
+            raise CommandError('give game ids or --all')
+
+        if not os.path.isdir(options['dir']):
+            os.makedirs(options['dir'])
+
+        n = 0
+        for g in games:
+            with open(os.path.join(options['dir'], g.hashkey + '.json'), 'w') as f:
+                json.dump(export_game(g), f)
+            n += 1
+        self.stdout.write(str(n) + ' game(s) exported to ' + options['dir'])
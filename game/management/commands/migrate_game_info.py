@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from optparse import make_option
+
+import random
+import time
+
+from game.models import Game, GameSnapshot, GameInfoCodec, GameInfoEncoder
+
+import json
+
+class Command(BaseCommand):
+    help = 'Re-encodes stored GameInfo (Game.initial_info / current_info, GameSnapshot.info) ' \
+           'with the current GameInfoCodec, and reports size and encode/decode time before and after. ' \
+           'Infos saved before GameInfo had a seed get one random seed per game.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report, do not write anything.'),
+        make_option('--no-compress', action='store_false', dest='compress', default=True,
+            help='Store plain (uncompressed) payloads.'),
+    )
+
+    def handle(self, *args, **options):
+        self.stats = {
+            'rows': 0,
+            'legacy_bytes': 0, 'legacy_encode': 0.0, 'legacy_decode': 0.0,
+            'new_bytes': 0, 'new_encode': 0.0, 'new_decode': 0.0,
+        }
+        compress = options['compress']
+        dry_run = options['dry_run']
+
+        for g in Game.objects.exclude(current_info=None).iterator():
+            with transaction.atomic():
+                snapshots = list(GameSnapshot.objects.filter(game=g).values_list('pk', 'info'))
+                stored = [ g.initial_info, g.current_info ] + [ info for (pk, info) in snapshots ]
+                infos = [ self.decode(s) for s in stored ]
+                self.set_seed(g, infos)
+
+                encoded = [ self.encode(info, compress) for info in infos ]
+                if dry_run == False:
+                    Game.objects.filter(pk=g.pk).update(initial_info=encoded[0], current_info=encoded[1])
+                    for ((pk, info), s) in zip(snapshots, encoded[2:]):
+                        GameSnapshot.objects.filter(pk=pk).update(info=s)
+
+        st = self.stats
+        n = st['rows'] if st['rows'] > 0 else 1
+        self.stdout.write('rows: %d%s' % (st['rows'], ' (dry run)' if dry_run else ''))
+        self.stdout.write('%-8s %12s %12s %12s' % ('', 'avg bytes', 'encode ms', 'decode ms'))
+        for k in ('legacy', 'new'):
+            self.stdout.write('%-8s %12d %12.3f %12.3f' % (
+                k,
+                st[k + '_bytes'] / n,
+                st[k + '_encode'] * 1000 / n,
+                st[k + '_decode'] * 1000 / n,
+            ))
+
+    def set_seed(self, g, infos):
+        ''' give the infos of g saved without a seed the seed of the game
+
+        Every info of a game, its snapshots included, must have the same seed, or replays
+        would draw other cards and dice. The seed is that of an info of the game which
+        already has one, or a new random one.
+        '''
+        legacy = [ info for info in infos if info != None and info.seed == None ]
+        if not legacy:
+            return
+        seeds = [ info.seed for info in infos if info != None and info.seed != None ]
+        if seeds:
+            seed = seeds[0]
+        else:
+            # JSON(JavaScript) 에서도 정확히 표현되도록 53 bit 를 넘지 않는다.
+            seed = random.SystemRandom().getrandbits(53)
+        for info in legacy:
+            # seed 가 없던 때의 log 는 뽑은 카드와 주사위를 params 에 담고 있다.
+            info.seed = seed
+            info.rng_counter = 0
+
+    def decode(self, s):
+        if s == None:
+            return None
+        self.stats['rows'] += 1
+        return GameInfoCodec.decode(s)
+
+    def encode(self, info, compress):
+        if info == None:
+            return None
+        st = self.stats
+
+        t = time.time()
+        legacy = json.dumps(info, cls=GameInfoEncoder)
+        st['legacy_encode'] += time.time() - t
+        st['legacy_bytes'] += len(legacy)
+        t = time.time()
+        GameInfoCodec.decode(legacy)
+        st['legacy_decode'] += time.time() - t
+
+        t = time.time()
+        encoded = GameInfoCodec.encode(info, compress=compress)
+        st['new_encode'] += time.time() - t
+        st['new_bytes'] += len(encoded)
+
+        t = time.time()
+        GameInfoCodec.decode(encoded)
+        st['new_decode'] += time.time() - t
+        return encoded
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from game.engine import simulate
+from rule.catalog import RuleCatalog, get_catalog
+from rule.models import Edition
+
+class Command(BaseCommand):
+    help = 'Plays games in memory with random agents (game.engine) and reports games/sec and actions/sec.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--games', type='int', dest='games', default=100,
+            help='Number of games to play.'),
+        make_option('--players', type='int', dest='players', default=3,
+            help='Number of players per game (3 - 6).'),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='Seed of the first game; game i uses seed + i.'),
+        make_option('--max-actions', type='int', dest='max_actions', default=1000,
+            help='Stop a game after this many applied actions.'),
+        make_option('--edition', dest='edition', default='european',
+            help='Edition to play.'),
+        make_option('--fixture', dest='fixture', default=None,
+            help='Read rule data from this fixture instead of the database, '
+                 'e.g. rule/init_data.json.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['players'] < 3 or options['players'] > 6:
+            raise CommandError('--players must be between 3 and 6')
+
+        try:
+            if options['fixture'] != None:
+                catalog = RuleCatalog.from_fixture(options['fixture'], options['edition'])
+            else:
+                catalog = get_catalog(options['edition'])
+        except Edition.DoesNotExist:
+            raise CommandError("edition '" + options['edition'] + "' not found")
+
+        st = simulate(catalog, options['games'], options['players'],
+                seed=options['seed'], max_actions=options['max_actions'])
+
+        self.stdout.write('games: %d (%d players), %.2f s' % (st['games'], st['num_players'], st['seconds']))
+        self.stdout.write('actions: %d by agents of %d attempted, %d queued' % (st['actions'], st['attempts'], st['queued']))
+        self.stdout.write('games/sec: %.1f, actions/sec: %.1f' % (st['games_per_sec'] or 0, st['actions_per_sec'] or 0))
+        if st['stopped_games']:
+            # 예외로 멈춘 game 은 일찍 끝나므로 rate 는 그만큼 빨라 보인다.
+            self.stdout.write('stopped on an exception: %d of %d game(s)' % (st['stopped_games'], st['games']))
+        self.stdout.write('final states:')
+        for (name, n) in sorted(st['final_states'].items()):
+            self.stdout.write('  %-28s %d' % (name, n))
+        if st['errors']:
+            self.stdout.write('errors:')
+            for (e, n) in sorted(st['errors'].items()):
+                self.stdout.write('  %-60s %d' % (e, n))
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+''' in-process metrics of process_action, in the Prometheus text format
+
+Every process keeps its own registry. The web process serves it at /api/v1/game/metrics/,
+and a celery pool process serves it on GAME_METRICS['WORKER_PORT'] + its pool index.
+'''
+from bisect import bisect_left
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import threading
+
+from django.conf import settings
+from django.db import connection
+from celery.signals import worker_process_init
+from billiard import current_process
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+class Histogram(object):
+    ''' counts of observations per bucket; percentile() interpolates within a bucket '''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            if n > 0 and seen + n >= rank:
+                lower = max(self.buckets[i - 1] if i > 0 else self.min, self.min)
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+class Family(object):
+    ''' a metric with one Counter or Histogram per combination of label values '''
+    def __init__(self, registry, kind, name, help, labels, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.children = {}
+
+    def _child(self, values):
+        c = self.children.get(values, None)
+        if c == None:
+            c = Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+            self.children[values] = c
+        return c
+
+    def inc(self, n=1, *values):
+        with self.registry.lock:
+            self._child(values).inc(n)
+
+    def observe(self, value, *values):
+        with self.registry.lock:
+            self._child(values).observe(value)
+
+class Registry(object):
+    SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = []
+
+    def counter(self, name, help, labels=()):
+        f = Family(self, 'counter', name, help, labels)
+        self.families.append(f)
+        return f
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS):
+        f = Family(self, 'histogram', name, help, labels, buckets)
+        self.families.append(f)
+        return f
+
+    def render(self):
+        ''' Prometheus text exposition format '''
+        lines = []
+        with self.lock:
+            for f in self.families:
+                lines.append('# HELP ' + f.name + ' ' + f.help)
+                lines.append('# TYPE ' + f.name + ' ' + f.kind)
+                for (values, c) in sorted(f.children.items()):
+                    labels = zip(f.labels, values)
+                    if f.kind == 'counter':
+                        lines.append(f.name + _labels(labels) + ' ' + _number(c.value))
+                        continue
+                    cumulative = 0
+                    for (bound, n) in zip(list(f.buckets) + [ '+Inf' ], c.counts):
+                        cumulative += n
+                        le = _number(bound) if bound != '+Inf' else bound
+                        lines.append(f.name + '_bucket' + _labels(labels + [ ('le', le) ]) + ' ' + str(cumulative))
+                    lines.append(f.name + '_sum' + _labels(labels) + ' ' + _number(c.sum))
+                    lines.append(f.name + '_count' + _labels(labels) + ' ' + str(c.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, percentiles=(50, 90, 99)):
+        ''' { name : [ { labels, count, sum, p50, ... } or { labels, value } ] } '''
+        d = {}
+        with self.lock:
+            for f in self.families:
+                rows = []
+                for (values, c) in sorted(f.children.items()):
+                    row = { 'labels' : dict(zip(f.labels, values)) }
+                    if f.kind == 'counter':
+                        row['value'] = c.value
+                    else:
+                        row['count'] = c.count
+                        row['sum'] = c.sum
+                        for p in percentiles:
+                            row['p' + str(p)] = c.percentile(p)
+                    rows.append(row)
+                d[f.name] = rows
+        return d
+
+    def reset(self):
+        with self.lock:
+            for f in self.families:
+                f.children = {}
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join([ k + '="' + _escape(v) + '"' for (k, v) in pairs ]) + '}'
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class QueryCounter(object):
+    ''' number of SQL queries run inside the with block, in .count '''
+    def __enter__(self):
+        self.saved = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.start = len(connection.queries)
+        self.count = 0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.count = len(connection.queries) - self.start
+        connection.use_debug_cursor = self.saved
+        # DEBUG 가 아니면 남겨둘 이유가 없다.
+        if not connection.queries_logged:
+            del connection.queries[self.start:]
+        return False
+
+metrics = Registry()
+
+ACTION_SECONDS = metrics.histogram('aor_action_seconds',
+        'Wall time of GameState.action.', ('state', 'action'))
+ACTIONS = metrics.counter('aor_actions_total',
+        'Applied logs by result (confirmed, failed, or error for a handler exception).', ('state', 'action', 'result'))
+ACTION_QUERIES = metrics.counter('aor_action_queries_total',
+        'SQL queries (rule data) issued inside GameState.action.', ('state', 'action'))
+BATCH_DECODE_SECONDS = metrics.histogram('aor_batch_decode_seconds',
+        'Time to restore the GameInfo a batch starts from.')
+BATCH_ENCODE_SECONDS = metrics.histogram('aor_batch_encode_seconds',
+        'Time spent serializing GameInfo (patches, snapshots, current_info) in a batch.')
+BATCH_SIZE = metrics.histogram('aor_batch_size',
+        'Logs pending (lsn - applied_lsn) when a batch starts.',
+        buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+QUEUE_LAG_SECONDS = metrics.histogram('aor_queue_lag_seconds',
+        'Time from accepting a log to applying it.',
+        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host='127.0.0.1'):
+    server = HTTPServer((host, port), _Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+@worker_process_init.connect
+def _start_worker_server(**kwargs):
+    conf = getattr(settings, 'GAME_METRICS', {})
+    if conf.get('WORKER_PORT', None) != None:
+        # prefork pool 의 process 마다 port 가 하나씩 필요하다.
+        index = getattr(current_process(), 'index', 0) or 0
+        start_http_server(conf['WORKER_PORT'] + index, conf.get('HOST', '127.0.0.1'))
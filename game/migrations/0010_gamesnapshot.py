@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_gamelog_msg'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('lsn', models.SmallIntegerField(verbose_name=b'log sequence number')),
+                ('timestamp', models.DateTimeField(auto_now_add=True, verbose_name=b'timestamp')),
+                ('info', models.TextField()),
+                ('game', models.ForeignKey(to='game.Game')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gamesnapshot',
+            unique_together=set([('game', 'lsn')]),
+        ),
+    ]
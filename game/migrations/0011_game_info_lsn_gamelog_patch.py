@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F
+
+
+def set_info_lsn(apps, schema_editor):
+    # existing current_info always reflects applied_lsn
+    Game = apps.get_model('game', 'Game')
+    Game.objects.update(info_lsn=F('applied_lsn'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_gamesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='info_lsn',
+            field=models.SmallIntegerField(default=0, verbose_name=b'log sequence number of current_info'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='gamelog',
+            name='patch',
+            field=models.TextField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(set_info_lsn),
+    ]
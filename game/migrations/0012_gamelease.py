@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_game_info_lsn_gamelog_patch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameLease',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('owner', models.CharField(max_length=32, null=True, blank=True)),
+                ('expires', models.DateTimeField(null=True, blank=True)),
+                ('game', models.OneToOneField(to='game.Game')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
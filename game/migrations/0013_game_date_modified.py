@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_gamelease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='date_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True, verbose_name=b'datetime modified'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_game_index_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='generation',
+            field=models.IntegerField(default=0, verbose_name=b'rollback count'),
+            preserve_default=True,
+        ),
+    ]
@@ -1,14 +1,27 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
 
 from celery.utils.log import get_task_logger
 
 import json
 import random
+import zlib
+import base64
+import datetime
+import copy
+import hashlib
+import marshal
+import threading
+import time
+from operator import attrgetter
 
 from player.models import Player
-from rule.models import Edition, HistoryCard, EventCard, LeaderCard, CommodityCard, Province, Commodity, Water
+from game.patch import diff, apply_patch
+from rule.models import Edition, Advance, Province
 from rule.models import AREA_FAR_EAST, AREA_NEW_WORLD, AREA_VI, AREA_I, AREA_II, AREA_III
+from rule.catalog import get_catalog
 
 class GetOrNoneManager(models.Manager):
     """Adds get_or_none method to objects
@@ -35,17 +48,34 @@ class Game(models.Model):
     date_created = models.DateTimeField('datetime created', auto_now_add=True)
     date_started = models.DateTimeField('datetime started', null=True, blank=True)
     date_ended = models.DateTimeField('datetime ended', null=True, blank=True)
+    date_modified = models.DateTimeField('datetime modified', auto_now=True)
     status = models.CharField(max_length=1, choices=STATUS, default=WAITING)
     players = models.ManyToManyField(Player, null=True, blank=True)
     initial_info = models.TextField(null=True, blank=True)
     current_info = models.TextField(null=True, blank=True)
     last_lsn = models.SmallIntegerField('last log sequence number submitted', default=0)
     applied_lsn = models.SmallIntegerField('last log sequence number applied', default=0)
+    info_lsn = models.SmallIntegerField('log sequence number of current_info', default=0)
+    # rollback 마다 1 씩 늘린다. lsn 이 같아도 generation 이 다르면 다른 상태이다.
+    generation = models.IntegerField('rollback count', default=0)
     num_players = models.SmallIntegerField()
     edition = models.ForeignKey(Edition)
 
     objects = GetOrNoneManager()
 
+    class Meta:
+        # game list filters
+        index_together = (
+            ("status", "id"),
+            ("edition", "status", "id"),
+        )
+
+    # current_info is rewritten once every FOLD_INTERVAL applied logs;
+    # in between, the patches stored in GameLog are folded on read.
+    FOLD_INTERVAL = 10
+    # get_info_since() gives up on a since_lsn older than this many logs
+    DIFF_MAX_LOGS = 60
+
     def __unicode__(self):
         return self.hashkey
 
@@ -67,7 +97,145 @@ class Game(models.Model):
         return d
 
     def set_current_info(self, info):
-        self.current_info = json.dumps(info, cls=GameInfoEncoder)
+        ''' info must be the state as of applied_lsn '''
+        self.current_info = GameInfoCodec.encode(info)
+        self.info_lsn = self.applied_lsn
+
+    def get_current_info(self):
+        ''' GameInfo as of applied_lsn '''
+        return self.restore_current_info()[0]
+
+    def restore_current_info(self):
+        ''' (GameInfo as of applied_lsn, replayed)
+
+        replayed is True if the patches after info_lsn were written with another schema
+        version, so that the logs themselves had to be applied again.
+        '''
+        info = GameInfoCodec.decode(self.current_info)
+        if self.info_lsn < self.applied_lsn:
+            patches = self.get_patches(self.info_lsn, self.applied_lsn)
+            if patches == None:
+                return (self.replay_logs(info, self.info_lsn, self.applied_lsn), True)
+            if patches:
+                d = info.to_dict()
+                for (lsn, ops) in patches:
+                    d = apply_patch(d, ops)
+                info = GameInfo.from_dict(d)
+        return (info, False)
+
+    def get_patches(self, from_lsn, to_lsn):
+        ''' [ (lsn, ops), ... ] of the logs in (from_lsn, to_lsn] which changed the state
+
+        None if any of them was written with another GameInfoCodec schema version.
+        '''
+        logs = GameLog.objects                                  \
+                .filter(game=self, lsn__gt=from_lsn, lsn__lte=to_lsn)  \
+                .exclude(patch=None)                            \
+                .order_by('lsn')                                \
+                .values_list('lsn', 'patch')
+        patches = []
+        for (lsn, patch) in logs:
+            (version, ops) = GameLog.parse_patch(patch)
+            if version != GameInfoCodec.VERSION:
+                return None
+            patches.append( (lsn, ops) )
+        return patches
+
+    def replay_logs(self, info, from_lsn, to_lsn):
+        ''' info (the state as of from_lsn) with the logs in (from_lsn, to_lsn] applied again
+
+        As process_action(replay=True) does, a failed log is applied too, since it may
+        have changed info partially, a log whose handler raised anything else is skipped,
+        and the actions the logs queued are not queued again.
+        '''
+        logs = GameLog.objects                                  \
+                .filter(game=self, lsn__gt=from_lsn, lsn__lte=to_lsn)  \
+                .select_related('player')                       \
+                .order_by('lsn')
+        for l in logs:
+            user_id = l.player.user_id if l.player != None else None
+            saved = info.copy()
+            state = GameState.getInstance(info)
+            try:
+                action_dict = l.get_log_as_dict()
+                if not isinstance(action_dict, dict) or 'action' not in action_dict:
+                    raise Action.InvalidParameter("an action must be an object with 'action'")
+                state.action(action_dict['action'], user_id=user_id, params=action_dict)
+                info = state.info
+            except (GameState.NotSupportedAction,
+                    GameState.InvalidAction,
+                    Action.InvalidParameter,
+                    Action.WarNotResolved):
+                info = state.info
+            except Exception:
+                # process_action 도 이 log 가 적용되기 전으로 되돌렸다.
+                info = saved
+        return info
+
+    def get_info_since(self, since_lsn):
+        ''' (GameInfo as of since_lsn, GameInfo as of applied_lsn)
+
+        Returns None if since_lsn can not be restored cheaply, that is, when it is
+        too old, in the future, or the stored patches do not reproduce current_info.
+        '''
+        if since_lsn > self.applied_lsn or self.applied_lsn - since_lsn > Game.DIFF_MAX_LOGS:
+            return None
+
+        if self.info_lsn <= since_lsn:
+            base_lsn = self.info_lsn
+            d = GameInfoCodec.decode(self.current_info).to_dict()
+            expected = None
+        else:
+            s = self.get_nearest_snapshot(since_lsn)
+            if s != None:
+                base_lsn = s.lsn
+                d = GameInfoCodec.decode(s.info).to_dict()
+            elif self.initial_info != None:
+                base_lsn = 0
+                d = self.get_initial_info().to_dict()
+            else:
+                return None
+            # 오래된 log 에는 patch 가 없을 수 있으므로 current_info 와 맞는지 확인한다.
+            expected = self.get_current_info().to_dict()
+
+        patches = self.get_patches(base_lsn, self.applied_lsn)
+        if patches == None:
+            return None
+        old = None
+        for (lsn, ops) in patches:
+            if old == None and lsn > since_lsn:
+                old = copy.deepcopy(d)
+            d = apply_patch(d, ops)
+        if old == None:
+            old = copy.deepcopy(d)
+
+        if expected != None and expected != d:
+            return None
+        return (GameInfo.from_dict(old), GameInfo.from_dict(d))
+
+    def set_initial_info(self, info):
+        self.initial_info = GameInfoCodec.encode(info)
+
+    def get_initial_info(self):
+        return GameInfoCodec.decode(self.initial_info)
+
+    def take_snapshot(self, lsn, info):
+        ''' store info, the state right after log 'lsn' was applied '''
+        s = GameSnapshot(
+                game=self,
+                lsn=lsn,
+                info=GameInfoCodec.encode(info),
+            )
+        s.save()
+        return s
+
+    def get_last_snapshot_lsn(self):
+        s = GameSnapshot.objects.filter(game=self).order_by('-lsn').first()
+        return s.lsn if s != None else 0
+
+    def get_nearest_snapshot(self, lsn):
+        ''' the latest snapshot at or below lsn, or None '''
+        return GameSnapshot.objects.filter(game=self, lsn__lte=lsn).order_by('-lsn').first()
 
     class UnableToDelete(Exception):
         def __init__(self, message):
@@ -93,6 +261,12 @@ class Game(models.Model):
         def __unicode__(self):
             return repr(self.message)
 
+    class UnableToRollback(Exception):
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
+
 class GameLog(models.Model):
     ACCEPTED = 'A'
     CONFIRMED = 'C'
@@ -109,6 +283,7 @@ class GameLog(models.Model):
     status = models.CharField(max_length=1, choices=STATUS, default=ACCEPTED)
     log = models.TextField()
     msg = models.TextField(null=True, blank=True)
+    patch = models.TextField(null=True, blank=True)
 
     def __unicode__(self):
         return str(self.game) + ': ' + str(self.lsn)
@@ -120,6 +295,31 @@ class GameLog(models.Model):
     def get_log_as_dict(self):
         return json.loads(self.log)
 
+    def set_patch(self, ops):
+        ''' ops: changes of GameInfo.to_dict() made by this log, see game.patch
+
+        The dict follows the GameInfo schema, so the schema version is stored in front:
+        str(GameInfoCodec.VERSION) + ':' + JSON of ops.
+        '''
+        if ops:
+            self.patch = str(GameInfoCodec.VERSION) + ':' + json.dumps(ops, separators=(',', ':'))
+        else:
+            self.patch = None
+
+    def get_patch(self):
+        ''' (schema version, ops) '''
+        return GameLog.parse_patch(self.patch) if self.patch != None else (GameInfoCodec.VERSION, [])
+
+    @staticmethod
+    def parse_patch(patch):
+        ''' (schema version, ops) of a stored patch '''
+        (version, ops) = patch.split(':', 1)
+        return (int(version), json.loads(ops))
+
+    def get_msg(self, user_id):
+        ''' messages of this log to user_id '''
+        return json.loads(self.msg).get(user_id, []) if self.msg != None else []
+
     def add_warning(self, user_id, msg):
         self._add_msg( user_id, msg={ 'type':'warning', 'msg':msg } )
 
@@ -130,7 +330,7 @@ class GameLog(models.Model):
         if user_id == None or user_id == 'all' or user_id == 'auto' :
             # send to all
             user_list = []
-            for p in self.game.players:
+            for p in self.game.players.all():
                 user_list.append(p.user_id)
         else :
             user_list = [ user_id ]
@@ -159,7 +359,131 @@ class GameLog(models.Model):
         def __unicode__(self):
             return repr(self.message)
 
+class GameSnapshot(models.Model):
+    ''' serialized GameInfo as of lsn, so that rollback/replay does not start from lsn 0 '''
+    # a snapshot is taken every INTERVAL applied logs, and at the start of every phase
+    INTERVAL = 20
+
+    game = models.ForeignKey('Game')
+    lsn = models.SmallIntegerField('log sequence number')
+    timestamp = models.DateTimeField('timestamp', auto_now_add=True)
+    info = models.TextField()
+
+    def __unicode__(self):
+        return str(self.game) + ': ' + str(self.lsn)
+
+    @staticmethod
+    def is_required(lsn, last_snapshot_lsn, action):
+        if lsn - last_snapshot_lsn >= GameSnapshot.INTERVAL :
+            return True
+        # PRE_PHASE 는 항상 phase 의 시작점이다.
+        return action == Action.PRE_PHASE
+
+    class Meta:
+        unique_together = (
+            ("game", "lsn"),
+        )
+
+class GameLease(models.Model):
+    ''' at most one process_action applies the logs of a game at a time '''
+    # seconds; a lease of a crashed worker is taken over after it expires
+    DURATION = 60
+    # seconds between the tries of wait()
+    WAIT_INTERVAL = 0.1
+
+    game = models.OneToOneField('Game')
+    owner = models.CharField(max_length=32, null=True, blank=True)
+    expires = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return str(self.game) + ': ' + str(self.owner)
+
+    @staticmethod
+    def acquire(game_id, owner):
+        ''' take or extend the lease; must be called outside of a transaction '''
+        now = timezone.now()
+        expires = now + datetime.timedelta(seconds=GameLease.DURATION)
+        leases = GameLease.objects                              \
+                    .filter(game__hashkey=game_id)              \
+                    .filter(Q(owner=None) | Q(owner=owner) | Q(expires__lt=now))
+        if leases.update(owner=owner, expires=expires) == 1:
+            return True
+        if GameLease.objects.filter(game__hashkey=game_id).exists():
+            return False
+
+        # 처음 적용하는 game 
+        try:
+            with transaction.atomic():
+                GameLease.objects.create(game=Game.objects.get(hashkey=game_id), owner=owner, expires=expires)
+            return True
+        except IntegrityError:
+            return False
+
+    @staticmethod
+    def wait(game_id, owner, timeout):
+        ''' acquire(), tried again until timeout seconds have passed; False if it never succeeded '''
+        deadline = time.time() + timeout
+        while GameLease.acquire(game_id, owner) == False:
+            if time.time() >= deadline:
+                return False
+            time.sleep(GameLease.WAIT_INTERVAL)
+        return True
+
+    @staticmethod
+    def release(game_id, owner):
+        GameLease.objects.filter(game__hashkey=game_id, owner=owner).update(owner=None, expires=None)
+
+class GameRandom(random.Random):
+    ''' random.Random whose randint() and shuffle() are written on top of getrandbits(),
+    so that the same seed gives the same draws in any process and Python version
+    '''
+    @staticmethod
+    def draw(seed, n):
+        ''' generator of the n-th random draw of a game '''
+        return GameRandom(int(hashlib.sha256(str(seed) + ':' + str(n)).hexdigest(), 16))
+
+    def randbelow(self, n):
+        k = n.bit_length()
+        r = self.getrandbits(k)
+        while r >= n:
+            r = self.getrandbits(k)
+        # getrandbits() 는 long 을 돌려준다.
+        return int(r)
+
+    def randint(self, a, b):
+        return a + self.randbelow(b - a + 1)
+
+    def shuffle(self, x):
+        for i in range(len(x) - 1, 0, -1):
+            j = self.randbelow(i + 1)
+            x[i], x[j] = x[j], x[i]
+
+def _fields(obj):
+    ''' { field : value } of a __slots__ object; values are not copied '''
+    return dict(zip(obj.__slots__, _values(obj)))
+
+def _values(obj):
+    ''' field values of a __slots__ object in __slots__ order '''
+    getter = _GETTERS.get(type(obj), None)
+    if getter == None:
+        getter = _GETTERS[type(obj)] = attrgetter(*type(obj).__slots__)
+    return getter(obj)
+
+# __slots__ 를 한 번에 읽는 attrgetter, class 별로 하나씩
+_GETTERS = {}
+
+def _from_fields(cls, d):
+    ''' cls instance with the fields of d; fields missing in d are None '''
+    obj = cls.__new__(cls)
+    for f in cls.__slots__:
+        setattr(obj, f, d.get(f, None))
+    return obj
+
 class HouseBiddingLog(object):
+    __slots__ = (
+        'user_id', 'house', 'bid', 'order', 'draw_cards', 'discard_card', 'dice_rolled',
+    )
+
     def __init__(self):
         self.user_id = None
         self.house = None
@@ -176,8 +500,20 @@ class HouseBiddingLog(object):
             if bid_in_progress == True:
                 self.bid = None
 
+    def to_dict(self):
+        return _fields(self)
+
+    @staticmethod
+    def from_dict(d):
+        return _from_fields(HouseBiddingLog, d)
+
 # house name
 class HouseTurnLog(object):
+    __slots__ = (
+        'turn', 'cash', 'tokens', 'card_income', 'card_damage', 'buy_card', 'ship_upgrade',
+        'buy_advance', 'card_stabilization', 'tax', 'play_order',
+    )
+
     def __init__(self, turn=0, cash=0):
         self.turn = turn
         self.cash = cash
@@ -206,12 +542,27 @@ class HouseTurnLog(object):
         self.card_stabilization = 0
         self.tax = 0
 
+    def to_dict(self):
+        return _fields(self)
+
+    @staticmethod
+    def from_dict(d):
+        return _from_fields(HouseTurnLog, d)
+
 class HouseInfo(object):
     SHIP_GALLEY = 'galley'
     SHIP_SEAWROTHY = 'seaworthy'
     SHIP_OCEANGOING = 'oceangoing'
 
-    def __init__(self, house_name=None, user_id=None, cash=40, hands=[]):
+    __slots__ = (
+        'user_id', 'house_name', 'misery', 'advances', 'hands', 'cash', 'dominance_marker',
+        'stock_tokens', 'expansion_tokens', 'ship_type', 'ship_capacity', 'turn_logs', 'chaos_out',
+    )
+
+    # house bidding 에서 입찰한 만큼 빠진다.
+    STARTING_CASH = 40
+
+    def __init__(self, house_name=None, user_id=None, cash=STARTING_CASH, hands=[]):
         self.user_id = user_id
         self.house_name = house_name
         self.misery = 0
@@ -237,6 +588,17 @@ class HouseInfo(object):
                 else :
                     l.mask(bid_in_progress)
 
+    def to_dict(self):
+        d = _fields(self)
+        d['turn_logs'] = [ l.to_dict() for l in self.turn_logs ]
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        h = _from_fields(HouseInfo, d)
+        h.turn_logs = [ HouseTurnLog.from_dict(l) for l in h.turn_logs ]
+        return h
+
     def prepare_new_turn(self, turn):
         self.stock_tokens += self.expansion_tokens
         self.expansion_tokens = 0
@@ -279,6 +641,16 @@ class GameInfo(object):
     SHUFFLE_TURN2 = 2
     SHUFFLE_NEXT_EPOCH = 3
 
+    # in the order of GameInfoCodec.SCHEMAS[GameInfoCodec.VERSION]['game']
+    __slots__ = (
+        'edition', 'game_id', 'num_players', 'houses', 'play_order', 'play_order_tie_break',
+        'house_bidding_log', 'epoch', 'turn', 'final_turn', 'state_stack', 'discard_stack', 'draw_stack',
+        'shortage', 'surplus', 'provinces', 'card_log', 'war', 'leader', 'renaissance_usage',
+        'enlightened_ruler', 'civil_war', 'papal_decree', 'armor', 'stirrups', 'longbow',
+        'gunpowder', 'crusades', 'mongol_armies', 'religious_strife', 'marker_removal',
+        'market', 'areas', 'holdings', 'seed', 'rng_counter',
+    )
+
     def __init__(self, game=None):
         self.edition = 'european' #None
         self.game_id = None
@@ -293,12 +665,16 @@ class GameInfo(object):
         self.epoch = 1
         self.turn = 1
         self.final_turn = False
-        self.state = GameState.AUTO + '.' + GameState.INITIALIZE
+        # [ [actor, state name, params], ... ] from the bottom; the last frame is the current state
+        self.state_stack = [ [ GameState.AUTO, GameState.INITIALIZE, None ] ]
         self.discard_stack = []
         self.draw_stack = []
         self.shortage = []
         self.surplus = []
         self.provinces = {}
+        self.market = {}    # province_name -> number of tokens on it
+        self.areas = {}     # area -> { 'tokens': n, 'markers': n, 'occupied': [province_name, ...] }
+        self.holdings = {}  # commodity -> { user_id: number of dominated provinces producing it }
         self.card_log = {}
         self.card_log['epoch_1'] = {}
         self.card_log['epoch_2'] = {}
@@ -322,6 +698,10 @@ class GameInfo(object):
         self.mongol_armies = False
         self.religious_strife = False
         self.marker_removal = {}
+        # 모든 random draw 는 (seed, rng_counter) 로 정해진다. see get_rng()
+        # JSON(JavaScript) 에서도 정확히 표현되도록 53 bit 를 넘지 않는다.
+        self.seed = random.SystemRandom().getrandbits(53)
+        self.rng_counter = 0
 
         if game != None: 
             if isinstance(game, Game) != True:
@@ -335,16 +715,99 @@ class GameInfo(object):
                 h.user_id = p.user_id
                 self.house_bidding_log.append(h)
 
+    @property
+    def catalog(self):
+        ''' rule data of this game's edition '''
+        return get_catalog(self.edition)
+
+    def to_dict(self):
+        ''' plain (json compatible) copy of this info, the form GameLog.patch is a diff of '''
+        d = _fields(self)
+        d['houses'] = dict([ (key, h.to_dict()) for (key, h) in self.houses.iteritems() ])
+        d['house_bidding_log'] = [ l.to_dict() for l in self.house_bidding_log ]
+        return marshal.loads(marshal.dumps(d))
+
+    def to_api_dict(self):
+        ''' to_dict() plus the dotted 'state' that API clients read; derived from state_stack, never stored '''
+        d = self.to_dict()
+        d['state'] = self.state
+        return d
+
+    def copy(self):
+        ''' independent copy, e.g. to try actions on and throw away
+
+        Below the __slots__ objects everything is plain data, which marshal copies
+        several times faster than copy.deepcopy() or a to_dict() / from_dict() round trip.
+        '''
+        d = _fields(self)
+        houses = {}
+        for (key, h) in self.houses.iteritems():
+            houses[key] = _fields(h)
+            houses[key]['turn_logs'] = [ _values(l) for l in h.turn_logs ]
+        d['houses'] = houses
+        d['house_bidding_log'] = [ _values(l) for l in self.house_bidding_log ]
+        d = marshal.loads(marshal.dumps(d))
+
+        unpack = GameInfoCodec._unpack
+        g = _from_fields(GameInfo, d)
+        for (key, value) in g.houses.iteritems():
+            h = g.houses[key] = _from_fields(HouseInfo, value)
+            h.turn_logs = [ unpack(HouseTurnLog, HouseTurnLog.__slots__, l) for l in h.turn_logs ]
+        g.house_bidding_log = [ unpack(HouseBiddingLog, HouseBiddingLog.__slots__, l) for l in g.house_bidding_log ]
+        return g
+
+    @staticmethod
+    def from_dict(d):
+        ''' GameInfo of a dict made by to_dict(); d's values are used, not copied '''
+        g = _from_fields(GameInfo, d)
+        g.house_bidding_log = [ HouseBiddingLog.from_dict(l) for l in g.house_bidding_log ]
+        g.houses = dict([ (key, HouseInfo.from_dict(value)) for (key, value) in g.houses.iteritems() ])
+
+        if 'state_stack' not in d:
+            # codec 이전의 GameInfoEncoder JSON 에는 market counters 가 없고 state 는 문자열이다.
+            g.rebuild_market()
+            g.state = d['state']
+        return g
+
     def mask(self, user_id):
         self.draw_stack = []
-        bid_in_progress = self.state == GameState.ALL + '.' + GameState.TOKEN_BIDDING
+        # seed 를 알면 앞으로 섞일 카드와 주사위를 모두 알 수 있다.
+        self.seed = None
+        bid_in_progress = self.state_stack == [ [ GameState.ALL, GameState.TOKEN_BIDDING, None ] ]
         for key in self.houses:
             self.houses[key].mask(user_id, self.turn, bid_in_progress)
 
-        bid_in_progress = self.state == GameState.ALL + '.' + GameState.HOUSE_BIDDING
+        bid_in_progress = self.state_stack == [ [ GameState.ALL, GameState.HOUSE_BIDDING, None ] ]
         for l in self.house_bidding_log:
             l.mask(user_id, bid_in_progress)
 
+    @property
+    def state(self):
+        ''' legacy view of state_stack, 'actor.name' of each frame from the top, joined with '.' '''
+        return '.'.join([ f[0] + '.' + f[1] for f in reversed(self.state_stack) ])
+
+    @state.setter
+    def state(self, s):
+        parts = s.split('.') if s else []
+        self.state_stack = [ [ parts[i], parts[i + 1], None ] for i in range(len(parts) - 2, -1, -2) ]
+
+    def get_state(self):
+        ''' (actor, name, params) of the current state, or (None, None, None) '''
+        if not self.state_stack:
+            return (None, None, None)
+        return tuple(self.state_stack[-1])
+
+    def set_state(self, actor, name, params=None):
+        ''' replace the whole stack with a single state '''
+        self.state_stack = [ [ actor, name, params ] ]
+
+    def push_state(self, actor, name, params=None):
+        ''' interrupt the current state; pop_state() returns to it '''
+        self.state_stack.append([ actor, name, params ])
+
+    def pop_state(self):
+        return self.state_stack.pop() if self.state_stack else None
+
     def getHouseInfo(self, key):
         try:
             return self.houses[key]
@@ -490,10 +953,19 @@ class GameInfo(object):
                     return self.play_order[i]
         return None
 
+    def get_rng(self):
+        ''' GameRandom of the next draw; every call is a new draw '''
+        if self.seed == None:
+            # seed 없이 저장된 info 는 manage.py migrate_game_info 가 seed 를 정해 다시 저장한다.
+            raise GameInfo.SeedMissing('game ' + str(self.game_id) + ' has no seed, run manage.py migrate_game_info')
+        rng = GameRandom.draw(self.seed, self.rng_counter)
+        self.rng_counter += 1
+        return rng
+
     def shuffle_cards(self, method, params):
+        ''' Logs written before the games had a seed carry the shuffled cards in params['random'] '''
         rand_dict = params['random'] if 'random' in params.keys() else {}
         cards = []
-        edition = Edition.objects.filter(name__exact=self.edition)
 
         if method == GameInfo.SHUFFLE_NEXT_EPOCH :
             self.epoch += 1
@@ -506,41 +978,21 @@ class GameInfo(object):
             cards = rand_dict['draw_stack']
         else :
             if method == GameInfo.SHUFFLE_INIT :
-                hcards = HistoryCard.objects                    \
-                            .filter(edition__exact=edition)     \
-                            .filter(epoch__exact=1)             \
-                            .filter(shuffle_later__exact=False)
-                for c in hcards:
-                    cards.append(c.short_name)
+                cards = self.catalog.get_history_cards(1, shuffle_later=False)
             elif method == GameInfo.SHUFFLE_TURN1 :
                 cards = self.discard_stack + self.draw_stack
                 if self.num_players in (3, 4) :
-                    hcards = HistoryCard.objects                    \
-                                .filter(edition__exact=edition)     \
-                                .filter(epoch__exact=1)             \
-                                .filter(shuffle_later__exact=True)
-                    for c in hcards:
-                        cards.append(c.short_name)
+                    cards += self.catalog.get_history_cards(1, shuffle_later=True)
             elif method == GameInfo.SHUFFLE_TURN2 :
                 if self.num_players in (5, 6) :
-                    hcards = HistoryCard.objects                    \
-                                .filter(edition__exact=edition)     \
-                                .filter(epoch__exact=1)             \
-                                .filter(shuffle_later__exact=True)
-                    for c in hcards:
-                        cards.append(c.short_name)
+                    cards += self.catalog.get_history_cards(1, shuffle_later=True)
             elif method == GameInfo.SHUFFLE_NEXT_EPOCH :
-                hcards = HistoryCard.objects                    \
-                            .filter(edition__exact=edition)     \
-                            .filter(epoch__exact=self.epoch)
-                for c in hcards:
-                    cards.append(c.short_name)
-            random.shuffle(cards)
+                cards = self.catalog.get_history_cards(self.epoch)
+            self.get_rng().shuffle(cards)
 
         self.draw_stack = cards
         if method != GameInfo.SHUFFLE_TURN2 :
             self.discard_stack = []
-        return list(self.draw_stack)
 
     def get_province(self, province_name):
         if province_name not in self.provinces:
@@ -549,21 +1001,15 @@ class GameInfo(object):
 
     def add_tokens(self, province_name, user_id, num_tokens, from_expansion=True, colored=False):
         p = self.get_province(province_name)
-        edition = Edition.objects.filter(name__exact=self.info.edition)
-        p_info = Province.objects.filter(edition=edition, short_name=province_name)
+        market_size = self.catalog.provinces[province_name].market_size
 
         if "color-marker" in p or "white-marker" in p : 
             raise GameInfo.ConflictOccurs( "Dominance marker exists" )
 
-        all_tokens = 0
-        for i in ("color-token", "white-token"):
-            if i in p:
-                for k in p[i]:
-                    all_tokens += p[i][k]
-        
-        if all_tokens + num_tokens > p_info.market_size :
+        all_tokens = self.market.get(province_name, 0)
+        if all_tokens + num_tokens > market_size :
             raise GameInfo.ConflictOccurs(  \
-                    "market: " + str(p_info.market_size) + ", " + \
+                    "market: " + str(market_size) + ", " + \
                     "current: " + str(all_tokens) + ", " + \
                     "new: " + str(num_tokens) )
 
@@ -579,23 +1025,26 @@ class GameInfo(object):
                 raise GameInfo.NotEnoughTokens( "You have only " + str(h.stock_tokens) + " tokens" )
             h.stock_tokens -= num_tokens
 
+        was_occupied = self.is_occupied(province_name)
+        if k not in p:
+            p[k] = {}
         if h.user_id not in p[k]:
             p[k][h.user_id] = 0
         p[k][h.user_id] += num_tokens
+        self._adjust_market(province_name, was_occupied, tokens=num_tokens)
 
     def remove_tokens(self, province_name):
         p = self.get_province(province_name)
-        if "color-token" in p:
-            for k in p["color-token"]:
-                h = getHouseInfo(k)
-                h.stock_tokens += p["color-token"][k]
-            del p["color-token"]
-
-        if "white-token" in p:
-            for k in p["white-token"]:
-                h = getHouseInfo(k)
-                h.stock_tokens += p["white-token"][k]
-            del p["white-token"]
+        was_occupied = self.is_occupied(province_name)
+        removed = 0
+        for i in ("color-token", "white-token"):
+            if i in p:
+                for k in p[i]:
+                    h = self.getHouseInfo(k)
+                    h.stock_tokens += p[i][k]
+                    removed += p[i][k]
+                del p[i]
+        self._adjust_market(province_name, was_occupied, tokens=-removed)
 
     def set_marker(self, province_name, user_id, colored=False):
         self.remove_marker(province_name)
@@ -608,21 +1057,126 @@ class GameInfo(object):
         if h.dominance_marker == 0 :
             raise GameInfo.NotEnoughDominanceMarker("No dominance marker left")
 
+        was_occupied = self.is_occupied(province_name)
         p[k] = h.user_id
         h.dominance_marker -= 1
+        self._adjust_market(province_name, was_occupied, markers=1)
+        if colored == True:
+            self._adjust_holdings(province_name, h.user_id, 1)
 
     def remove_marker(self, province_name):
         p = self.get_province(province_name)
+        was_occupied = self.is_occupied(province_name)
+        removed = 0
 
         if "color-marker" in p: 
             h = self.getHouseInfo(p["color-marker"])
             h.dominance_marker += 1
             del p["color-marker"]
+            removed += 1
+            self._adjust_holdings(province_name, h.user_id, -1)
 
         if "white-marker" in p:
             h = self.getHouseInfo(p["white-marker"])
             h.dominance_marker += 1
             del p["white-marker"]
+            removed += 1
+
+        self._adjust_market(province_name, was_occupied, markers=-removed)
+
+    def is_occupied(self, province_name):
+        ''' whether province_name has any token or dominance marker '''
+        p = self.provinces[province_name]
+        return self.market.get(province_name, 0) > 0 or "color-marker" in p or "white-marker" in p
+
+    def get_occupied_provinces(self, area):
+        ''' provinces of area with tokens or a marker, in the order of catalog.get_provinces_in_area() '''
+        if area not in self.areas:
+            return []
+        return list(self.areas[area]['occupied'])
+
+    def _adjust_market(self, province_name, was_occupied, tokens=0, markers=0):
+        ''' reflect a change of tokens / markers on province_name in market and areas '''
+        if tokens == 0 and markers == 0:
+            return
+        if tokens != 0:
+            n = self.market.get(province_name, 0) + tokens
+            if n == 0:
+                del self.market[province_name]
+            else:
+                self.market[province_name] = n
+
+        rule = self.catalog.provinces[province_name]
+        if rule.area not in self.areas:
+            self.areas[rule.area] = { 'tokens': 0, 'markers': 0, 'occupied': [] }
+        a = self.areas[rule.area]
+        a['tokens'] += tokens
+        a['markers'] += markers
+
+        occupied = self.is_occupied(province_name)
+        if occupied and not was_occupied:
+            provinces = self.catalog.provinces
+            a['occupied'].append(province_name)
+            a['occupied'].sort(key=lambda x: (provinces[x].market_size, x))
+        elif was_occupied and not occupied:
+            a['occupied'].remove(province_name)
+            if not a['occupied']:
+                del self.areas[rule.area]
+
+    def _adjust_holdings(self, province_name, user_id, n):
+        ''' user_id gained (n > 0) or lost the color marker on province_name '''
+        for c in self.catalog.provinces[province_name].commodities:
+            if c not in self.holdings:
+                self.holdings[c] = {}
+            count = self.holdings[c].get(user_id, 0) + n
+            if count == 0:
+                del self.holdings[c][user_id]
+                if not self.holdings[c]:
+                    del self.holdings[c]
+            else:
+                self.holdings[c][user_id] = count
+
+    def get_holdings(self, commodity_name):
+        ''' { user_id: number of dominated provinces producing commodity_name } '''
+        return dict(self.holdings.get(commodity_name, {}))
+
+    def get_market_report(self):
+        ''' commodity -> unit price and each house's holding and income if the card were played now '''
+        report = {}
+        for c in self.catalog.commodities.values():
+            houses = {}
+            for key in self.houses:
+                n = self.holdings.get(c.short_name, {}).get(key, 0)
+                houses[key] = { 'provinces': n, 'income': n * n * c.unit_price }
+            report[c.short_name] = { 'unit_price': c.unit_price, 'houses': houses }
+        return report
+
+    def rebuild_market(self):
+        ''' recompute market, areas and holdings from provinces '''
+        self.market = {}
+        self.areas = {}
+        self.holdings = {}
+        for province_name in sorted(self.provinces.keys()):
+            p = self.provinces[province_name]
+            tokens = 0
+            for i in ("color-token", "white-token"):
+                if i in p:
+                    tokens += sum(p[i].values())
+            markers = len([k for k in ("color-marker", "white-marker") if k in p])
+            if tokens > 0 or markers > 0:
+                self._adjust_market(province_name, False, tokens=tokens, markers=markers)
+            if "color-marker" in p:
+                self._adjust_holdings(province_name, p["color-marker"], 1)
+
+    def check_invariants(self):
+        ''' raises GameInfo.InvariantViolated if the market counters do not match provinces '''
+        counters = { 'market': self.market, 'areas': self.areas, 'holdings': self.holdings }
+        self.rebuild_market()
+        expected = { 'market': self.market, 'areas': self.areas, 'holdings': self.holdings }
+        (self.market, self.areas, self.holdings) = (counters['market'], counters['areas'], counters['holdings'])
+        if counters != expected:
+            raise GameInfo.InvariantViolated(
+                    "market counters out of sync: " + json.dumps(counters) + ", expected " + json.dumps(expected) )
 
     def add_marker_removal(self, province_name):
         p = self.get_province(province_name)
@@ -633,7 +1187,7 @@ class GameInfo(object):
                 self.marker_removal[h.user_id] = []
             self.marker_removal[h.user_id].append(province_name)
         else:
-            raise MarkerNotFound("No dominance marker found on '" + province_name + "'")
+            raise GameInfo.MarkerNotFound("No dominance marker found on '" + province_name + "'")
 
     def resolve_marker_removal(self):
         for n in self.info.marker_removal:
@@ -646,7 +1200,7 @@ class GameInfo(object):
 
         player = get_next_player_for_marker_removal()
         if player != None:
-            self.info.state = player + '.' + GameInfo.REMOVE_MARKER + '.' + self.info.state
+            self.push_state(player, GameState.REMOVE_MARKER)
 
     def get_next_player_for_marker_removal(self):
         if self.info.marker_removal:
@@ -666,21 +1220,25 @@ class GameInfo(object):
         return False
 
     def get_accessible_provinces(self, include_overland_east=True, include_far_east=True, include_new_world=True):
-        edition = Edition.objects.filter(name=self.edition)
-        provinces = Province.objects.all()
+        ''' short names of the provinces in play '''
+        excluded = set()
         if self.num_players < 6 :
-            provinces = provinces.exclude(area=AREA_I)
+            excluded.add(AREA_I)
         if self.num_players < 5 :
-            provinces = provinces.exclude(area=AREA_II)
+            excluded.add(AREA_II)
         if self.num_players < 4 :
-            provinces = provinces.exclude(area=AREA_III)
+            excluded.add(AREA_III)
         if include_overland_east == False :
-            provinces = provinces.exclude(area=AREA_VI)
+            excluded.add(AREA_VI)
         if include_far_east == False :
-            provinces = provinces.exclude(area=AREA_FAR_EAST)
+            excluded.add(AREA_FAR_EAST)
         if include_new_world == False :
-            provinces = provinces.exclude(area=AREA_NEW_WORLD)
+            excluded.add(AREA_NEW_WORLD)
 
+        provinces = []
+        for key, p in self.catalog.provinces.iteritems():
+            if p.area not in excluded:
+                provinces.append(key)
         return provinces
 
     class ProvinceNotFound(Exception):
@@ -719,46 +1277,151 @@ class GameInfo(object):
         def __unicode__(self):
             return repr(self.message)
 
+    class InvariantViolated(Exception):
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
+
+    class SeedMissing(Exception):
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
+
 class GameInfoEncoder(json.JSONEncoder):
+    ''' API responses; GameInfo gets the derived 'state' as in to_api_dict() '''
     def default(self, obj):
         if isinstance(obj, GameInfo):
-            return obj.__dict__
-        if isinstance(obj, HouseInfo):
-            return obj.__dict__
-        if isinstance(obj, HouseTurnLog):
-            return obj.__dict__
-        if isinstance(obj, HouseBiddingLog):
-            return obj.__dict__
+            d = _fields(obj)
+            # API 와 UI 는 아직 문자열 state 를 읽는다. state_stack 에서 만들 뿐 저장하지는 않는다.
+            d['state'] = obj.state
+            return d
+        if isinstance(obj, (HouseInfo, HouseTurnLog, HouseBiddingLog)):
+            return _fields(obj)
         return json.JSONEncoder.default(self, obj)
 
 class GameInfoDecoder(json.JSONDecoder):
     def decode(self, s):
         d = json.JSONDecoder.decode(self, s)
-        g = GameInfo()
-        g.__dict__ = d
+        return GameInfo.from_dict(d)
+
+class GameInfoCodec(object):
+    ''' compact, schema-versioned storage format of GameInfo
+
+    Stored text is PREFIX + version + (COMPRESSED | PLAIN) + ':' + payload, where the payload
+    is minified JSON of the objects as positional lists in the field order of SCHEMAS[version],
+    zlib-compressed and base64-encoded when COMPRESSED.
+    Text which starts with '{' is the GameInfoEncoder JSON that games were stored in before,
+    and is still readable; see migrate_game_info.
+    '''
+    PREFIX = 'AOR'
+    COMPRESSED = 'z'
+    PLAIN = 'j'
+
+    VERSION = 1
+    COMPRESS = True
+
+    # 새 version 을 추가할 때는 예전 schema 를 고치지 말고 그대로 둔다.
+    SCHEMAS = {
+        1 : {
+            'game' : (
+                'edition', 'game_id', 'num_players', 'houses', 'play_order', 'play_order_tie_break',
+                'house_bidding_log', 'epoch', 'turn', 'final_turn', 'state_stack', 'discard_stack', 'draw_stack',
+                'shortage', 'surplus', 'provinces', 'card_log', 'war', 'leader', 'renaissance_usage',
+                'enlightened_ruler', 'civil_war', 'papal_decree', 'armor', 'stirrups', 'longbow',
+                'gunpowder', 'crusades', 'mongol_armies', 'religious_strife', 'marker_removal',
+                'market', 'areas', 'holdings', 'seed', 'rng_counter',
+            ),
+            'house' : (
+                'user_id', 'house_name', 'misery', 'advances', 'hands', 'cash', 'dominance_marker',
+                'stock_tokens', 'expansion_tokens', 'ship_type', 'ship_capacity', 'turn_logs', 'chaos_out',
+            ),
+            'turn_log' : (
+                'turn', 'cash', 'tokens', 'card_income', 'card_damage', 'buy_card', 'ship_upgrade',
+                'buy_advance', 'card_stabilization', 'tax', 'play_order',
+            ),
+            'bidding_log' : (
+                'user_id', 'house', 'bid', 'order', 'draw_cards', 'discard_card', 'dice_rolled',
+            ),
+        },
+    }
 
-        house_bidding_log = []
-        for l in g.house_bidding_log:
-            hbl = HouseBiddingLog()
-            hbl.__dict__ = l
-            house_bidding_log.append(hbl)
-        g.house_bidding_log = house_bidding_log
+    @staticmethod
+    def _pack(obj, fields, custom={}):
+        ''' field values in schema order '''
+        if fields == obj.__slots__:
+            values = list(_values(obj))
+        else:
+            values = [ getattr(obj, f) for f in fields ]
+        for (i, f) in enumerate(fields):
+            if f in custom:
+                values[i] = custom[f](values[i])
+        return values
 
-        houses = {}
-        for key, value in g.houses.iteritems():
-            h = HouseInfo()
-            h.__dict__ = value
-            turn_logs = []
-            for l in h.turn_logs:
-                tl = HouseTurnLog()
-                tl.__dict__ = l
-                turn_logs.append(tl)
-            h.turn_logs = turn_logs
+    @staticmethod
+    def _unpack(cls, fields, values):
+        obj = cls.__new__(cls)
+        map(setattr, [ obj ] * len(fields), fields, values)
+        return obj
 
+    @staticmethod
+    def encode(info, compress=None):
+        if compress == None:
+            compress = GameInfoCodec.COMPRESS
+        schema = GameInfoCodec.SCHEMAS[GameInfoCodec.VERSION]
+        pack = GameInfoCodec._pack
+
+        def pack_house(h):
+            return pack(h, schema['house'], {
+                'turn_logs' : lambda v: [ pack(l, schema['turn_log']) for l in v ],
+            })
+
+        body = pack(info, schema['game'], {
+            'houses' : lambda v: dict([ (k, pack_house(h)) for k, h in v.iteritems() ]),
+            'house_bidding_log' : lambda v: [ pack(l, schema['bidding_log']) for l in v ],
+        })
+
+        payload = json.dumps(body, separators=(',', ':'))
+        if compress == True:
+            payload = base64.b64encode(zlib.compress(payload))
+            flag = GameInfoCodec.COMPRESSED
+        else:
+            flag = GameInfoCodec.PLAIN
+        return GameInfoCodec.PREFIX + str(GameInfoCodec.VERSION) + flag + ':' + payload
+
+    @staticmethod
+    def decode(s):
+        if s.startswith('{'):
+            # codec 이전의 GameInfoEncoder 형식
+            return json.loads(s, cls=GameInfoDecoder)
+        if not s.startswith(GameInfoCodec.PREFIX):
+            raise GameInfoCodec.UnknownFormat("GameInfo must start with '" + GameInfoCodec.PREFIX + "' or '{'")
+
+        (header, payload) = s.split(':', 1)
+        version = int(header[len(GameInfoCodec.PREFIX):-1])
+        if version not in GameInfoCodec.SCHEMAS:
+            raise GameInfoCodec.UnknownFormat("Unknown GameInfo schema version " + str(version))
+        schema = GameInfoCodec.SCHEMAS[version]
+        unpack = GameInfoCodec._unpack
+        if header[-1] == GameInfoCodec.COMPRESSED:
+            payload = zlib.decompress(base64.b64decode(payload))
+
+        info = unpack(GameInfo, schema['game'], json.loads(payload))
+        info.house_bidding_log = [ unpack(HouseBiddingLog, schema['bidding_log'], l) for l in info.house_bidding_log ]
+        houses = {}
+        for key, value in info.houses.iteritems():
+            h = unpack(HouseInfo, schema['house'], value)
+            h.turn_logs = [ unpack(HouseTurnLog, schema['turn_log'], l) for l in h.turn_logs ]
             houses[key] = h
-        g.houses = houses
+        info.houses = houses
+        return info
 
-        return g
+    class UnknownFormat(Exception):
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
 
 class Action(object):
     PRE_PHASE       =   'pre_phase'
@@ -772,12 +1435,25 @@ class Action(object):
     PASS            =   'pass'
     RESOLVE_WAR     =   'resolve_war'
 
+    @staticmethod
+    def check_shape(action):
+        ''' raise Action.Malformed unless action is an object with a string 'action' '''
+        if not isinstance(action, dict) or not isinstance(action.get('action', None), basestring):
+            raise Action.Malformed("an action must be an object with an 'action' string")
+
     class InvalidParameter(Exception):
         def __init__(self, message):
             self.message = message
         def __unicode__(self):
             return repr(self.message)
 
+    class Malformed(Exception):
+        ''' not an action at all, e.g. not an object or without 'action'; see check_shape() '''
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
+
     class WarNotResolved(Exception):
         def __init__(self, message, actions=[]):
             self.message = message
@@ -786,11 +1462,15 @@ class Action(object):
             return repr(self.message)
 
 def split_state_string(state):
+    ''' (actor, name, rest) of a legacy dotted state string '''
     state_part = state.split('.', 2)
     if len(state_part) == 2:
         state_part.append(None)
     return state_part
 
+# GameState.getInstance() 가 재사용하는 handler, thread 마다 class 별로 하나씩
+_handlers = threading.local()
+
 class GameState(object):
     ALL             =   'all'
     AUTO            =   'auto'
@@ -811,39 +1491,37 @@ class GameState(object):
     REMOVE_SURPLUS_SHORTAGE =   'remove_shortage_surplus'
     PURCHASE                =   'purchase'
 
-    STATE_MAPS = {
-        INITIALIZE              : 'InitState',
-        HOUSE_BIDDING           : 'HouseBiddingState',
-        CHOOSE_CAPITAL          : 'ChooseCapitalState',
-        TOKEN_BIDDING           : 'TokenBiddingState',
-        TIE_BREAKING            : 'TieBreakingState',
-        DRAW_CARD               : 'DrawCardsState',
-        BUY_CARD                : 'BuyCardsState',
-        PLAY_CARD               : 'PlayCardsState',
-        POST_WAR                : 'PostWarState',
-        RESOLVE_CIVIL_WAR       : 'ResolveCivilWarState',
-        REMOVE_MARKER           : 'RemoveMarkerState',
-        APPLY_RENAISSANCE       : 'ApplyRenaissanceState',
-        APPLY_WATERMILL         : 'ApplyWatermillState',
-        REMOVE_SURPLUS_SHORTAGE : 'RemoveSurplusShortageState',
-        PURCHASE                : 'PurchaseState',
-    }
+    # state name -> GameState subclass, filled in after the subclasses are defined
+    HANDLERS = {}
 
-    def __init__(self, info, actor='all', depends_on=None):
+    def __init__(self, info, actor='all'):
         self.info = info
         self.actor = actor
-        self.depends_on = depends_on
 
     def action(self, a, user_id=None, params={}):
         raise GameState.NotSupportedAction(
-                    type(self).__name__ + '( ' + str(self.actor) + ', ' + str(self.depends_on) 
+                    type(self).__name__ + '( ' + str(self.actor) + ', ' + self.info.state
                     + ' ) cannot handle ' + a) 
 
     @staticmethod
     def getInstance(info):
-        (actor, name, remains) = split_state_string( info.state )
-        n = GameState.STATE_MAPS[name] if name in GameState.STATE_MAPS.keys() else None
-        return globals()[n](info, actor=actor, depends_on=remains) if n in globals().keys() else None
+        ''' handler of the current state of info, or None
+
+        Handlers hold no state of their own, so one instance per class (and thread)
+        is reused and only rebound to info and the actor of the top frame.
+        '''
+        (actor, name, params) = info.get_state()
+        cls = GameState.HANDLERS.get(name, None)
+        if cls == None:
+            return None
+        handlers = _handlers.__dict__
+        state = handlers.get(cls, None)
+        if state == None:
+            state = handlers[cls] = cls(info, actor=actor)
+        else:
+            state.info = info
+            state.actor = actor
+        return state
 
     class NotSupportedAction(Exception):
         def __init__(self, message):
@@ -861,9 +1539,8 @@ class InitState(GameState):
     def action(self, a, user_id=None, params={}):
         if a == Action.DEAL_CARDS :
             # 초기화 상태이니, 무조건 카드를 섞고, 배분한다.
-            # log replay를 하는 경우에는 과거에 섞은것과 동일하게 섞는다.
-            rand_dict = {}
-            rand_dict['draw_stack'] = self.info.shuffle_cards(GameInfo.SHUFFLE_INIT, params)
+            # log replay를 하는 경우에는 seed 가 같으므로 과거에 섞은것과 동일하게 섞인다.
+            self.info.shuffle_cards(GameInfo.SHUFFLE_INIT, params)
 
             response = {}
 
@@ -872,13 +1549,11 @@ class InitState(GameState):
                 h.draw_cards.append(self.info.draw_stack.pop())
                 h.draw_cards.append(self.info.draw_stack.pop())
 
-            edition = Edition.objects.filter(name__exact=self.info.edition)
             all_provinces = self.info.get_accessible_provinces()
             for p in all_provinces:
-                self.info.provinces[p.short_name] = { }
+                self.info.provinces[p] = { }
 
-            self.info.state = GameState.ALL + '.' + GameState.HOUSE_BIDDING
-            response['random'] = rand_dict
+            self.info.set_state(GameState.ALL, GameState.HOUSE_BIDDING)
 
             return response
         else:
@@ -917,14 +1592,14 @@ def cmp_play_order_after_tie_break(info):
         return diff
     return inner
 
-def roll_dice():
-    return random.randint(1, 6)
+def roll_dice(rng):
+    return rng.randint(1, 6)
 
-def roll_dices():
+def roll_dices(rng):
     return { 
-        "white": roll_dice(),
-        "black": roll_dice(),
-        "green": roll_dice(),
+        "white": roll_dice(rng),
+        "black": roll_dice(rng),
+        "green": roll_dice(rng),
     }
     
 class HouseBiddingState(GameState):
@@ -966,6 +1641,7 @@ class HouseBiddingState(GameState):
 
             self.info.house_bidding_log.sort(cmp=cmp_house_bid, reverse=True)
 
+            rng = self.info.get_rng() if tie_breaking else None
             while tie_breaking :
                 roll = {}
                 # 이미 sort 되어 있으므로, single-loop 로 가능하다.
@@ -975,17 +1651,13 @@ class HouseBiddingState(GameState):
                         roll[i+1] = True
                 if roll:
                     for i in roll.keys():
-                        self.info.house_bidding_log[i].dice_rolled.append(roll_dice())
+                        self.info.house_bidding_log[i].dice_rolled.append(roll_dice(rng))
                     self.info.house_bidding_log.sort(cmp=cmp_house_bid, reverse=True)
                 else:
                     tie_breaking = False
 
-            self.info.state = self.info.house_bidding_log[0].user_id + '.' + GameState.CHOOSE_CAPITAL
-
-            rand_dict = {}
-            for l in self.info.house_bidding_log:
-                rand_dict[l.user_id] = l.dice_rolled
-            return { 'random': rand_dict  }
+            self.info.set_state(self.info.house_bidding_log[0].user_id, GameState.CHOOSE_CAPITAL)
+            return {}
         else:
             return super(HouseBiddingState, self).action(a, params)
 
@@ -1025,7 +1697,7 @@ class ChooseCapitalState(GameState):
                     house_name=choice,
                     user_id=user_id,
                     hands = list(bidinfo.draw_cards),
-                    cash = 40 - bidinfo.bid,
+                    cash = HouseInfo.STARTING_CASH - bidinfo.bid,
             )
             self.info.houses[user_id] = h
             self.info.set_marker(choice, user_id, colored=True)
@@ -1040,10 +1712,10 @@ class ChooseCapitalState(GameState):
                     }
 
             if len(self.info.houses) < self.info.num_players:
-                self.info.state = self.info.house_bidding_log[len(self.info.houses)].user_id \
-                                    + '.' + GameState.CHOOSE_CAPITAL
+                self.info.set_state(self.info.house_bidding_log[len(self.info.houses)].user_id,
+                                    GameState.CHOOSE_CAPITAL)
             else:
-                self.info.state = GameState.ALL + '.' + GameState.TOKEN_BIDDING
+                self.info.set_state(GameState.ALL, GameState.TOKEN_BIDDING)
                 response['queue_action'] =  { 'action': Action.PRE_PHASE } 
                 self.info.epoch = 1
                 self.info.turn = 1
@@ -1073,7 +1745,7 @@ class TokenBiddingState(GameState):
                     h.expansion_tokens = h.stock_tokens
                 h.stock_tokens -= h.expansion_tokens
 
-            self.info.state = GameState.ALL + '.' + GameState.DRAW_CARD
+            self.info.set_state(GameState.ALL, GameState.DRAW_CARD)
             return { 'queue_action':  { 'action': Action.PRE_PHASE } }
         elif a == Action.BID :
             if user_id == None :
@@ -1121,8 +1793,8 @@ class TokenBiddingState(GameState):
                                 tie_break['resolve_order'].remove( tie_break['ties'][k][0] )
 
                         self.info.play_order_tie_break = tie_break
-                        self.info.state = tie_break['resolve_order'][0] + '.' + GameState.TIE_BREAKING \
-                                        + '.' + GameState.ALL + '.' + GameState.TOKEN_BIDDING
+                        self.info.set_state(GameState.ALL, GameState.TOKEN_BIDDING)
+                        self.info.push_state(tie_break['resolve_order'][0], GameState.TIE_BREAKING)
                         return {}
 
                     self.info.append_play_order( p_list[i] )
@@ -1166,8 +1838,8 @@ class TieBreakingState(GameState):
 
             if tie_break['resolve_order'] :
                 self.info.play_order_tie_break = tie_break
-                self.info.state = tie_break['resolve_order'][0] + '.' + GameState.TIE_BREAKING \
-                                + '.' + GameState.ALL + '.' + GameState.TOKEN_BIDDING
+                self.info.set_state(GameState.ALL, GameState.TOKEN_BIDDING)
+                self.info.push_state(tie_break['resolve_order'][0], GameState.TIE_BREAKING)
                 if len(possible_choice) == 1 :
                     response['queue_action'] = { 
                         'action': Action.CHOOSE, 
@@ -1176,7 +1848,7 @@ class TieBreakingState(GameState):
                         }
             else:
                 response['queue_action'] = { 'action': Action.DETERMINE_ORDER }
-                self.info.state = GameState.ALL + '.' + GameState.TOKEN_BIDDING
+                self.info.set_state(GameState.ALL, GameState.TOKEN_BIDDING)
 
             return response
         else:
@@ -1186,43 +1858,37 @@ class DrawCardsState(GameState):
     def action(self, a, user_id=None, params={}):
         if a == Action.PRE_PHASE :
             response = {}
-            rand_dict = {}
             if self.info.turn == 1 :
-                rand_dict['draw_stack'] = self.info.shuffle_cards(GameInfo.SHUFFLE_TURN1, params)
+                self.info.shuffle_cards(GameInfo.SHUFFLE_TURN1, params)
             elif self.info.turn == 2 and self.info.num_players in (5, 6) :
-                rand_dict['draw_stack'] = self.info.shuffle_cards(GameInfo.SHUFFLE_TURN2, params)
+                self.info.shuffle_cards(GameInfo.SHUFFLE_TURN2, params)
            
-            response['random'] = rand_dict
             self.info.reset_renaissance_usage()
-            next_state = ''
-        
-            next_renaissance_player = self.info.get_next_renaissance_player() 
-            if next_renaissance_player != None :
-                next_state += next_renaissance_player + '.' + GameState.APPLY_RENAISSANCE + '.'
-
-            if self.info.shortage or self.info.surplus : 
-                next_state += self.info.get_next_player() + '.' + GameState.REMOVE_SURPLUS_SHORTAGE + '.'
+            # 먼저 처리할 state 가 위에 오도록 쌓는다.
+            self.info.set_state(GameState.AUTO, GameState.DRAW_CARD)
 
             watermill_player = self.info.get_last_moving_watermill_player()
             if watermill_player != None:
-                next_state += watermill_player + '.' + GameState.APPLY_WATERMILL + '.'
-
-            next_state += GameState.AUTO + '.' + GameState.DRAW_CARD
+                self.info.push_state(watermill_player, GameState.APPLY_WATERMILL)
 
-            (actor, name, remains) = split_state_string( next_state )
+            if self.info.shortage or self.info.surplus : 
+                self.info.push_state(self.info.get_next_player(), GameState.REMOVE_SURPLUS_SHORTAGE)
+        
+            next_renaissance_player = self.info.get_next_renaissance_player() 
+            if next_renaissance_player != None :
+                self.info.push_state(next_renaissance_player, GameState.APPLY_RENAISSANCE)
 
+            (actor, name, params) = self.info.get_state()
             if actor == GameState.AUTO and name == GameState.DRAW_CARD:
                 response['queue_action'] = { 'action': Action.DEAL_CARDS }
-            self.info.state = next_state
 
             return response
 
         elif a == Action.POST_PHASE :
-            self.info.state = GameState.AUTO + '.' + GameState.BUY_CARD
+            self.info.set_state(GameState.AUTO, GameState.BUY_CARD)
             return { 'queue_action' :  { 'action': Action.PRE_PHASE } }
 
         elif a == Action.DEAL_CARDS :
-            rand_dict = {}
             response = {}
 
             for key in self.info.play_order:
@@ -1231,16 +1897,12 @@ class DrawCardsState(GameState):
                 h = self.info.getHouseInfo(key)
 
                 if not self.info.draw_stack :
-                    rand_dict['draw_stack'] = self.info.shuffle_cards(GameInfo.SHUFFLE_NEXT_EPOCH, params)
+                    self.info.shuffle_cards(GameInfo.SHUFFLE_NEXT_EPOCH, params)
                     if self.info.final_turn == True :
-                        del rand_dict['draw_stack']
                         break
 
                 h.hands.append(self.info.draw_stack.pop())
 
-            if rand_dict :
-                response['random'] = rand_dict
-
             response['queue_action'] = { 'action': Action.POST_PHASE }
 
             return response
@@ -1271,18 +1933,17 @@ class BuyCardsState(GameState):
             if buy_card_player == None :
                 response['queue_action'] = { 'action': Action.POST_PHASE }
             else :
-                next_state = buy_card_player + '.' + GameState.BUY_CARD
+                self.info.set_state(buy_card_player, GameState.BUY_CARD)
 
                 if self.info.get_next_buy_card_player( buy_card_player ) != None :
                     # 두 명 이상이 행동을 할 수 있으므로, renaissance 사용 확인이 필요하다.
                     next_renaissance_player = self.info.get_next_renaissance_player() 
                     if next_renaissance_player != None :
-                        next_state = next_renaissance_player + '.' + GameState.APPLY_RENAISSANCE + '.' + next_state
-                self.info.state = next_state
+                        self.info.push_state(next_renaissance_player, GameState.APPLY_RENAISSANCE)
 
             return response
         elif a == Action.POST_PHASE :
-            self.info.state = GameState.ALL + '.' + GameState.PLAY_CARD
+            self.info.set_state(GameState.ALL, GameState.PLAY_CARD)
             return { 'queue_action' :  { 'action': Action.PRE_PHASE } }
         return super(BuyCardsState, self).action(a, params)
 
@@ -1290,19 +1951,15 @@ class PlayCardsState(GameState):
     def action(self, a, user_id=None, params={}):
         if a == Action.PRE_PHASE :
             response = {}
-            next_state = ''
+            self.info.set_state(self.info.get_next_player(), GameState.PLAY_CARD)
 
             next_renaissance_player = self.info.get_next_renaissance_player() 
             if next_renaissance_player != None :
-                next_state += next_renaissance_player + '.' + GameState.APPLY_RENAISSANCE + '.'
-
-            next_state += self.info.get_next_player() + '.' + GameState.PLAY_CARD
-
-            self.info.state = next_state
+                self.info.push_state(next_renaissance_player, GameState.APPLY_RENAISSANCE)
 
             return response
         elif a == Action.POST_PHASE :
-            self.info.state = GameState.ALL + '.' + GameState.PURCHASE
+            self.info.set_state(GameState.ALL, GameState.PURCHASE)
             return { 'queue_action' :  { 'action': Action.PRE_PHASE } }
         elif a == Action.PASS:
             if user_id != self.actor :
@@ -1315,7 +1972,7 @@ class PlayCardsState(GameState):
             if next_player == None:
                 response['queue_action'] = { 'action': Action.POST_PHASE }
             else :
-                self.info.state = next_player + '.' + GameState.PLAY_CARD
+                self.info.set_state(next_player, GameState.PLAY_CARD)
             return response
         elif a == Action.PLAY_CARD:
             if 'card' not in params.keys() :
@@ -1357,13 +2014,15 @@ class PlayCardsState(GameState):
             # http://boardgamegeek.com/thread/514950/again-war-card
             # http://boardgamegeek.com/thread/299484/war-card
             response = {}
-            rand_dict = params['random'] if 'random' in params.keys() else {}
-
-            if 'attacker' not in rand_dict:
-                rand_dict['attacker'] = roll_dice()
+            # seed 가 생기기 전의 log 에는 굴린 주사위가 params['random'] 에 있다.
+            rand_dict = dict(params['random']) if 'random' in params.keys() else {}
 
-            if 'defender' not in rand_dict:
-                rand_dict['defender'] = roll_dice()
+            if 'attacker' not in rand_dict or 'defender' not in rand_dict:
+                rng = self.info.get_rng()
+                if 'attacker' not in rand_dict:
+                    rand_dict['attacker'] = roll_dice(rng)
+                if 'defender' not in rand_dict:
+                    rand_dict['defender'] = roll_dice(rng)
 
             mod = {}
             mod[self.info.war['attacker']] = rand_dict['attacker'] 
@@ -1449,9 +2108,8 @@ class PlayCardsState(GameState):
                             self.info.set_marker(p, self.info.war['winner'], colored=True)
                         self.info.reset_war_info()
                     else:
-                        self.info.state = self.info.war['loser'] + '.' + GameState.POST_WAR + '.' + self.info.state
+                        self.info.push_state(self.info.war['loser'], GameState.POST_WAR)
 
-            response['random'] = rand_dict
             return response
         return super(PlayCardsState, self).action(a, params)
 
@@ -1463,31 +2121,18 @@ class PlayCardsState(GameState):
 
     def play_commodity_card(self, card, params):
         response = {}
-        edition = Edition.objects.filter(name=self.info.edition)
-        commodity_card = CommodityCard.objects.get(edition=edition, short_name=card)
-        if ( len(commodity_card.commodities.all()) > 1 ) :
+        catalog = self.info.catalog
+        commodity_card = catalog.commodity_cards[card]
+        if ( len(commodity_card.commodities) > 1 ) :
             if 'choice' not in params.keys() :
-                raise Action.InvalidParameter("'" + str(commodity_card) + "' requires 'choice' parameter.")
-            choice = params['choice']
-
-            try:
-                if len(choice) == 2 :
-                    commodity = commodity_card.commodities.get(short_name=choice)
-                else:
-                    commodity = commodity_card.commodities.get(full_name=choice)
-            except (Commodity.DoesNotExist) as e:
-                raise Action.InvalidParameter("'choice' parameter must be either '" + str(commodity_card) + "'")
+                raise Action.InvalidParameter("'" + commodity_card.full_name + "' requires 'choice' parameter.")
+            commodity = catalog.get_commodity(params['choice'])
+            if commodity == None or commodity.short_name not in commodity_card.commodities :
+                raise Action.InvalidParameter("'choice' parameter must be either '" + commodity_card.full_name + "'")
         else :
-            commodity = commodity_card.commodities.all()[0]
-        provinces = Province.objects.filter(edition=edition, commodities=commodity)
+            commodity = catalog.commodities[list(commodity_card.commodities)[0]]
 
-        owners = {}
-        for p in provinces:
-            if p.short_name in self.info.provinces and "color-marker" in self.info.provinces[p.short_name] :
-                owner = self.info.provinces[p.short_name]["color-marker"]
-                if owner not in owners:
-                    owners[owner] = 0
-                owners[owner] += 1
+        owners = self.info.get_holdings(commodity.short_name)
 
         for key in owners:
             income = owners[key] * owners[key] * commodity.unit_price
@@ -1501,8 +2146,7 @@ class PlayCardsState(GameState):
 
     def play_leader_card(self, card, user_id):
         response = {}
-        edition = Edition.objects.filter(name=self.info.edition)
-        leader_card = LeaderCard.objects.get(edition=edition, short_name=card)
+        leader_card = self.info.catalog.leader_cards[card]
 
         h = self.info.getHouseInfo(user_id)
         l = self.info.getTurnLog(user_id)
@@ -1513,8 +2157,8 @@ class PlayCardsState(GameState):
             elif leader_card.short_name == 'L25_RY' and self.info.mongol_armies == True:
                 credit = leader_card.discount_on_event
 
-            for a in leader_card.advances.all():
-                if a.short_name in h.advances:
+            for a in leader_card.advances:
+                if a in h.advances:
                     l.card_income += income
                     h.cash += income
 
@@ -1568,19 +2212,16 @@ class PlayCardsState(GameState):
             if params['target'] not in playable_area:
                 raise Action.InvalidParameter("You cannot play 'Black Death' on Area " + params['target'] + ".")
 
-            edition = Edition.objects.filter(name=self.info.edition)
             # token 부터 회수하고, dominance marker를 token으로 교환한다. 
-            provinces = Province.objects                    \
-                            .filter(edition=edition)        \
-                            .filter(area=params['target'])  \
-                            .order_by('market_size')
+            # token 이나 marker 가 없는 province 는 볼 필요가 없다.
+            provinces = self.info.get_occupied_provinces(str(params['target']))
 
             self.info.clear_marker_removal()
             for p in provinces:
                 try: 
-                    self.info.add_marker_removal(p.short_name)
-                except MarkerNotFound as e:
-                    self.info.remove_tokens(p.short_name)
+                    self.info.add_marker_removal(p)
+                except GameInfo.MarkerNotFound as e:
+                    self.info.remove_tokens(p)
 
             self.info.resolve_marker_removal()
         elif card =='E14_C':
@@ -1597,7 +2238,7 @@ class PlayCardsState(GameState):
                 raise Action.InvalidParameter("You cannot play 'Civil War' on player '" + params['target'] + "'.")
 
             # 대상 플레이어가 토큰과 캐시 중 하나를 선택한 다음, 모든 값을 조정한다.
-            self.info.state = params['target'] + '.' + GameState.RESOLVE_CIVIL_WAR + '.' + self.info.state
+            self.info.push_state(params['target'], GameState.RESOLVE_CIVIL_WAR)
         elif card =='E15_cru':
             # Place one of your Colored Dominance Markers (circle) anywhere within Area VI 
             # and remove any other markers in that Province. Gain one Misery. 
@@ -1609,10 +2250,9 @@ class PlayCardsState(GameState):
             if 'target' not in params.keys() :
                 raise Action.InvalidParameter("'The Crusades' requires 'target' parameter.")
 
-            edition = Edition.objects.filter(name=self.info.edition)
-            province = Province.objects.get(edition=edition, short_name=params['target'])
+            province = self.info.catalog.provinces.get(params['target'], None)
 
-            if province.area != AREA_VI:
+            if province == None or province.area != AREA_VI:
                 raise Action.InvalidParameter("'target' parameter must be the short name of a Province in Area VI.")
 
             h = self.info.getHouseInfo(user_id)
@@ -1626,25 +2266,16 @@ class PlayCardsState(GameState):
         elif card =='E17_fam':
             # All players gain four spaces on the Misery Index minus one space for each Grain Province they dominate. 
             # Having [J] Improved Agriculture also reduces the penalty by one space.                                  
-            edition = Edition.objects.filter(name=self.info.edition)
-            commodity = Commodity.objects.get(edition=edition, full_name='Grain')
+            commodity = self.info.catalog.get_commodity('Grain')
 
-            provinces = Province.objects.filter(edition=edition, commodities=commodity)
-
-            grain_owners = {}
-            for p in provinces:
-                if "color-marker" in self.info.provinces[p.short_name] :
-                    grain_owner = self.info.provinces[p.short_name]["color-marker"]
-                    if grain_owner not in grain_owners:
-                        grain_owners[grain_owner] = 0
-                    grain_owners[grain_owner] += 1
+            grain_owners = self.info.get_holdings(commodity.short_name)
 
             for key in self.info.houses:
                 penalty = 4
                 h = self.info.getHouseInfo(key)
                 if 'J' in h.advances:
                     penalty -= 1
-                if h in grain_owners:
+                if key in grain_owners:
                     penalty -= grain_owners[key]
                 if penalty > 0:
                     h.adjust_misery(penalty)
@@ -1664,12 +2295,7 @@ class PlayCardsState(GameState):
         elif card =='E20_mys':
             # All players gain four spaces on the Misery Index minus one space for each Science Advance [A,B,C,D] held. 
             # This card becomes a worthless Misery burden if all players own all four Sciences [A,B,C,D]. 
-            edition = Edition.objects.filter(name=self.info.edition)
-            advances = Advanc.objects.filter(edition=edition).filter(category=Advance.SCIENCE)
-            science_advances = []
-            for a in advances:
-                science_advances.append(a.ahort_name)
-            science_advances_set = set(science_advances)
+            science_advances_set = self.info.catalog.advance_categories.get(Advance.SCIENCE, frozenset())
             sum_misery_level = 0
 
             for key in self.info.houses:
@@ -1695,7 +2321,7 @@ class PlayCardsState(GameState):
             h.cash += 10
             l.card_income += 10
 
-            self.mongol_armies = True
+            self.info.mongol_armies = True
         elif card =='E22_pap':
             # You may ban the acquisition by all players of any Advance in one of the following three categories: 
             #   Science [A,B,C,D], Religion [E,F,G,H] and Exploration [R,S,T,U]. 
@@ -1712,22 +2338,13 @@ class PlayCardsState(GameState):
                 # 이 때도 플레이는 가능하지만, 게임에는 아무런 영향을 미칠 수 없다 
                 pass
             else:
-                edition = Edition.objects.filter(name=self.info.edition)
                 if params['target'] == 'Science':
-                    advances = Advanc.objects   \
-                                .filter(edition=edition) \
-                                .filter(category=Advance.SCIENCE)
+                    category = Advance.SCIENCE
                 elif params['target'] == 'Religion':
-                    advances = Advanc.objects   \
-                                .filter(edition=edition) \
-                                .filter(category=Advance.RELIGION)
+                    category = Advance.RELIGION
                 else: # params['target'] == 'Exploration':
-                    advances = Advanc.objects   \
-                                .filter(edition=edition) \
-                                .filter(category=Advance.EXPLORATION)
-                self.papal_decree = []
-                for a in advances:
-                    self.papal_decree.append(a.short_name)
+                    category = Advance.EXPLORATION
+                self.info.papal_decree = sorted(self.info.catalog.advance_categories.get(category, ()))
         elif card =='E23_vik':
             # Reduce any Dominance Marker (circle) to a Colored Token (square) in any coastal Province of your choice. 
             # If played during Epoch II, reduce two Colored Dominance Markers (circles). 
@@ -1739,17 +2356,15 @@ class PlayCardsState(GameState):
                             "'targets' parameter must be an array of " + self.info.epoch + " Coastal Provinces"
                 )
 
-            edition = Edition.objects.filter(name=self.info.edition)
             self.info.clear_marker_removal()
 
             for key in params['targets']:
-                p = Province.objects.get(edition=edition, short_name=key)
+                p = self.info.catalog.provinces[key]
                 self.info.add_marker_removal(p.short_name)
                 if p.area == AREA_FAR_EAST or p.area == AREA_NEW_WORLD:
                     continue
                 else:
-                    w = Water.objects.filter(edition=edition, coast_of=p)
-                    if len(w) == 0:
+                    if len(p.coasts) == 0:
                         self.info.clear_marker_removal()
                         raise Action.InvalidParameter( \
                                 "'targets' parameter must be an array of " + self.info.epoch + " Coastal Provinces"
@@ -1762,8 +2377,9 @@ class PlayCardsState(GameState):
             if 'target' not in params.keys() :
                 raise Action.InvalidParameter("'Rebellion' requires 'target' parameter.")
 
-            edition = Edition.objects.filter(name=self.info.edition)
-            p = Province.objects.get(edition=edition, short_name=params['target'])
+            p = self.info.catalog.provinces.get(params['target'], None)
+            if p == None :
+                raise Action.InvalidParameter("'" + params['target'] + "' is not a valid province name.")
 
             if p.province_type == Province.CAPITAL or p.area == AREA_NEW_WORLD :
                 raise Action.InvalidParameter("'target' cannot be a Capital or New World")
@@ -1781,12 +2397,7 @@ class PlayCardsState(GameState):
             # Voids PAPAL DECREE, if played in the same turn. 
             # If played in Epoch 3, the PAPAL DECREE card becomes an unplayable Misery burden.                                 
 
-            edition = Edition.objects.filter(name=self.info.edition)
-            advances = Advanc.objects.filter(edition=edition).filter(category=Advance.RELIGION)
-            religion_advances = []
-            for a in advances:
-                religion_advances.append(a.ahort_name)
-            religion_advances_set = set(religion_advances)
+            religion_advances_set = self.info.catalog.advance_categories.get(Advance.RELIGION, frozenset())
 
             for key in self.info.houses:
                 h = self.info.getHouseInfo(key)
@@ -1796,15 +2407,10 @@ class PlayCardsState(GameState):
                 h.adjust_misery(len(dev_set))
 
             # Papal Decree가 선언되었다면 무효화시킨다.
-            self.papal_decree = []
+            self.info.papal_decree = []
         elif card =='E26_rev':
             # Each player gains one space on the Misery Index for each Commerce Advance [I,J,K,L,M] he holds.
-            edition = Edition.objects.filter(name=self.info.edition)
-            advances = Advanc.objects.filter(edition=edition).filter(category=Advance.COMMERCE)
-            commerce_advances = []
-            for a in advances:
-                commerce_advances.append(a.ahort_name)
-            commerce_advances_set = set(commerce_advances)
+            commerce_advances_set = self.info.catalog.advance_categories.get(Advance.COMMERCE, frozenset())
 
             for key in self.info.houses:
                 h = self.info.getHouseInfo(key)
@@ -1863,7 +2469,7 @@ class PostWarState(GameState):
             for p in choice_refined :
                 self.info.set_marker(p, self.info.war['winner'], colored=True)
             self.info.reset_war_info()
-            self.info.state = self.depends_on
+            self.info.pop_state()
         else :
             return super(PostWarState, self).action(a, params)
         return {}
@@ -1896,7 +2502,7 @@ class ResolveCivilWarState(GameState):
                 l.card_damage += penalty
             
             capital = self.info.provinces[h.house_name]
-            self.info.state = self.depends_on
+            self.info.pop_state()
             if 'color-marker' in capital:
                 if capital['color-marker'] == h.house_name : 
                     # 수도를 보유하고 있음. 
@@ -1963,11 +2569,11 @@ class RemoveMarkerState(GameState):
             if len(self.marker_removal[user_id]) == 0:
                 del self.marker_removal[user_id]
                 player = get_next_player_for_marker_removal()
+                self.info.pop_state()
                 if player != None:
-                    self.info.state = player + '.' + GameInfo.REMOVE_MARKER + '.' + self.depends_on
+                    self.info.push_state(player, GameState.REMOVE_MARKER)
                 else: 
                     self.info.clear_marker_removal()
-                    self.info.state = self.depends_on
         else :
             return super(RemoveMarkerState, self).action(a, params)
         return {}
@@ -1975,3 +2581,21 @@ class RemoveMarkerState(GameState):
 class PurchaseState(GameState):
     def action(self, a, user_id=None, params={}):
         return super(PurchaseState, self).action(a, params)
+
+GameState.HANDLERS = {
+    GameState.INITIALIZE              : InitState,
+    GameState.HOUSE_BIDDING           : HouseBiddingState,
+    GameState.CHOOSE_CAPITAL          : ChooseCapitalState,
+    GameState.TOKEN_BIDDING           : TokenBiddingState,
+    GameState.TIE_BREAKING            : TieBreakingState,
+    GameState.DRAW_CARD               : DrawCardsState,
+    GameState.BUY_CARD                : BuyCardsState,
+    GameState.PLAY_CARD               : PlayCardsState,
+    GameState.POST_WAR                : PostWarState,
+    GameState.RESOLVE_CIVIL_WAR       : ResolveCivilWarState,
+    GameState.REMOVE_MARKER           : RemoveMarkerState,
+    GameState.APPLY_RENAISSANCE       : ApplyRenaissanceState,
+    GameState.APPLY_WATERMILL         : ApplyWatermillState,
+    GameState.REMOVE_SURPLUS_SHORTAGE : RemoveSurplusShortageState,
+    GameState.PURCHASE                : PurchaseState,
+}
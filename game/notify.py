@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from django.conf import settings
+
+from game.models import Game
+
+class LsnNotifier(object):
+    ''' lets requests wait until Game.applied_lsn reaches a given lsn
+
+    process_action calls notify() after each commit, which wakes up waiters of the
+    same process at once. Logs applied by another process (e.g. a celery worker)
+    are noticed by re-reading applied_lsn every POLL_INTERVAL seconds.
+
+    A waiting request holds its worker. With the sync uwsgi workers of aor_uwsgi.ini
+    nothing else runs in that process meanwhile, so notify() only comes from celery
+    and every wait is a poll; the wait is therefore capped at MAX_TIMEOUT seconds
+    (settings.GAME_WAIT_FOR_LSN). Raise it only where getInfo is served by workers
+    that can afford to block, e.g. a separate gevent or threaded uwsgi instance.
+    '''
+    POLL_INTERVAL = 0.5
+    MAX_TIMEOUT = 3
+
+    def __init__(self):
+        conf = getattr(settings, 'GAME_WAIT_FOR_LSN', {})
+        self.max_timeout = conf.get('MAX_TIMEOUT', LsnNotifier.MAX_TIMEOUT)
+        self._cond = threading.Condition()
+        self._applied = {}  # game_id -> applied_lsn, kept only while someone waits
+        self._waiters = {}
+
+    def notify(self, game_id, applied_lsn):
+        with self._cond:
+            if game_id in self._waiters:
+                self._applied[game_id] = applied_lsn
+                self._cond.notify_all()
+
+    def wait(self, game_id, lsn, timeout):
+        ''' returns applied_lsn, which is smaller than lsn on timeout; None if game_id is not found
+
+        timeout is cut to max_timeout seconds.
+        '''
+        timeout = min(max(timeout, 0), self.max_timeout)
+        deadline = time.time() + timeout
+
+        with self._cond:
+            self._waiters[game_id] = self._waiters.get(game_id, 0) + 1
+        try:
+            while True:
+                applied_lsn = Game.objects.filter(hashkey=game_id).values_list('applied_lsn', flat=True).first()
+                if applied_lsn == None or applied_lsn >= lsn:
+                    return applied_lsn
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return applied_lsn
+
+                with self._cond:
+                    if self._applied.get(game_id, applied_lsn) < lsn:
+                        self._cond.wait(min(remaining, LsnNotifier.POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self._waiters[game_id] -= 1
+                if self._waiters[game_id] == 0:
+                    del self._waiters[game_id]
+                    self._applied.pop(game_id, None)
+
+lsn_notifier = LsnNotifier()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+''' JSON-patch like structural diff between two plain (json compatible) values
+
+A patch is a list of operations, applied in order:
+    { 'op': 'add',     'path': '/houses/u1/turn_logs/2', 'value': {...} }
+    { 'op': 'replace', 'path': '/houses/u1/cash', 'value': 37 }
+    { 'op': 'remove',  'path': '/draw_stack/12' }
+Paths follow RFC 6901 ('~' is written as '~0', '/' as '~1').
+'''
+
+ADD = 'add'
+REPLACE = 'replace'
+REMOVE = 'remove'
+
+def _escape(key):
+    return unicode(key).replace('~', '~0').replace('/', '~1')
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+def diff(before, after, path=''):
+    ''' list of operations that turns before into after '''
+    ops = []
+    _diff(before, after, path, ops)
+    return ops
+
+def _diff(before, after, path, ops):
+    if before is after:
+        return
+    if type(before) is dict and type(after) is dict:
+        for k in before:
+            if k not in after:
+                ops.append({ 'op': REMOVE, 'path': path + '/' + _escape(k) })
+        for k in after:
+            if k not in before:
+                ops.append({ 'op': ADD, 'path': path + '/' + _escape(k), 'value': after[k] })
+            else:
+                _diff(before[k], after[k], path + '/' + _escape(k), ops)
+    elif type(before) is list and type(after) is list:
+        n = min(len(before), len(after))
+        for i in range(n):
+            _diff(before[i], after[i], path + '/' + str(i), ops)
+        # 뒤에서부터 지워야 index 가 유지된다.
+        for i in range(len(before) - 1, n - 1, -1):
+            ops.append({ 'op': REMOVE, 'path': path + '/' + str(i) })
+        for i in range(n, len(after)):
+            ops.append({ 'op': ADD, 'path': path + '/' + str(i), 'value': after[i] })
+    elif before != after or type(before) != type(after):
+        ops.append({ 'op': REPLACE, 'path': path, 'value': after })
+
+def apply_patch(doc, ops):
+    ''' apply ops to doc in place and return the (possibly replaced) doc '''
+    for o in ops:
+        tokens = [ _unescape(t) for t in o['path'].split('/')[1:] ]
+        if not tokens:
+            # whole document replaced
+            doc = o['value']
+            continue
+
+        parent = doc
+        for t in tokens[:-1]:
+            parent = parent[int(t)] if type(parent) is list else parent[t]
+        last = tokens[-1]
+
+        if type(parent) is list:
+            i = len(parent) if last == '-' else int(last)
+            if o['op'] == ADD:
+                parent.insert(i, o['value'])
+            elif o['op'] == REMOVE:
+                del parent[i]
+            else:
+                parent[i] = o['value']
+        else:
+            if o['op'] == REMOVE:
+                del parent[last]
+            else:
+                parent[last] = o['value']
+    return doc
@@ -1,54 +1,199 @@
+# -*- coding: utf-8 -*-
 from django.db import IntegrityError, transaction
+from django.conf import settings
+from django.utils import timezone
 from celery import task
 from celery.utils.log import get_task_logger
 
+from timeit import default_timer as clock
+import copy
 import json
+import uuid
 
-from game.models import Game, GameLog, GameState, GameInfo, Action, GameInfoDecoder
+from game.models import Game, GameLog, GameSnapshot, GameLease, GameState, GameInfo, Action
+from game.patch import diff
+from game.notify import lsn_notifier
+from game import metrics
 from player.models import Player
 #, GameLog, GameInfo, HouseInfo, HouseTurnLog, HouseBiddingLog, GameInfoEncoder, GameInfoDecoder, Action
 
+# queued (system) actions applied in a single transaction
+MAX_QUEUED_STEPS = 50
+
+# label values of the action metrics; anything else a client sends is counted as 'other'
+KNOWN_ACTIONS = frozenset([ v for (k, v) in vars(Action).items() if k.isupper() ])
+
+def _action_label(action_dict):
+    a = action_dict.get('action', None)
+    return a if a in KNOWN_ACTIONS else 'other'
+
+# seconds before a replay which found the lease taken is tried again
+REPLAY_RETRY_SECONDS = 1
+
 @task()
 def process_action(game_id, lsn, replay=False):
+    ''' apply the accepted logs of a game; lsn is only a hint unless replay is True
+
+    Only the holder of the game's GameLease applies logs, and it keeps going until
+    applied_lsn catches up with last_lsn, so concurrent invocations collapse into one run.
+    A replay does not queue actions again, so no other run can stand in for it: while the
+    lease is taken, it is tried again later. A run stops once a rollback bumps Game.generation.
+    '''
     logger = get_task_logger(game_id)
+    owner = uuid.uuid4().hex
+
+    if GameLease.acquire(game_id, owner) == False:
+        if replay == True:
+            logger.info('Retrying replay of ' + game_id + ': ' + str(lsn) + ', already being applied')
+            process_action.apply_async((game_id, lsn), { 'replay' : True }, countdown=REPLAY_RETRY_SECONDS)
+            return None
+        # 다른 worker 가 last_lsn 까지 적용할 것이다.
+        logger.info('Skipping ' + game_id + ': ' + str(lsn) + ', already being applied')
+        return None
+
+    stalled = False
+    lost = False
+    try:
+        generation = Game.objects.filter(hashkey=game_id).values_list('generation', flat=True).get()
+        g = _apply_logs(game_id, lsn, replay, logger, generation)
+        while replay == False and g.generation == generation and g.applied_lsn < g.last_lsn:
+            applied_lsn = g.applied_lsn
+            if GameLease.acquire(game_id, owner) == False:
+                # lease 가 만료되어 다른 worker 가 가져갔다. 나머지는 그 worker 가 적용한다.
+                lost = True
+                logger.warning(game_id + ': lease lost after ' + str(applied_lsn))
+                break
+            g = _apply_logs(game_id, g.last_lsn, replay, logger, generation)
+            if g.generation == generation and g.applied_lsn == applied_lsn:
+                stalled = True
+                logger.error(game_id + ': no accepted log after ' + str(applied_lsn))
+                break
+        if g.generation != generation:
+            # rollback 이 되돌린 log 는 rollback 이 replay 한다.
+            lost = True
+            logger.warning(game_id + ': rolled back while applying, stopped')
+    finally:
+        GameLease.release(game_id, owner)
+
+    # lease 를 놓기 직전에 들어온 action 은 그 task 가 그냥 종료했을 수 있다.
+    g = Game.objects.get(hashkey=game_id)
+    if stalled == False and lost == False and g.applied_lsn < g.last_lsn:
+        process_action.delay(game_id, g.last_lsn)
+
+    return g.applied_lsn
+
+def replay_held(game_id, lsn):
+    ''' process_action(game_id, lsn, replay=True) for a caller which already holds the GameLease '''
+    return _apply_logs(game_id, lsn, True, get_task_logger(game_id))
+
+def _apply_logs(game_id, lsn, replay, logger, generation=None):
+    ''' one transaction of process_action; nothing is applied if the game's generation is not generation '''
     action_queue = []
+    steps = 0
 
     with transaction.atomic():
-        g = Game.objects.get(hashkey=game_id)
-        logs = GameLog.objects.filter(game=g, lsn__gt=g.applied_lsn, lsn__lte=lsn, status=GameLog.ACCEPTED)
-        info = json.loads(g.current_info, cls=GameInfoDecoder)
-        for l in logs:
-            action_dict = l.get_log_as_dict()
-            user_id = l.player.user_id if l.player != None else None
-
-            try:
-                state = GameState.getInstance(info)
-                logger.info('Applying ' + str(l) + ': ' + type(state).__name__ + ', ' + l.log)
-                result = state.action(action_dict['action'], user_id=user_id, params=action_dict)
-
-                info = state.info
-                if 'random' in result.keys():
-                    action_dict['random'] = result['random']
-                if 'queue_action' in result.keys() :
-                    action_queue.append(result['queue_action'])
-                if 'msg' in result.keys():
-                    for m in result['msg']:
-                        l.add_info(m['user_id'], m['msg'])
-
-                l.set_log(action_dict)
-                l.status = GameLog.CONFIRMED
-            except (GameState.NotSupportedAction, 
-                    GameState.InvalidAction, 
-                    Action.InvalidParameter, 
-                    Action.WarNotResolved) as e:
-                l.status = GameLog.FAILED
-                logger.error(str(l) + " :" + type(e).__name__ + ": " + e.message)
-                l.add_warning(user_id, e.message)
-            g.applied_lsn = l.lsn
-            l.save()
-        g.set_current_info(info)
-
+        # rollback 과 동시에 쓰지 않도록 row 를 잠근다.
+        g = Game.objects.select_for_update().get(hashkey=game_id)
+        if generation != None and g.generation != generation:
+            return g
         if replay == False:
+            lsn = g.last_lsn
+        metrics.BATCH_SIZE.observe(lsn - g.applied_lsn)
+
+        start = clock()
+        # patch 가 다른 schema version 으로 쓰여 log 를 다시 적용했다면 current_info 를 새로 쓴다.
+        (info, fold) = g.restore_current_info()
+        metrics.BATCH_DECODE_SECONDS.observe(clock() - start)
+
+        last_snapshot_lsn = g.get_last_snapshot_lsn()
+        start = clock()
+        before = info.to_dict()
+        encode_seconds = clock() - start
+
+        # queue_action 으로 생긴 action 은 새 task 를 기다리지 않고 바로 이어서 적용한다.
+        # lsn 순서는 새 task 로 적용하던 때와 동일하다.
+        while True:
+            action_queue = []
+            logs = GameLog.objects                                  \
+                    .filter(game=g, lsn__gt=g.applied_lsn, lsn__lte=lsn, status=GameLog.ACCEPTED) \
+                    .order_by('lsn')
+            for l in logs:
+                user_id = l.player.user_id if l.player != None else None
+                metrics.QUEUE_LAG_SECONDS.observe((timezone.now() - l.timestamp).total_seconds())
+                labels = None
+                queued = len(action_queue)
+                action = None
+
+                try:
+                    # 잘못된 log 도 이 log 만 실패로 기록한다. 밖에서 예외가 나면 매번 여기서 멈춘다.
+                    action_dict = l.get_log_as_dict()
+                    if not isinstance(action_dict, dict) or 'action' not in action_dict:
+                        raise Action.InvalidParameter("an action must be an object with 'action'")
+                    action = action_dict['action']
+                    state = GameState.getInstance(info)
+                    logger.info('Applying ' + str(l) + ': ' + type(state).__name__ + ', ' + l.log)
+                    labels = (type(state).__name__, _action_label(action_dict))
+                    start = clock()
+                    try:
+                        with metrics.QueryCounter() as queries:
+                            result = state.action(action, user_id=user_id, params=action_dict)
+                    finally:
+                        metrics.ACTION_SECONDS.observe(clock() - start, *labels)
+                        metrics.ACTION_QUERIES.inc(queries.count, *labels)
+
+                    info = state.info
+                    if getattr(settings, 'GAME_CHECK_INVARIANTS', False):
+                        info.check_invariants()
+                    if 'queue_action' in result.keys() :
+                        action_queue.append(result['queue_action'])
+                    if 'msg' in result.keys():
+                        for m in result['msg']:
+                            l.add_info(m['user_id'], m['msg'])
+
+                    l.set_log(action_dict)
+                    l.status = GameLog.CONFIRMED
+                    metrics.ACTIONS.inc(1, *(labels + ('confirmed',)))
+                except (GameState.NotSupportedAction, 
+                        GameState.InvalidAction, 
+                        Action.InvalidParameter, 
+                        Action.WarNotResolved) as e:
+                    l.status = GameLog.FAILED
+                    logger.error(str(l) + " :" + type(e).__name__ + ": " + e.message)
+                    l.add_warning(user_id, e.message)
+                    if labels != None:
+                        metrics.ACTIONS.inc(1, *(labels + ('failed',)))
+                except Exception as e:
+                    # handler 의 오류이다. 이 log 만 적용하지 않은 것으로 하고 실패로 기록한다.
+                    # 여기서 transaction 을 되돌리면 앞서 적용한 log (queue_action 을 보낸
+                    # player 의 action 포함) 까지 사라지고, 다시 시도해도 같은 곳에서 멈춘다.
+                    l.status = GameLog.FAILED
+                    logger.exception(str(l) + " :" + type(e).__name__ + ": " + unicode(e))
+                    l.add_warning(user_id, 'unable to apply the action: ' + type(e).__name__)
+                    info = GameInfo.from_dict(copy.deepcopy(before))
+                    del action_queue[queued:]
+                    if labels != None:
+                        metrics.ACTIONS.inc(1, *(labels + ('error',)))
+
+                # 실패한 action 도 info 를 일부 변경했을 수 있으므로 patch 는 항상 기록한다.
+                start = clock()
+                after = info.to_dict()
+                l.set_patch(diff(before, after))
+                before = after
+                encode_seconds += clock() - start
+
+                g.applied_lsn = l.lsn
+                l.save()
+
+                if GameSnapshot.is_required(l.lsn, last_snapshot_lsn, action):
+                    start = clock()
+                    g.take_snapshot(l.lsn, info)
+                    encode_seconds += clock() - start
+                    last_snapshot_lsn = l.lsn
+                    fold = True
+
+            if replay == True or not action_queue:
+                break
+
             for aq in action_queue:
                 g.last_lsn += 1
                 p = Player.objects.get(user_id=aq['_player']) if '_player' in aq else None
@@ -59,9 +204,24 @@ def process_action(game_id, lsn, replay=False):
                     )
                 a.set_log(log_dict=aq)
                 a.save()
-        g.save()
+            lsn = g.last_lsn
 
-    if action_queue and replay == False:
-        process_action.delay(g.hashkey, g.last_lsn)
+            steps += len(action_queue)
+            if steps >= MAX_QUEUED_STEPS:
+                # 나머지는 다음 transaction 에서
+                break
 
-    return g.applied_lsn
+        # current_info 는 가끔씩만 다시 쓰고, 그 사이에는 GameLog 의 patch 로 복원한다.
+        if fold or g.applied_lsn - g.info_lsn >= Game.FOLD_INTERVAL :
+            start = clock()
+            g.set_current_info(info)
+            encode_seconds += clock() - start
+        metrics.BATCH_ENCODE_SECONDS.observe(encode_seconds)
+        # generation 은 rollback 만 바꾸므로 다시 쓰지 않는다.
+        if g.info_lsn == g.applied_lsn :
+            g.save(update_fields=['last_lsn', 'applied_lsn', 'info_lsn', 'current_info', 'date_modified'])
+        else :
+            g.save(update_fields=['last_lsn', 'applied_lsn', 'date_modified'])
+
+    lsn_notifier.notify(g.hashkey, g.applied_lsn)
+    return g
@@ -1,3 +1,831 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from game.models import Game, GameLog, GameSnapshot, GameLease, GameInfo, GameInfoCodec, GameInfoEncoder, GameRandom, GameState, Action
+from game.models import TokenBiddingState
+from game.engine import Engine, RandomAgent, play, simulate
+from game.benchmark import Timings, synthetic_records, measure
+from game.patch import diff, apply_patch
+from game.tasks import process_action, REPLAY_RETRY_SECONDS
+from game import tasks, views
+from game.notify import lsn_notifier
+from game.cache import info_cache
+from game.metrics import metrics
+from player.models import Player, AccessToken
+from game.views import ROLLBACK_LEASE_WAIT
+from player.cache import token_cache
+from rule.catalog import RuleCatalog
+from rule.models import Edition
+
+FIXTURE = os.path.join(settings.BASE_DIR, 'rule', 'init_data.json')
+
+def _played(seed, num_players=3, max_actions=60):
+    ''' Engine after a random game; it stops early on some handler errors, which is fine here '''
+    engine = Engine(RuleCatalog.from_fixture(FIXTURE, 'european'), num_players, seed=seed)
+    play(engine, RandomAgent(random.Random(seed)), max_actions)
+    return engine
+
+def _states(engine):
+    ''' [ GameInfo.to_dict() as of lsn 0, 1, ... ] of engine.log '''
+    info = engine.initial_info.copy()
+    states = [ info.to_dict() ]
+    for (user_id, action) in engine.log:
+        state = GameState.getInstance(info)
+        state.action(action['action'], user_id=user_id, params=dict(action))
+        info = state.info
+        states.append(info.to_dict())
+    return states
+
+class GameInfoCodecTest(TestCase):
+    def setUp(self):
+        self.info = _played(1).info
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            s = GameInfoCodec.encode(self.info, compress=compress)
+            self.assertEqual(GameInfoCodec.decode(s).to_dict(), self.info.to_dict())
+
+    def test_stored_json(self):
+        ''' GameInfoEncoder JSON which games were stored in before the codec '''
+        d = json.loads(json.dumps(self.info, cls=GameInfoEncoder))
+        for f in ('state_stack', 'market', 'areas', 'holdings', 'seed', 'rng_counter'):
+            del d[f]
+        expected = self.info.to_dict()
+        expected['seed'] = None
+        expected['rng_counter'] = None
+        self.assertEqual(GameInfoCodec.decode(json.dumps(d)).to_dict(), expected)
+
+    def test_unknown_version(self):
+        s = GameInfoCodec.encode(self.info).replace(GameInfoCodec.PREFIX + str(GameInfoCodec.VERSION), GameInfoCodec.PREFIX + '99', 1)
+        self.assertRaises(GameInfoCodec.UnknownFormat, GameInfoCodec.decode, s)
+        self.assertRaises(GameInfoCodec.UnknownFormat, GameInfoCodec.decode, 'XYZ')
+
+class PatchTest(TestCase):
+    def test_diff_and_apply(self):
+        states = _states(_played(2))
+        for (before, after) in zip(states, states[1:]):
+            ops = diff(before, after)
+            self.assertEqual(apply_patch(json.loads(json.dumps(before)), ops), after)
+        self.assertEqual(diff(states[-1], states[-1]), [])
+
+class GameRandomTest(TestCase):
+    def test_draw(self):
+        def draws(seed, n):
+            r = GameRandom.draw(seed, n)
+            cards = range(20)
+            r.shuffle(cards)
+            return (cards, [ r.randint(1, 6) for i in range(10) ])
+
+        self.assertEqual(draws(7, 3), draws(7, 3))
+        self.assertNotEqual(draws(7, 3), draws(7, 4))
+        self.assertNotEqual(draws(7, 3), draws(8, 3))
+        for (cards, dice) in [ draws(7, n) for n in range(20) ]:
+            self.assertEqual(sorted(cards), range(20))
+            self.assertTrue(all([ 1 <= d <= 6 for d in dice ]))
+
+    def test_engine(self):
+        ''' the same seed plays the same game '''
+        self.assertEqual(_played(3).log, _played(3).log)
+        self.assertEqual(_played(3).info.to_dict(), _played(3).info.to_dict())
+
+class GameTestCase(TestCase):
+    ''' a game replayed into the database from Engine logs '''
+    fixtures = [ FIXTURE ]
+
+    def setUp(self):
+        self.engine = _played(1)
+        self.states = _states(self.engine)
+        self.players = {}
+        for user_id in self.engine.user_ids:
+            self.players[user_id] = Player.objects.create(user_id=user_id, name=user_id)
+
+        info = GameInfoCodec.encode(self.engine.initial_info)
+        self.game = Game(
+                hashkey='test-game',
+                num_players=self.engine.info.num_players,
+                edition=Edition.objects.get(name='european'),
+                status=Game.IN_PROGRESS,
+                initial_info=info,
+                current_info=info,
+            )
+        self.game.save()
+        for p in self.players.values():
+            self.game.players.add(p)
+
+        # celery 없이 예약된 task 만 기록한다.
+        self.delayed = []
+        self.saved = (process_action.delay, process_action.apply_async)
+        process_action.delay = lambda *args, **kwargs: self.delayed.append( (args, kwargs) )
+        process_action.apply_async = lambda args, kwargs, **options: self.delayed.append( (args, kwargs, options) )
+        token_cache.clear()
+        # 'test-game' 의 lsn 은 test 마다 같으므로 이전 test 의 응답이 남아 있으면 안 된다.
+        info_cache.backend.clear()
+
+    def tearDown(self):
+        (process_action.delay, process_action.apply_async) = self.saved
+
+    def submit(self, logs, first_lsn=1):
+        for (lsn, (user_id, action)) in enumerate(logs, first_lsn):
+            GameLog.objects.create(game=self.game, player=self.players.get(user_id, None), lsn=lsn, log=json.dumps(action))
+        Game.objects.filter(pk=self.game.pk).update(last_lsn=first_lsn + len(logs) - 1)
+
+    def replay(self, logs):
+        ''' logs as they are, one process_action each '''
+        for (lsn, log) in enumerate(logs, 1):
+            self.submit([ log ], lsn)
+            process_action(self.game.hashkey, lsn, replay=True)
+        return Game.objects.get(pk=self.game.pk)
+
+    def token(self, user_id):
+        p = Player.objects.get_or_create(user_id=user_id, defaults={ 'name': user_id })[0]
+        AccessToken.objects.get_or_create(player=p,
+                defaults={ 'token': 'token-' + user_id, 'expires': timezone.now() + datetime.timedelta(days=1) })
+        return 'Bearer token-' + user_id
+
+    def get(self, path, data, **extra):
+        return self.client.get(path, data, HTTP_AUTHORIZATION=self.token(data['user_id']), **extra)
+
+    def post(self, path, data, user_id='admin'):
+        data = dict(data, user_id=user_id)
+        return json.loads(self.client.post(path, data, HTTP_AUTHORIZATION=self.token(user_id)).content)
+
+    def post_json(self, path, body):
+        ''' response of a JSON body, e.g. to action and actions '''
+        return self.client.post(path, json.dumps(body), content_type='application/json',
+                HTTP_AUTHORIZATION=self.token(body['user_id']))
+
+    def queued_chain(self):
+        ''' (lsn of the last token bid, lsn of the determine_order it queues) '''
+        for (i, (user_id, action)) in enumerate(self.engine.log):
+            if action['action'] == Action.DETERMINE_ORDER and i > 0 and self.engine.log[i - 1][1]['action'] == Action.BID:
+                if isinstance(GameState.getInstance(GameInfo.from_dict(self.states[i])), TokenBiddingState):
+                    return (i, i + 1)
+        self.fail('no token bidding in the game')
+
+class StoredGameTest(GameTestCase):
+    def test_replay(self):
+        g = self.replay(self.engine.log)
+        self.assertEqual(g.applied_lsn, len(self.engine.log))
+        self.assertEqual(g.get_current_info().to_dict(), self.states[-1])
+        self.assertEqual(GameLog.objects.filter(game=g).exclude(status=GameLog.CONFIRMED).count(), 0)
+
+    def test_current_info_from_patches(self):
+        g = self.replay(self.engine.log)
+        # current_info 를 첫 snapshot 으로 되돌려 나머지는 patch 로 복원하게 한다.
+        s = GameSnapshot.objects.filter(game=g).order_by('lsn').first()
+        g.current_info = s.info
+        g.info_lsn = s.lsn
+        g.save()
+
+        (info, replayed) = g.restore_current_info()
+        self.assertFalse(replayed)
+        self.assertEqual(info.to_dict(), self.states[-1])
+
+        for since_lsn in range(0, g.applied_lsn + 1):
+            (old, new) = g.get_info_since(since_lsn)
+            self.assertEqual(old.to_dict(), self.states[since_lsn], 'since ' + str(since_lsn))
+            self.assertEqual(new.to_dict(), self.states[-1])
+        self.assertEqual(g.get_info_since(g.applied_lsn + 1), None)
+
+    def test_patches_of_another_version(self):
+        g = self.replay(self.engine.log)
+        g.current_info = g.initial_info
+        g.info_lsn = 0
+        g.save()
+        for l in GameLog.objects.filter(game=g).exclude(patch=None):
+            # 다른 schema version 으로 저장된 patch
+            l.patch = str(GameInfoCodec.VERSION + 1) + ':' + json.dumps(l.get_patch()[1])
+            l.save()
+
+        (info, replayed) = g.restore_current_info()
+        self.assertTrue(replayed)
+        self.assertEqual(info.to_dict(), self.states[-1])
+        self.assertEqual(g.get_info_since(g.applied_lsn - 1), None)
+
+    def test_rollback(self):
+        g = self.replay(self.engine.log)
+        lsn = len(self.engine.log) - 3
+        s = GameSnapshot.objects.filter(game=g, lsn__lte=lsn).order_by('-lsn').first()
+        self.assertTrue(s.lsn < lsn)
+
+        response = self.post('/api/v1/game/rollback/', { 'game_id': g.hashkey, 'lsn': lsn })
+        self.assertTrue(response['success'])
+        self.assertEqual(response['applied_lsn'], lsn)
+
+        g = Game.objects.get(pk=g.pk)
+        self.assertEqual(g.generation, 1)
+        self.assertEqual((g.last_lsn, g.applied_lsn), (lsn, lsn))
+        self.assertEqual(g.get_current_info().to_dict(), self.states[lsn])
+        self.assertEqual(GameLog.objects.filter(game=g, lsn__gt=lsn).count(), 0)
+        self.assertEqual(GameSnapshot.objects.filter(game=g, lsn__gt=lsn).count(), 0)
+
+    def test_queued_chain(self):
+        ''' a log and the chain of actions it queues are applied in one process_action '''
+        (bid_lsn, queued_lsn) = self.queued_chain()
+        self.replay(self.engine.log[:bid_lsn - 1])
+        self.submit(self.engine.log[bid_lsn - 1:bid_lsn], bid_lsn)
+        process_action(self.game.hashkey, bid_lsn)
+
+        g = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(g.applied_lsn, g.last_lsn)
+        self.assertTrue(g.last_lsn > queued_lsn)
+        self.assertEqual(g.get_current_info().to_dict(), self.states[g.last_lsn])
+
+    def test_failing_queued_action(self):
+        ''' A queued action whose handler raises must not roll back the log which queued it.
+
+        It used to abort the whole transaction, so the bid stayed ACCEPTED and every
+        retry stopped at the same place.
+        '''
+        (bid_lsn, queued_lsn) = self.queued_chain()
+        self.replay(self.engine.log[:bid_lsn - 1])
+        self.submit(self.engine.log[bid_lsn - 1:bid_lsn], bid_lsn)
+
+        original = TokenBiddingState.action
+        def action(state, a, user_id=None, params={}):
+            if a == Action.DETERMINE_ORDER:
+                raise KeyError(a)
+            return original(state, a, user_id=user_id, params=params)
+        TokenBiddingState.action = action
+        try:
+            process_action(self.game.hashkey, bid_lsn)
+        finally:
+            TokenBiddingState.action = original
+
+        g = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(g.applied_lsn, queued_lsn)
+        self.assertEqual(g.last_lsn, queued_lsn)
+        self.assertEqual(GameLog.objects.get(game=g, lsn=bid_lsn).status, GameLog.CONFIRMED)
+
+        failed = GameLog.objects.get(game=g, lsn=queued_lsn)
+        self.assertEqual(failed.status, GameLog.FAILED)
+        self.assertEqual(failed.patch, None)
+        # system action 의 경고는 모든 player 에게 간다.
+        for user_id in self.engine.user_ids:
+            self.assertEqual([ m['type'] for m in failed.get_msg(user_id) ], [ 'warning' ])
+        self.assertEqual(g.get_current_info().to_dict(), self.states[bid_lsn])
+
+    def test_malformed_logs(self):
+        ''' a log which is not an action fails by itself instead of stopping the game '''
+        self.replay(self.engine.log[:4])
+        for (lsn, text) in enumerate([ '[1, 2]', '{"card": "E1_Wo"}', '"pass"', 'not json' ], 5):
+            GameLog.objects.create(game=self.game, player=self.players['p1'], lsn=lsn, log=text)
+        self.submit(self.engine.log[4:5], 9)
+        process_action(self.game.hashkey, 9)
+
+        g = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(g.applied_lsn, 9)
+        self.assertEqual([ l.status for l in GameLog.objects.filter(game=g, lsn__gt=4).order_by('lsn') ],
+                [ GameLog.FAILED ] * 4 + [ GameLog.CONFIRMED ])
+        self.assertEqual(g.get_current_info().to_dict(), self.states[5])
+        self.assertEqual(g.replay_logs(GameInfo.from_dict(self.states[4]), 4, 9).to_dict(), self.states[5])
+
+class LeaseTest(GameTestCase):
+    def setUp(self):
+        super(LeaseTest, self).setUp()
+        views.ROLLBACK_LEASE_WAIT = 0
+
+    def tearDown(self):
+        views.ROLLBACK_LEASE_WAIT = ROLLBACK_LEASE_WAIT
+        super(LeaseTest, self).tearDown()
+
+    def test_busy(self):
+        self.submit(self.engine.log[:3])
+        self.assertTrue(GameLease.acquire(self.game.hashkey, 'other'))
+
+        self.assertEqual(process_action(self.game.hashkey, 3), None)
+        self.assertEqual(self.delayed, [])
+        # replay 는 버리지 않고 다시 시도한다.
+        self.assertEqual(process_action(self.game.hashkey, 3, replay=True), None)
+        self.assertEqual(self.delayed, [ ((self.game.hashkey, 3), { 'replay': True }, { 'countdown': REPLAY_RETRY_SECONDS }) ])
+        self.assertEqual(Game.objects.get(pk=self.game.pk).applied_lsn, 0)
+
+        GameLease.release(self.game.hashkey, 'other')
+        self.assertEqual(process_action(self.game.hashkey, 3), 3)
+
+    def test_rollback_waits_for_the_lease(self):
+        g = self.replay(self.engine.log)
+        GameLease.acquire(g.hashkey, 'other')
+        response = self.post('/api/v1/game/rollback/', { 'game_id': g.hashkey, 'lsn': 5 })
+        self.assertFalse(response['success'])
+        self.assertTrue(response['errmsg'].startswith('UnableToRollback'))
+        self.assertEqual(Game.objects.get(pk=g.pk).last_lsn, len(self.engine.log))
+
+    def test_rolled_back_while_applying(self):
+        ''' the lease holder stops at a rollback and leaves the reset logs to it '''
+        self.replay(self.engine.log[:2])
+        self.submit(self.engine.log[2:3], 3)
+        apply_logs = tasks._apply_logs
+        def rolled_back(game_id, lsn, replay, logger, generation=None):
+            g = apply_logs(game_id, lsn, replay, logger, generation)
+            if g.generation == 0:
+                # 첫 transaction 뒤에 다른 process 가 rollback 하고 action 이 하나 더 들어왔다.
+                self.submit(self.engine.log[3:4], 4)
+                Game.objects.filter(pk=g.pk).update(generation=1)
+                g = Game.objects.get(pk=g.pk)
+            return g
+        tasks._apply_logs = rolled_back
+        try:
+            self.assertEqual(process_action(self.game.hashkey, 3), 3)
+        finally:
+            tasks._apply_logs = apply_logs
+
+        self.assertEqual(GameLog.objects.get(game=self.game, lsn=4).status, GameLog.ACCEPTED)
+        self.assertEqual(self.delayed, [])
+        self.assertTrue(GameLease.acquire(self.game.hashkey, 'other'))
+
+class LongPollTest(GameTestCase):
+    def get_info(self, params):
+        params = dict(params, game_id=self.game.hashkey, user_id='admin')
+        start = time.time()
+        response = json.loads(self.get('/api/v1/game/getInfo/', params).content)
+        return (response, time.time() - start)
+
+    def test_applied(self):
+        self.replay(self.engine.log[:2])
+        (response, seconds) = self.get_info({ 'wait_for_lsn': 2, 'timeout': 5 })
+        self.assertEqual(response['applied_lsn'], 2)
+        self.assertTrue(seconds < 1)
+
+    def test_timeout(self):
+        ''' a log that is never applied returns the current state after at most max_timeout '''
+        self.submit(self.engine.log[:1])
+        saved = lsn_notifier.max_timeout
+        lsn_notifier.max_timeout = 0.3
+        try:
+            (response, seconds) = self.get_info({ 'wait_for_lsn': 1, 'timeout': 60 })
+        finally:
+            lsn_notifier.max_timeout = saved
+        self.assertTrue(response['success'])
+        self.assertEqual(response['applied_lsn'], 0)
+        self.assertEqual(response['last_lsn'], 1)
+        self.assertTrue(0.3 <= seconds < 2)
+
+class InfoViewTest(GameTestCase):
+    def get_info(self, user_id, **params):
+        params = dict(params, game_id=self.game.hashkey, user_id=user_id)
+        return json.loads(self.get('/api/v1/game/getInfo/', params).content)
+
+    def test_masked_per_viewer(self):
+        self.replay(self.engine.log[:1])
+        admin = self.get_info('admin')['info']
+        self.assertNotEqual(admin['seed'], None)
+        for user_id in self.engine.user_ids:
+            info = self.get_info(user_id)['info']
+            # 같은 lsn 이라도 viewer 마다 따로 cache 된다.
+            self.assertEqual(info['seed'], None)
+            self.assertEqual(info['draw_stack'], [])
+            for l in info['house_bidding_log']:
+                if l['user_id'] == user_id:
+                    self.assertTrue(len(l['draw_cards']) > 0)
+                else:
+                    self.assertEqual(l['draw_cards'], [])
+
+    def test_applied_log_is_not_served_from_cache(self):
+        self.replay(self.engine.log[:1])
+        before = self.get_info('admin')
+        self.submit(self.engine.log[1:2], 2)
+        process_action(self.game.hashkey, 2, replay=True)
+        after = self.get_info('admin')
+        self.assertEqual(after['applied_lsn'], 2)
+        self.assertEqual(after['info'], self.get_info('admin')['info'])
+        self.assertNotEqual(before['info'], after['info'])
+
+class ConditionalGetTest(GameTestCase):
+    def check_not_modified(self, get):
+        ''' ETag of the first response of get(**extra), after checking that it gets 304 '''
+        response = get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        return etag
+
+    def test_get_info(self):
+        self.replay(self.engine.log[:1])
+        data = { 'game_id': self.game.hashkey, 'user_id': self.engine.user_ids[0] }
+        etag = self.check_not_modified(lambda **extra: self.get('/api/v1/game/getInfo/', data, **extra))
+        self.submit(self.engine.log[1:2], 2)
+        self.assertEqual(self.get('/api/v1/game/getInfo/', data, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list(self):
+        data = { 'user_id': 'admin', 'status': Game.IN_PROGRESS }
+        etag = self.check_not_modified(lambda **extra: self.get('/api/v1/game/list/', data, **extra))
+        Game.objects.create(hashkey='another-game', num_players=3, status=Game.IN_PROGRESS,
+                edition=Edition.objects.get(name='european'))
+        self.assertEqual(self.get('/api/v1/game/list/', data, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_get_map(self):
+        self.check_not_modified(lambda **extra: self.client.get('/api/v1/rule/getMap/', { 'edition': 'european' }, **extra))
+
+class SinceLsnTest(GameTestCase):
+    def apply_to(self, lsn):
+        ''' replays engine logs after applied_lsn up to lsn '''
+        applied = Game.objects.get(pk=self.game.pk).applied_lsn
+        self.submit(self.engine.log[applied:lsn], applied + 1)
+        for n in range(applied + 1, lsn + 1):
+            process_action(self.game.hashkey, n, replay=True)
+
+    def get_info(self, user_id, **params):
+        params = dict(params, game_id=self.game.hashkey, user_id=user_id)
+        return json.loads(self.get('/api/v1/game/getInfo/', params).content)
+
+    def test_patch(self):
+        viewers = [ 'admin' ] + self.engine.user_ids
+        self.apply_to(2)
+        before = dict([ (user_id, self.get_info(user_id)['info']) for user_id in viewers ])
+        self.apply_to(3)
+        for user_id in viewers:
+            response = self.get_info(user_id, since_lsn=2)
+            self.assertEqual(response['since_lsn'], 2)
+            self.assertFalse('info' in response)
+            # 가려진 상태끼리의 diff 이므로 다른 house 의 입찰은 patch 에도 없다.
+            self.assertEqual(apply_patch(before[user_id], response['patch']), self.get_info(user_id)['info'])
+
+    def test_unknown_lsn(self):
+        self.apply_to(3)
+        response = self.get_info('admin', since_lsn=10)
+        self.assertFalse('patch' in response)
+        self.assertEqual(response['info'], self.get_info('admin')['info'])
+
+class GameListTest(GameTestCase):
+    def setUp(self):
+        super(GameListTest, self).setUp()
+        edition = Edition.objects.get(name='european')
+        (p1, p2, p3) = [ self.players[user_id] for user_id in self.engine.user_ids ]
+        for (hashkey, players) in ( ('w1', [ p1 ]), ('w2', [ p1, p2, p3 ]), ('w3', []), ('w4', [ p2 ]) ):
+            g = Game.objects.create(hashkey=hashkey, num_players=3, edition=edition)
+            for p in players:
+                g.players.add(p)
+
+    def list(self, **params):
+        response = json.loads(self.get('/api/v1/game/list/', dict(params, user_id='admin')).content)
+        self.assertTrue(response['success'], response.get('errmsg', None))
+        return ([ g['game_id'] for g in response['games'] ], response['next_cursor'])
+
+    def test_pages(self):
+        (games, cursor) = self.list(status=Game.WAITING, limit=2)
+        self.assertEqual(games, [ 'w1', 'w2' ])
+        self.assertEqual(self.list(status=Game.WAITING, limit=2, cursor=cursor), ([ 'w3', 'w4' ], None))
+
+    def test_filters(self):
+        self.assertEqual(self.list()[0], [ 'test-game', 'w1', 'w2', 'w3', 'w4' ])
+        self.assertEqual(self.list(status=Game.IN_PROGRESS)[0], [ 'test-game' ])
+        self.assertEqual(self.list(player=self.engine.user_ids[0])[0], [ 'test-game', 'w1', 'w2' ])
+        self.assertEqual(self.list(open_seat='1')[0], [ 'w1', 'w3', 'w4' ])
+        self.assertEqual(self.list(edition='none')[0], [])
+        response = json.loads(self.get('/api/v1/game/list/', { 'user_id': 'admin', 'status': 'X' }).content)
+        self.assertFalse(response['success'])
+
+    def test_queries(self):
+        ''' the ETag, the page and its players, however many games there are '''
+        auth = self.token('admin')
+        get = lambda: self.client.get('/api/v1/game/list/', { 'user_id': 'admin', 'limit': 100 }, HTTP_AUTHORIZATION=auth)
+        get()
+        with self.assertNumQueries(3):
+            get()
+        for i in range(10):
+            g = Game.objects.create(hashkey='more-' + str(i), num_players=3, edition=self.game.edition)
+            g.players.add(*self.players.values())
+        with self.assertNumQueries(3):
+            self.assertEqual(len(json.loads(get().content)['games']), 15)
+
+class MarketCounterTest(TestCase):
+    def setUp(self):
+        self.info = _played(1).info
+        for h in self.info.houses.values():
+            (h.expansion_tokens, h.stock_tokens, h.dominance_marker) = (1000, 1000, 1000)
+
+    def steps(self, seed, n=300):
+        ''' random token and marker changes on info, yielding after each '''
+        rnd = random.Random(seed)
+        names = sorted(self.info.provinces.keys())
+        users = sorted(self.info.houses.keys())
+        for i in range(n):
+            (p, u) = (rnd.choice(names), rnd.choice(users))
+            op = rnd.randint(0, 3)
+            try:
+                if op == 0:
+                    self.info.add_tokens(p, u, rnd.randint(1, 3), from_expansion=rnd.random() < 0.5, colored=rnd.random() < 0.5)
+                elif op == 1:
+                    self.info.remove_tokens(p)
+                elif op == 2:
+                    self.info.set_marker(p, u, colored=rnd.random() < 0.7)
+                else:
+                    self.info.remove_marker(p)
+            except GameInfo.ConflictOccurs:
+                pass
+            yield
+
+    def test_recount(self):
+        for _ in self.steps(0):
+            self.info.check_invariants()
+        self.assertTrue(self.info.areas)
+        for (area, a) in self.info.areas.items():
+            provinces = [ p for p in self.info.catalog.get_provinces_in_area(area) if self.info.is_occupied(p) ]
+            self.assertEqual(a['occupied'], provinces)
+
+    def test_out_of_sync(self):
+        for _ in self.steps(1, 50):
+            pass
+        name = sorted(self.info.market.keys())[0]
+        self.info.market[name] += 1
+        self.assertRaises(GameInfo.InvariantViolated, self.info.check_invariants)
+
+    def test_holdings(self):
+        for _ in self.steps(2):
+            pass
+        report = self.info.get_market_report()
+        for c in self.info.catalog.commodities.values():
+            holdings = {}
+            for p in c.provinces:
+                owner = self.info.provinces.get(p, {}).get('color-marker', None)
+                if owner != None:
+                    holdings[owner] = holdings.get(owner, 0) + 1
+            self.assertEqual(self.info.get_holdings(c.short_name), holdings)
+            for (key, h) in report[c.short_name]['houses'].items():
+                n = holdings.get(key, 0)
+                self.assertEqual(h, { 'provinces': n, 'income': n * n * c.unit_price })
+        self.assertTrue(self.info.holdings)
+
+class BatchTest(GameTestCase):
+    def test_contiguous_lsns(self):
+        self.replay(self.engine.log[:1])
+        (user_id, first) = self.engine.log[1]
+        logs = [ a for (u, a) in self.engine.log[1:3] if u == user_id ]
+        self.assertEqual(len(logs), 2)
+
+        response = json.loads(self.post_json('/api/v1/game/actions/',
+                { 'game_id': self.game.hashkey, 'user_id': user_id, 'actions': logs }).content)
+        self.assertTrue(response['success'])
+        self.assertEqual(response['lsns'], [ 2, 3 ])
+        # 마지막 lsn 까지 한 task 가 적용한다.
+        self.assertEqual(self.delayed, [ ((self.game.hashkey, 3), {}) ])
+
+        process_action(self.game.hashkey, 3)
+        g = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(g.applied_lsn, 3)
+        self.assertEqual(g.get_current_info().to_dict(), self.states[3])
+
+    def test_malformed(self):
+        self.replay(self.engine.log[:1])
+        user_id = self.engine.log[1][0]
+        for actions in ([], 'pass', [ { 'action': 'pass' }, 'pass' ], [ { 'bid': 3 } ], [ { 'action': 3 } ],
+                [ { 'action': 'pass' } ] * (views.MAX_BATCH_ACTIONS + 1)):
+            response = self.post_json('/api/v1/game/actions/',
+                    { 'game_id': self.game.hashkey, 'user_id': user_id, 'actions': actions })
+            self.assertEqual(response.status_code, 400, repr(actions))
+            self.assertFalse(json.loads(response.content)['success'])
+
+        response = self.post_json('/api/v1/game/action/',
+                { 'game_id': self.game.hashkey, 'user_id': user_id, 'action': 'pass' })
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(Game.objects.get(pk=self.game.pk).last_lsn, 1)
+        self.assertEqual(GameLog.objects.filter(game=self.game).count(), 1)
+        self.assertEqual(self.delayed, [])
+
+@override_settings(GAME_SYNC_APPLY=True)
+class SyncApplyTest(GameTestCase):
+    def setUp(self):
+        super(SyncApplyTest, self).setUp()
+        self.replay(self.engine.log[:1])
+        (self.user_id, self.action) = self.engine.log[1]
+
+    def send(self):
+        return json.loads(self.post_json('/api/v1/game/action/', { 'game_id': self.game.hashkey,
+                'user_id': self.user_id, 'action': self.action, 'sync': True }).content)
+
+    def test_applied(self):
+        response = self.send()
+        self.assertTrue(response['success'])
+        self.assertEqual((response['lsn'], response['status']), (2, GameLog.CONFIRMED))
+        self.assertEqual(self.delayed, [])
+        self.assertEqual(Game.objects.get(pk=self.game.pk).applied_lsn, 2)
+
+    def test_batch(self):
+        actions = [ a for (u, a) in self.engine.log[1:3] if u == self.user_id ]
+        response = json.loads(self.post_json('/api/v1/game/actions/', { 'game_id': self.game.hashkey,
+                'user_id': self.user_id, 'actions': actions, 'sync': True }).content)
+        self.assertEqual([ (r['lsn'], r['status']) for r in response['results'] ], [ (2, 'C'), (3, 'C') ])
+        self.assertEqual(self.delayed, [])
+
+    def test_failed(self):
+        ''' the log is written, so it is left to celery and reported as accepted, not as failed '''
+        apply_logs = tasks._apply_logs
+        def failing(*args, **kwargs):
+            raise DatabaseError('gone away')
+        tasks._apply_logs = failing
+        try:
+            response = self.send()
+        finally:
+            tasks._apply_logs = apply_logs
+
+        self.assertTrue(response['success'])
+        self.assertEqual((response['lsn'], response['status']), (2, GameLog.ACCEPTED))
+        self.assertEqual(self.delayed, [ ((self.game.hashkey, 2), {}) ])
+        self.assertEqual(GameLog.objects.get(game=self.game, lsn=2).status, GameLog.ACCEPTED)
+        # lease 는 놓았다.
+        self.assertEqual(process_action(self.game.hashkey, 2), 2)
+
+    def test_busy(self):
+        GameLease.acquire(self.game.hashkey, 'other')
+        response = self.send()
+        self.assertEqual((response['lsn'], response['status']), (2, GameLog.ACCEPTED))
+        self.assertEqual(self.delayed, [ ((self.game.hashkey, 2), {}) ])
+
+class SimulateTest(TestCase):
+    def test_counts(self):
+        catalog = RuleCatalog.from_fixture(FIXTURE, 'european')
+        st = simulate(catalog, 5, 4, seed=0, max_actions=60)
+        logs = 0
+        for i in range(5):
+            engine = Engine(catalog, 4, seed=i)
+            (attempts, accepted, error) = play(engine, RandomAgent(random.Random(i)), 60)
+            logs += len(engine.log)
+        self.assertEqual(st['actions'] + st['queued'], logs)
+        self.assertTrue(st['actions'] <= st['attempts'])
+        self.assertEqual(st['stopped_games'], sum(st['errors'].values()))
+        self.assertEqual(sum(st['final_states'].values()), 5)
+
+    def test_command(self):
+        ''' stopped games are reported, not a failure of the command '''
+        out = StringIO()
+        call_command('simulate', games=5, players=4, fixture=FIXTURE, stdout=out)
+        self.assertTrue('by agents of' in out.getvalue())
+
+class BenchmarkTest(TestCase):
+    def test_stopped_records_replay(self):
+        catalog = RuleCatalog.from_fixture(FIXTURE, 'european')
+        records = synthetic_records(catalog, 5, 3, seed=0, max_actions=60)
+        t = measure(records, Timings())
+        # 받아들여진 log 만 기록되므로 멈춘 game 도 끝까지 replay 된다.
+        self.assertEqual(t.errors, [])
+        for r in records:
+            if r['stopped'] != None:
+                self.assertEqual(r['stopped']['lsn'], len(r['logs']) + 1)
+
+    def test_command_compares_with_baseline(self):
+        (fd, path) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            call_command('benchmark', synthetic=5, repeat=1, fixture=FIXTURE,
+                         process_action=False, output=path, stdout=StringIO())
+            out = StringIO()
+            call_command('benchmark', synthetic=5, repeat=1, fixture=FIXTURE,
+                         process_action=False, baseline=path, threshold=100.0, stdout=out)
+            self.assertTrue('no regression against' in out.getvalue())
+        finally:
+            os.remove(path)
+
+class MetricsTest(GameTestCase):
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        metrics.reset()
+
+    def test_actions(self):
+        g = self.replay(self.engine.log)
+        summary = json.loads(self.client.get('/api/v1/game/metrics/', { 'format': 'json' }).content)
+        rows = summary['aor_actions_total']
+        self.assertEqual(sum([ r['value'] for r in rows ]), g.applied_lsn)
+        self.assertEqual(set([ r['labels']['result'] for r in rows ]), set([ 'confirmed' ]))
+        seconds = summary['aor_action_seconds']
+        self.assertEqual(sum([ r['count'] for r in seconds ]), g.applied_lsn)
+
+        text = self.client.get('/api/v1/game/metrics/').content
+        self.assertTrue('action="' + Action.DEAL_CARDS + '",result="confirmed"} 1\n' in text)
+
+    def test_other_hosts(self):
+        self.assertEqual(self.client.get('/api/v1/game/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+class SlotsTest(TestCase):
+    def setUp(self):
+        self.info = _played(1).info
+
+    def test_no_dict(self):
+        h = self.info.houses.values()[0]
+        for obj in (self.info, h, h.turn_logs[0], self.info.house_bidding_log[0]):
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj).__name__)
+            self.assertRaises(AttributeError, setattr, obj, 'no_such_field', 1)
+
+    def test_copy(self):
+        copied = self.info.copy()
+        self.assertEqual(copied.to_dict(), self.info.to_dict())
+        key = sorted(copied.houses.keys())[0]
+        copied.houses[key].cash += 1
+        copied.houses[key].turn_logs[0].cash += 1
+        copied.house_bidding_log[0].bid = -1
+        self.assertNotEqual(copied.to_dict(), self.info.to_dict())
+        self.assertEqual(self.info.to_dict(), _played(1).info.to_dict())
+
+class StateStackTest(TestCase):
+    def setUp(self):
+        self.info = _played(1).info.copy()
+
+    def test_push_and_pop(self):
+        self.info.set_state(GameState.ALL, GameState.TOKEN_BIDDING)
+        self.info.push_state('p1', GameState.REMOVE_MARKER, { 'province': 'Ven' })
+        self.assertEqual(self.info.get_state(), ('p1', GameState.REMOVE_MARKER, { 'province': 'Ven' }))
+        self.assertEqual(self.info.state, 'p1.' + GameState.REMOVE_MARKER + '.' + GameState.ALL + '.' + GameState.TOKEN_BIDDING)
+        self.assertEqual(self.info.pop_state(), [ 'p1', GameState.REMOVE_MARKER, { 'province': 'Ven' } ])
+        self.assertEqual(self.info.get_state(), (GameState.ALL, GameState.TOKEN_BIDDING, None))
+        self.info.pop_state()
+        self.assertEqual(self.info.pop_state(), None)
+        self.assertEqual(self.info.get_state(), (None, None, None))
+
+    def test_legacy_state(self):
+        ''' the dotted string of stored games and API clients, top of the stack first '''
+        self.info.state = 'p2.' + GameState.REMOVE_MARKER + '.' + GameState.ALL + '.' + GameState.TOKEN_BIDDING
+        self.assertEqual(self.info.state_stack, [
+                [ GameState.ALL, GameState.TOKEN_BIDDING, None ],
+                [ 'p2', GameState.REMOVE_MARKER, None ],
+            ])
+        self.info.state = ''
+        self.assertEqual(self.info.state_stack, [])
+
+    def test_dispatch(self):
+        for (name, cls) in GameState.HANDLERS.items():
+            self.info.set_state('p1', name)
+            state = GameState.getInstance(self.info)
+            self.assertTrue(type(state) is cls, name)
+            self.assertEqual(state.actor, 'p1')
+            self.assertTrue(state.info is self.info)
+        self.info.set_state('p1', 'no_such_state')
+        self.assertEqual(GameState.getInstance(self.info), None)
+
+@override_settings(GAME_VALIDATE_ACTIONS=True)
+class DryRunTest(GameTestCase):
+    def setUp(self):
+        super(DryRunTest, self).setUp()
+        views._dry_run_infos.clear()
+        self.replay(self.engine.log[:1])
+
+    def send(self, user_id, action):
+        return json.loads(self.post_json('/api/v1/game/action/', { 'game_id': self.game.hashkey,
+                'user_id': user_id, 'action': action }).content)
+
+    def test_rejected(self):
+        (p1, p2) = self.engine.user_ids[:2]
+        card = [ l for l in self.states[1]['house_bidding_log'] if l['user_id'] == p2 ][0]['draw_cards'][0]
+        action = { 'action': Action.DISCARD, 'card': card }
+        response = self.send(p1, action)
+        self.assertFalse(response['success'])
+        self.assertFalse('lsn' in response)
+        self.assertEqual(Game.objects.get(pk=self.game.pk).last_lsn, 1)
+        self.assertFalse(GameLog.objects.filter(game=self.game, lsn=2).exists())
+        self.assertEqual(self.delayed, [])
+        # 검사하지 않으면 lsn 을 받고 process_action 에서야 실패한다.
+        with self.settings(GAME_VALIDATE_ACTIONS=False):
+            self.assertEqual(self.send(p1, action)['lsn'], 2)
+
+    def test_accepted(self):
+        (user_id, action) = self.engine.log[1]
+        response = self.send(user_id, action)
+        self.assertTrue(response['success'], response.get('errmsg', None))
+        self.assertEqual(response['lsn'], 2)
+
+    def test_backlog_is_not_checked(self):
+        ''' with logs still to apply the state the action meets is not known '''
+        self.submit(self.engine.log[1:2], 2)
+        response = self.send(self.engine.user_ids[0], { 'action': Action.BID, 'bid': 1000 })
+        self.assertTrue(response['success'])
+        self.assertEqual(response['lsn'], 3)
+
+class LegalActionsTest(GameTestCase):
+    def legal_actions(self, user_id):
+        return json.loads(self.get('/api/v1/game/getLegalActions/',
+                { 'game_id': self.game.hashkey, 'user_id': user_id }).content)
+
+    def test_house_bidding(self):
+        self.replay(self.engine.log[:1])
+        for l in self.states[1]['house_bidding_log']:
+            response = self.legal_actions(l['user_id'])
+            self.assertEqual(response['applied_lsn'], 1)
+            self.assertEqual(response['state'], GameState.ALL + '.' + GameState.HOUSE_BIDDING)
+            self.assertEqual(response['actions'], [
+                    { 'action': Action.DISCARD, 'card': { 'one_of': l['draw_cards'] } },
+                    { 'action': Action.BID, 'bid': { 'min': 0, 'max': 40 } },
+                ])
+
+    def test_not_a_player(self):
+        self.replay(self.engine.log[:1])
+        self.assertEqual(self.legal_actions('admin')['actions'], [])
 
-# Create your tests here.
+    def test_auto(self):
+        ''' deal_cards is sent by the server, not by a player '''
+        for user_id in self.engine.user_ids:
+            self.assertEqual(self.legal_actions(user_id)['actions'], [])
@@ -10,7 +10,11 @@ urlpatterns = patterns('',
     url(r'^quit/$', views.quit),
     url(r'^start/$', views.start),
     url(r'^action/$', views.action),
+    url(r'^actions/$', views.actions),
     url(r'^getInfo/$', views.get_info),
+    url(r'^getMarketReport/$', views.get_market_report),
+    url(r'^getLegalActions/$', views.get_legal_actions),
+    url(r'^metrics/$', views.get_metrics),
     url(r'^rollback/$', views.rollback),
     #url(r'^registerToken/$', views.registerToken),
 )
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.db import IntegrityError, transaction
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import Q, F, Count, Max
+from django.views.decorators.http import condition
+from django.utils.http import parse_etags, quote_etag
 from django.utils.datastructures import MultiValueDictKeyError
 from django.core import serializers
 
@@ -11,12 +14,25 @@ import random
 import string
 import json
 import datetime
+import hashlib
+import logging
+import uuid
+from types import ListType
 
-from game.models import Game, GameLog, GameInfo, HouseInfo, HouseTurnLog, HouseBiddingLog, GameInfoEncoder, GameInfoDecoder, Action
+from game.models import Game, GameLog, GameSnapshot, GameLease, GameInfo, HouseInfo, HouseTurnLog, HouseBiddingLog, GameInfoEncoder, GameInfoDecoder, Action, GameState
 from rule.models import Edition
 from player.models import Player
 from player.decorators import requires_access_token
-from game.tasks import process_action
+from player.cache import membership_cache
+from game.tasks import process_action, replay_held
+from game.notify import lsn_notifier
+from game.cache import info_cache, LocalLRUBackend
+from game.engine import dry_run
+from game.legal import legal_actions
+from game.patch import diff
+from game.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 def _generate_hashkey(size=15):
     c = string.letters + string.digits
@@ -46,16 +62,71 @@ def create(request):
 
     return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
 
+def _etag(s):
+    ''' unquoted, as etag_func of condition() returns it '''
+    return hashlib.md5(s.encode('utf-8')).hexdigest()
+
+LIST_DEFAULT_LIMIT = 20
+LIST_MAX_LIMIT = 100
+
+# can raise ValueError
+def _filter_games(params):
+    statuses = params.get('status', Game.WAITING + ',' + Game.IN_PROGRESS).split(',')
+    for s in statuses:
+        if s not in (Game.WAITING, Game.IN_PROGRESS):
+            raise ValueError('status must be one of ' + Game.WAITING + ', ' + Game.IN_PROGRESS)
+    games = Game.objects.filter(status__in=statuses)
+
+    if 'edition' in params:
+        games = games.filter(edition__name=params['edition'])
+    if 'player' in params:
+        # players 를 join 하면 아래 Count 가 틀어지므로 subquery 로 거른다.
+        joined = Game.players.through.objects.filter(player__user_id=params['player']).values('game_id')
+        games = games.filter(id__in=joined)
+    if params.get('open_seat', None) == '1':
+        games = games.annotate(num_joined=Count('players')).filter(num_joined__lt=F('num_players'))
+    return games
+
+def _list_etag(request):
+    ''' over the games the request's filters and cursor select; None (no ETag) for bad parameters '''
+    # 목록에 보이는 값이 바뀌면 date_modified 가 갱신되고, 목록에서 빠지면 count 가 줄어든다.
+    try:
+        games = _filter_games(request.GET)
+        if 'cursor' in request.GET:
+            games = games.filter(id__gt=int(request.GET['cursor']))
+    except ValueError:
+        return None
+    marker = games.aggregate(count=Count('id'), modified=Max('date_modified'))
+    return _etag('list:%s:%d:%s' % (request.GET.urlencode(), marker['count'], marker['modified']))
+
 @requires_access_token()
+@condition(etag_func=_list_etag)
 def list(request):
+    ''' games in the order of creation, a page at a time
+
+    Filters: status (W, P or both, comma separated), edition, player (user_id), open_seat=1.
+    Pass next_cursor of a response as cursor to get the next page.
+    '''
     response_data = {}
-    games = Game.objects.all().filter(
-        Q(status__exact=Game.WAITING) | Q(status__exact=Game.IN_PROGRESS))
-    response_data['games'] = []
-    for g in games:
-        response_data['games'].append(g.to_dict())
-    response_data['success'] = True
-    return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
+
+    try:
+        limit = min(int(request.GET.get('limit', LIST_DEFAULT_LIMIT)), LIST_MAX_LIMIT)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        games = _filter_games(request.GET)
+        if 'cursor' in request.GET:
+            games = games.filter(id__gt=int(request.GET['cursor']))
+        games = games.select_related('edition').prefetch_related('players').order_by('id')[:limit + 1]
+
+        games = [g for g in games]
+        response_data['games'] = [g.to_dict() for g in games[:limit]]
+        response_data['next_cursor'] = games[limit - 1].id if len(games) > limit else None
+        response_data['success'] = True
+    except ValueError as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+
+    return HttpResponse(json.dumps(response_data, separators=(',', ':')), content_type="application/json")
 
 
 @csrf_exempt
@@ -97,9 +168,12 @@ def join(request):
 
             if ( g.status == Game.WAITING and g.players.count() < g.num_players ) :
                 g.players.add(p)
+                g.save(update_fields=['date_modified'])
                 response_data['success'] = True
             else :
                 raise Game.UnableToJoin('unable to join game')
+        # commit 된 뒤에 지워야 이전 값이 다시 캐시되지 않는다.
+        membership_cache.invalidate(p.user_id, g.hashkey)
 
     except (MultiValueDictKeyError, Game.DoesNotExist, Game.UnableToJoin, Player.DoesNotExist) as e:
         response_data['success'] = False
@@ -119,9 +193,11 @@ def quit(request):
 
             if ( g.status == Game.WAITING  ) :
                 g.players.remove(p)
+                g.save(update_fields=['date_modified'])
                 response_data['success'] = True
             else :
                 raise Game.UnableToQuit('unable to quit game')
+        membership_cache.invalidate(p.user_id, g.hashkey)
 
     except (MultiValueDictKeyError, Game.DoesNotExist, Game.UnableToQuit, Player.DoesNotExist) as e:
         response_data['success'] = False
@@ -145,7 +221,7 @@ def start(request):
                 g.status = Game.IN_PROGRESS
                 g.date_started = datetime.datetime.now()
                 info = GameInfo(g)
-                g.initial_info = json.dumps(info, cls=GameInfoEncoder)
+                g.set_initial_info(info)
                 g.current_info = g.initial_info
                 g.last_lsn += 1
                 a = GameLog(
@@ -174,51 +250,196 @@ def get_info(request):
     response_data = {}
 
     try:
+        # wait_for_lsn 이 주어지면 그 lsn 이 적용될 때까지 (최대 timeout 초) 기다렸다가 응답한다.
+        # worker 를 잡고 있으므로 timeout 은 settings.GAME_WAIT_FOR_LSN 의 MAX_TIMEOUT 을 넘지 않는다.
+        if 'wait_for_lsn' in request.GET:
+            lsn_notifier.wait(
+                request.GET['game_id'],
+                int(request.GET['wait_for_lsn']),
+                float(request.GET.get('timeout', lsn_notifier.max_timeout)),
+            )
+
+        game_id = request.GET['game_id']
+        viewer = request.GET['user_id']
+        since_lsn = int(request.GET['since_lsn']) if 'since_lsn' in request.GET else None
+        keys = Game.objects.filter(hashkey=game_id).values_list('generation', 'applied_lsn', 'last_lsn').first()
+        if keys == None:
+            raise Game.DoesNotExist('Game matching query does not exist.')
+        key = info_cache.make_key(game_id, keys[0], keys[1], keys[2], viewer, since_lsn)
+        if _etag(key) in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = quote_etag(_etag(key))
+            return response
+        content = info_cache.get(key)
+        if content != None:
+            response = HttpResponse(content, content_type="application/json")
+            response['ETag'] = quote_etag(_etag(key))
+            return response
+
         with transaction.atomic():
-            g = Game.objects.get(hashkey=request.GET['game_id'])
-            response_data['info'] = json.loads(g.current_info, cls=GameInfoDecoder)
+            g = Game.objects.get(hashkey=game_id)
+            infos = g.get_info_since(since_lsn) if since_lsn != None else None
+            info = infos[1] if infos != None else g.get_current_info()
             response_data['applied_lsn'] = g.applied_lsn
             response_data['last_lsn'] = g.last_lsn
             response_data['success'] = True
 
-        if request.GET['user_id'] != "admin":
-            response_data['info'].mask(request.GET['user_id'])
-
-    except (MultiValueDictKeyError, Game.DoesNotExist) as e:
+        if viewer != "admin":
+            info.mask(viewer)
+
+        patch = None
+        if infos != None:
+            # 가려진 상태끼리 비교하므로 숨겨진 패나 입찰 내용은 diff 에 나타나지 않는다.
+            if viewer != "admin":
+                infos[0].mask(viewer)
+            d = info.to_api_dict()
+            patch = diff(infos[0].to_api_dict(), d)
+            if len(json.dumps(patch)) >= len(json.dumps(d)):
+                patch = None
+
+        if patch != None:
+            response_data['since_lsn'] = since_lsn
+            response_data['patch'] = patch
+        else:
+            # since_lsn 이 없거나 diff 가 전체보다 작지 않으면 전체 상태를 보낸다.
+            response_data['info'] = info
+
+        content = json.dumps(response_data, cls=GameInfoEncoder, indent=2)
+        key = info_cache.make_key(game_id, g.generation, g.applied_lsn, g.last_lsn, viewer, since_lsn)
+        info_cache.set(key, content)
+        response = HttpResponse(content, content_type="application/json")
+        response['ETag'] = quote_etag(_etag(key))
+        return response
+
+    except (MultiValueDictKeyError, ValueError, Game.DoesNotExist) as e:
         response_data['success'] = False
         response_data['errmsg'] = type(e).__name__ + ": " + e.message
     return HttpResponse(json.dumps(response_data, cls=GameInfoEncoder, indent=2), content_type="application/json")
         
+@requires_access_token(func_get_user_id=_get_user_id_from_get)
+def get_market_report(request):
+    ''' each house's holdings and commodity card income for every commodity '''
+    response_data = {}
+
+    try:
+        g = Game.objects.get(hashkey=request.GET['game_id'])
+        response_data['report'] = g.get_current_info().get_market_report()
+        response_data['applied_lsn'] = g.applied_lsn
+        response_data['success'] = True
+    except (MultiValueDictKeyError, Game.DoesNotExist) as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+    return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
+
+@requires_access_token(func_get_user_id=_get_user_id_from_get)
+def get_legal_actions(request):
+    ''' actions the user may send in the state as of applied_lsn, see game.legal '''
+    response_data = {}
+
+    try:
+        game_id = request.GET['game_id']
+        viewer = request.GET['user_id']
+        keys = Game.objects.filter(hashkey=game_id).values_list('generation', 'applied_lsn').first()
+        if keys == None:
+            raise Game.DoesNotExist('Game matching query does not exist.')
+        content = info_cache.get(info_cache.make_legal_key(game_id, keys[0], keys[1], viewer))
+        if content != None:
+            return HttpResponse(content, content_type="application/json")
+
+        g = Game.objects.get(hashkey=game_id)
+        info = _applied_info(g)
+        response_data['applied_lsn'] = g.applied_lsn
+        response_data['state'] = info.state
+        response_data['actions'] = legal_actions(info, viewer)
+        response_data['success'] = True
+
+        content = json.dumps(response_data, indent=2)
+        info_cache.set(info_cache.make_legal_key(game_id, g.generation, g.applied_lsn, viewer), content)
+        return HttpResponse(content, content_type="application/json")
+
+    except (MultiValueDictKeyError, Game.DoesNotExist) as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+    return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
+
+def get_metrics(request):
+    ''' process_action metrics of this process; Prometheus text, or percentiles with format=json '''
+    allowed = getattr(settings, 'GAME_METRICS', {}).get('ALLOWED_IPS', ('127.0.0.1',))
+    if request.META.get('REMOTE_ADDR', None) not in allowed:
+        raise Http404
+
+    if request.GET.get('format', None) == 'json':
+        return HttpResponse(json.dumps(metrics.summary(), indent=2), content_type="application/json")
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
+# rollback 이 적용 중인 worker 를 기다리는 시간 (초)
+ROLLBACK_LEASE_WAIT = 10
+
 @csrf_exempt
 @requires_access_token(func_get_user_id=_get_user_id_from_post)
 def rollback(request):
+    ''' reset the game to lsn and replay the logs from the nearest snapshot
+
+    This holds the game's GameLease from the reset until the replay is done; otherwise
+    a process_action run could apply the reset logs as new ones and queue their
+    actions a second time.
+    '''
     response_data = {}
+    owner = uuid.uuid4().hex
 
     try:
-        with transaction.atomic():
-            lsn = int(request.POST['lsn'])
-            g = Game.objects.get(hashkey=request.POST['game_id'])
-            if lsn == 0 :
-                g.status = Game.WAITING
-                g.last_lsn = 0
-                g.applied_lsn = 0
-                info = GameInfo(g)
-                g.current_info = json.dumps(info, cls=GameInfoEncoder)
-                g.save()
-                GameLog.objects.filter(game=g).delete()
-            else :
-                g.last_lsn = lsn
-                g.applied_lsn = 0
-                info = GameInfo(g)
-                g.current_info = json.dumps(info, cls=GameInfoEncoder)
-                g.save()
-                GameLog.objects.filter(game=g, lsn__gt=lsn).delete()
-                GameLog.objects.filter(game=g, lsn__lte=lsn).update(status=GameLog.ACCEPTED)
-
-        if lsn > 0 :
-            process_action.delay(g.hashkey, lsn, replay=True)
+        lsn = int(request.POST['lsn'])
+        game_id = request.POST['game_id']
+        if GameLease.wait(game_id, owner, ROLLBACK_LEASE_WAIT) == False:
+            raise Game.UnableToRollback('the game is being applied, try again later')
+        try:
+            with transaction.atomic():
+                g = Game.objects.select_for_update().get(hashkey=game_id)
+                # rollback 뒤에는 같은 lsn 이 다른 내용을 가질 수 있다.
+                g.generation += 1
+                if lsn == 0 :
+                    g.status = Game.WAITING
+                    g.last_lsn = 0
+                    g.applied_lsn = 0
+                    info = GameInfo(g)
+                    g.set_current_info(info)
+                    g.save()
+                    GameLog.objects.filter(game=g).delete()
+                    GameSnapshot.objects.filter(game=g).delete()
+                else :
+                    # 가장 가까운 snapshot 부터 lsn 까지만 replay 한다.
+                    s = g.get_nearest_snapshot(lsn)
+                    g.last_lsn = lsn
+                    if s != None :
+                        g.applied_lsn = s.lsn
+                        g.info_lsn = s.lsn
+                        g.current_info = s.info
+                    elif g.initial_info != None :
+                        # 처음부터 replay 한다. initial_info 에 있는 seed 로 같은 카드와 주사위가 나온다.
+                        g.applied_lsn = 0
+                        g.info_lsn = 0
+                        g.current_info = g.initial_info
+                    else :
+                        g.applied_lsn = 0
+                        info = GameInfo(g)
+                        g.set_current_info(info)
+                    g.save()
+                    GameLog.objects.filter(game=g, lsn__gt=lsn).delete()
+                    GameLog.objects.filter(game=g, lsn__gt=g.applied_lsn, lsn__lte=lsn).update(status=GameLog.ACCEPTED)
+                    GameSnapshot.objects.filter(game=g, lsn__gt=lsn).delete()
+
+            if lsn > g.applied_lsn :
+                g = replay_held(g.hashkey, lsn)
+        finally:
+            GameLease.release(game_id, owner)
+
+        # rollback 중에 들어온 action 의 task 는 lease 를 잡지 못하고 끝났다.
+        g = Game.objects.get(hashkey=game_id)
+        if g.applied_lsn < g.last_lsn :
+            process_action.delay(g.hashkey, g.last_lsn)
         response_data['success'] = True
-    except (MultiValueDictKeyError, Game.DoesNotExist) as e:
+        response_data['applied_lsn'] = g.applied_lsn
+    except (MultiValueDictKeyError, ValueError, Game.DoesNotExist, Game.UnableToRollback) as e:
         response_data['success'] = False
         response_data['errmsg'] = type(e).__name__ + ": " + e.message
     return HttpResponse(json.dumps(response_data, cls=GameInfoEncoder, indent=2), content_type="application/json")
@@ -228,6 +449,51 @@ def _get_user_id_from_action(request):
     body = json.loads(request.body)
     return body['user_id'] if 'user_id' in body else None
 
+def _apply_now(g, first_lsn):
+    ''' apply first_lsn .. g.last_lsn in this request with process_action itself
+
+    Only when the game was idle, i.e. nothing before first_lsn was waiting.
+    Returns the GameLogs in lsn order, or None if the logs are left to celery: when
+    another process holds the lease, or when applying raised. The logs are written
+    and accepted either way, so a client must not send them again.
+    '''
+    if not getattr(settings, 'GAME_SYNC_APPLY', False) or g.applied_lsn != first_lsn - 1:
+        return None
+    try:
+        if process_action(g.hashkey, g.last_lsn) == None:
+            # 다른 process 가 lease 를 잡고 있다.
+            return None
+    except Exception as e:
+        # handler 의 오류는 process_action 이 log 를 실패로 기록하고 넘어가므로 DB 등의 문제이다.
+        # log 는 이미 쓰였으므로 celery 가 다시 시도한다.
+        logger.exception('Applying ' + g.hashkey + ': ' + str(g.last_lsn) + ' in the request failed')
+        return None
+    return GameLog.objects.filter(game=g, lsn__gte=first_lsn, lsn__lte=g.last_lsn).order_by('lsn')
+
+# dry run 의 출발점이 되는 GameInfo, (game, generation, applied_lsn) 마다 하나. 복사본에만 적용한다.
+# generation 은 DB 에 있으므로 다른 process 의 rollback 뒤에도 예전 상태를 쓰지 않는다.
+_dry_run_infos = LocalLRUBackend(max_entries=256)
+
+def _applied_info(g):
+    ''' GameInfo as of g.applied_lsn, shared; must not be changed '''
+    key = (g.hashkey, g.generation, g.applied_lsn)
+    info = _dry_run_infos.get(key)
+    if info == None:
+        info = g.get_current_info()
+        _dry_run_infos.set(key, info)
+    return info
+
+def _check_actions(g, actions):
+    ''' raise what process_action would fail the first of [ (user_id, action), ... ] with
+
+    Only when the game is idle; with a backlog the actions meet a state that is not known yet.
+    The actions they queue are followed too (see game.engine.dry_run), but only the submitted
+    actions are rejected: a queued action that fails is recorded by process_action as well.
+    '''
+    if not getattr(settings, 'GAME_VALIDATE_ACTIONS', False) or g.applied_lsn != g.last_lsn:
+        return
+    dry_run(_applied_info(g), actions)
+
 # TODO PRE_PHASE, POST_PHASE 는 이 view를 통해 보낼 수 없도록 한다.
 @csrf_exempt
 @requires_access_token(func_get_user_id=_get_user_id_from_action)
@@ -237,12 +503,17 @@ def action(request):
     try:
         body = json.loads(request.body)
 
+        action = body['action']
+        Action.check_shape(action)
+
         with transaction.atomic():
             g = Game.objects.get(hashkey=body['game_id'])
             p = Player.objects.get(user_id=body['user_id'])
-            action = body['action']
             if ( ( g.status == Game.IN_PROGRESS ) 
-                and g.players.filter(user_id=body['user_id']).exists() ):
+                and membership_cache.is_member(body['user_id'], g.hashkey,
+                        lambda: g.players.filter(user_id=body['user_id']).exists()) ):
+                # 실패할 action 은 lsn 을 쓰기 전에 돌려보낸다.
+                _check_actions(g, [ (body['user_id'], action) ])
                 g.last_lsn += 1
                 a = GameLog(
                         game=g,
@@ -258,10 +529,94 @@ def action(request):
                 raise GameLog.WriteFailed('unable to write action log')
         
         # 여기까지 왔으면, transaction은 정상 종료된 것이다.
-        process_action.delay(g.hashkey, a.lsn)
+        applied = _apply_now(g, a.lsn) if body.get('sync', False) == True else None
+        if applied != None:
+            l = applied[0]
+            response_data['status'] = l.status
+            response_data['msg'] = l.get_msg(body['user_id'])
+        else:
+            if body.get('sync', False) == True:
+                # 아직 적용하지 못했을 뿐 받아들인 action 이다.
+                response_data['status'] = GameLog.ACCEPTED
+            process_action.delay(g.hashkey, a.lsn)
+
+    except (KeyError, ValueError, Game.DoesNotExist, Player.DoesNotExist, GameLog.WriteFailed,
+            GameState.NotSupportedAction, GameState.InvalidAction,
+            Action.InvalidParameter, Action.WarNotResolved) as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+    except Action.Malformed as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+        return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json", status=400)
+
+    return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
 
-    except (KeyError, ValueError, Game.DoesNotExist, Player.DoesNotExist, GameLog.WriteFailed) as e:
+# actions 한 번에 받을 수 있는 action 의 수
+MAX_BATCH_ACTIONS = 50
+
+@csrf_exempt
+@requires_access_token(func_get_user_id=_get_user_id_from_action)
+def actions(request):
+    ''' ordered list of one player's actions; they get contiguous lsns and are applied by one task '''
+    response_data = {}
+
+    try:
+        body = json.loads(request.body)
+        action_list = body['actions']
+        # list 는 이 module 의 view 이름이다.
+        if not isinstance(action_list, ListType) or not 0 < len(action_list) <= MAX_BATCH_ACTIONS:
+            raise Action.Malformed("'actions' must be a list of 1 to " + str(MAX_BATCH_ACTIONS) + " actions")
+        # lsn 을 받은 뒤에는 실패로 기록될 뿐이므로 action 이 아닌 것은 여기서 돌려보낸다.
+        for action in action_list:
+            Action.check_shape(action)
+
+        with transaction.atomic():
+            g = Game.objects.get(hashkey=body['game_id'])
+            p = Player.objects.get(user_id=body['user_id'])
+            if ( ( g.status == Game.IN_PROGRESS ) 
+                and membership_cache.is_member(body['user_id'], g.hashkey,
+                        lambda: g.players.filter(user_id=body['user_id']).exists()) ):
+                # 하나라도 실패할 것이면 아무것도 쓰지 않는다.
+                _check_actions(g, [ (body['user_id'], a) for a in action_list ])
+                logs = []
+                for action in action_list:
+                    g.last_lsn += 1
+                    a = GameLog(
+                            game=g,
+                            player=p,
+                            lsn=g.last_lsn,
+                        )
+                    a.set_log(action)
+                    logs.append(a)
+                g.save()
+                GameLog.objects.bulk_create(logs)
+                response_data['success'] = True
+                response_data['lsns'] = [ a.lsn for a in logs ]
+            else :
+                raise GameLog.WriteFailed('unable to write action log')
+
+        applied = _apply_now(g, logs[0].lsn) if body.get('sync', False) == True else None
+        if applied != None:
+            response_data['results'] = [ {
+                    'lsn' : l.lsn,
+                    'status' : l.status,
+                    'msg' : l.get_msg(body['user_id']),
+                } for l in applied if l.lsn <= logs[-1].lsn ]
+        else:
+            if body.get('sync', False) == True:
+                response_data['results'] = [ { 'lsn' : a.lsn, 'status' : GameLog.ACCEPTED, 'msg' : [] } for a in logs ]
+            # 마지막 lsn 까지 한 task 가 모두 적용한다.
+            process_action.delay(g.hashkey, g.last_lsn)
+
+    except (KeyError, ValueError, Game.DoesNotExist, Player.DoesNotExist, GameLog.WriteFailed,
+            GameState.NotSupportedAction, GameState.InvalidAction,
+            Action.InvalidParameter, Action.WarNotResolved) as e:
+        response_data['success'] = False
+        response_data['errmsg'] = type(e).__name__ + ": " + e.message
+    except Action.Malformed as e:
         response_data['success'] = False
         response_data['errmsg'] = type(e).__name__ + ": " + e.message
+        return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json", status=400)
 
     return HttpResponse(json.dumps(response_data, indent=2), content_type="application/json")
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from django.utils import timezone
+
+# In-process caches for the checks done on every API call. Each process keeps
+# its own copy, so an invalidation reaches only the process that made the
+# change; the TTLs bound how long another process may keep using stale data.
+
+class TTLCache(object):
+    MISS = object()
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' cached value, or TTLCache.MISS '''
+        entry = self._entries.get(key, None)
+        if entry == None or entry[1] <= time.time():
+            return TTLCache.MISS
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl == None else ttl
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._purge(now)
+            self._entries[key] = (value, now + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _purge(self, now):
+        for key in [k for (k, e) in self._entries.iteritems() if e[1] <= now]:
+            del self._entries[key]
+        # 그래도 넘치면 전부 버린다. 다음 요청부터 다시 채워진다.
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+class TokenCache(TTLCache):
+    ''' token -> (user_id, expires), or None for a token that is not registered '''
+    TTL = 60
+    NEGATIVE_TTL = 10
+
+    def __init__(self):
+        super(TokenCache, self).__init__(TokenCache.TTL)
+
+    def set_token(self, token, user_id, expires):
+        # 만료된 뒤까지 캐시하지 않는다.
+        ttl = min(TokenCache.TTL, (expires - timezone.now()).total_seconds())
+        self.set(token, (user_id, expires), ttl)
+
+    def set_unknown(self, token):
+        self.set(token, None, TokenCache.NEGATIVE_TTL)
+
+class MembershipCache(TTLCache):
+    ''' (user_id, game_id) of players who have joined the game
+
+    Only members are cached. A player who has just joined in another process must
+    not be refused for the rest of a TTL, while players only quit a waiting game,
+    which does not accept actions anyway.
+    '''
+    TTL = 60
+
+    def __init__(self):
+        super(MembershipCache, self).__init__(MembershipCache.TTL)
+
+    def is_member(self, user_id, game_id, load):
+        ''' load() is called to read the membership unless it is cached '''
+        if self.get((user_id, game_id)) == True:
+            return True
+        member = load()
+        if member == True:
+            self.set((user_id, game_id), True)
+        return member
+
+    def invalidate(self, user_id, game_id):
+        self.delete((user_id, game_id))
+
+token_cache = TokenCache()
+membership_cache = MembershipCache()
@@ -1,33 +1,47 @@
 # -*- coding: utf-8 -*-
 from django.http import HttpResponse
+from django.utils import timezone
 
 from functools import wraps
 
 import json
 
 from player.models import Player, AccessToken
+from player.cache import token_cache, TokenCache
 
 # func_get_user_id 는 request 를 parameter로 받는 함수
 # None이면 user_id check를 수행하지 않음
 def requires_access_token(func_get_user_id=None):
     def _wrapper(func_view):
         def _decorator(request, *args, **kwargs):
-            return func_view(request, *args, **kwargs)
             try:
                 http_authorization = request.META.get('HTTP_AUTHORIZATION', None)
-                if http_authorization == None :
+                if http_authorization == None or len(http_authorization.split()) < 2 :
                     raise AccessToken.NotFound('')
 
                 token_str = http_authorization.split()[1] # [0] must be Bearer
-                t = AccessToken.objects.get(token=token_str)
+
+                # 매 요청마다 DB 를 읽지 않도록 token 정보는 token_cache 에 둔다.
+                cached = token_cache.get(token_str)
+                if cached is TokenCache.MISS:
+                    try:
+                        t = AccessToken.objects.select_related('player').get(token=token_str)
+                    except AccessToken.DoesNotExist:
+                        token_cache.set_unknown(token_str)
+                        raise
+                    cached = (t.player.user_id, t.expires)
+                    token_cache.set_token(token_str, t.player.user_id, t.expires)
+                elif cached == None:
+                    raise AccessToken.DoesNotExist('AccessToken matching query does not exist.')
+                (user_id, expires) = cached
 
                 if ( func_get_user_id != None ):
                     req_user_id = func_get_user_id(request)
-                    if ( req_user_id != t.player.user_id ) :
+                    if ( req_user_id != user_id ) :
                         raise AccessToken.Invalid('user_id does not match')
 
-                if t.is_expired() :
-                    raise AccessToken.Expired(t.expires)
+                if timezone.now() >= expires :
+                    raise AccessToken.Expired(str(expires))
 
             except (AccessToken.DoesNotExist, AccessToken.NotFound, AccessToken.Expired, AccessToken.Invalid) as e:
                 response_data = {}
@@ -1,3 +1,95 @@
+# -*- coding: utf-8 -*-
+import threading
+
 from django.test import TestCase
 
-# Create your tests here.
+from player.cache import TTLCache, MembershipCache
+from player.models import AccessToken
+from player.tokeninfo import TokenInfoClient, StubProvider
+
+class TTLCacheTest(TestCase):
+    def test_get_set(self):
+        c = TTLCache(60)
+        self.assertTrue(c.get('k') is TTLCache.MISS)
+        c.set('k', None)
+        self.assertEqual(c.get('k'), None)
+        c.delete('k')
+        self.assertTrue(c.get('k') is TTLCache.MISS)
+
+    def test_expires(self):
+        c = TTLCache(60)
+        c.set('k', 1, ttl=-1)
+        self.assertTrue(c.get('k') is TTLCache.MISS)
+        c.set('k', 1)
+        c._entries['k'] = (1, 0)
+        self.assertTrue(c.get('k') is TTLCache.MISS)
+
+    def test_max_entries(self):
+        c = TTLCache(60, max_entries=3)
+        for i in range(10):
+            c.set(i, i)
+        self.assertTrue(len(c._entries) <= 3)
+        self.assertEqual(c.get(9), 9)
+
+class MembershipCacheTest(TestCase):
+    def test_only_members_are_cached(self):
+        c = MembershipCache()
+        loads = []
+        def load(member):
+            def _load():
+                loads.append(member)
+                return member
+            return _load
+
+        # 다른 process 에서 방금 join 했을 수 있으므로 member 가 아니라는 결과는 다시 읽는다.
+        self.assertFalse(c.is_member('u', 'g', load(False)))
+        self.assertTrue(c.is_member('u', 'g', load(True)))
+        self.assertTrue(c.is_member('u', 'g', load(False)))
+        self.assertEqual(loads, [ False, True ])
+
+        c.invalidate('u', 'g')
+        self.assertFalse(c.is_member('u', 'g', load(False)))
+
+class CountingProvider(StubProvider):
+    def __init__(self, **options):
+        super(CountingProvider, self).__init__(**options)
+        self.calls = []
+
+    def get_token_info(self, token):
+        self.calls.append(token)
+        return super(CountingProvider, self).get_token_info(token)
+
+class TokenInfoClientTest(TestCase):
+    def client_of(self, **options):
+        return TokenInfoClient(provider='player.tests.CountingProvider', options=options)
+
+    def test_cached_until_expired(self):
+        c = self.client_of()
+        self.assertEqual(c.get_token_info('stub-u')['user']['id'], 'u')
+        self.assertEqual(c.get_token_info('stub-u')['user']['id'], 'u')
+        self.assertEqual(c.provider.calls, [ 'stub-u' ])
+        c.invalidate('stub-u')
+        c.get_token_info('stub-u')
+        self.assertEqual(len(c.provider.calls), 2)
+
+        c = self.client_of(expires_in=-1)
+        c.get_token_info('stub-u')
+        c.get_token_info('stub-u')
+        self.assertEqual(len(c.provider.calls), 2)
+
+    def test_invalid_is_not_cached(self):
+        c = self.client_of()
+        self.assertRaises(AccessToken.Invalid, c.get_token_info, 'bad')
+        self.assertRaises(AccessToken.Invalid, c.get_token_info, 'bad')
+        self.assertEqual(len(c.provider.calls), 2)
+
+    def test_concurrent_lookups_share_a_request(self):
+        c = self.client_of(latency=0.2)
+        results = []
+        threads = [ threading.Thread(target=lambda: results.append(c.get_token_info('stub-u'))) for i in range(5) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(c.provider.calls, [ 'stub-u' ])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import threading
+import datetime
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from player.models import AccessToken
+from player.cache import TTLCache
+
+class IizsNetProvider(object):
+    ''' asks iizs.net about a token over a pooled, keep-alive session '''
+    URL = 'https://iizs.net/auth/tokeninfo'
+
+    def __init__(self, url=URL, connect_timeout=2, read_timeout=5, pool_size=10, verify=True):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify = verify
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def get_token_info(self, token):
+        try:
+            r = self.session.get(self.url, params={ 'token': token }, timeout=self.timeout, verify=self.verify)
+        except requests.RequestException as e:
+            raise TokenInfoClient.Unavailable(type(e).__name__ + ': ' + str(e))
+        if r.status_code != 200:
+            raise AccessToken.Invalid( 'AccessToken, \'' + token + '\' not found from iizs.net')
+        try:
+            return r.json()
+        except ValueError as e:
+            raise TokenInfoClient.Unavailable('malformed token info: ' + str(e))
+
+class StubProvider(object):
+    ''' local stand-in for load tests: token 'stub-<user_id>' belongs to user_id '''
+    PREFIX = 'stub-'
+
+    def __init__(self, expires_in=3600, latency=0):
+        self.expires_in = expires_in
+        self.latency = latency
+
+    def get_token_info(self, token):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if not token.startswith(StubProvider.PREFIX):
+            raise AccessToken.Invalid( 'AccessToken, \'' + token + '\' not found from stub')
+        expires = timezone.now() + datetime.timedelta(seconds=self.expires_in)
+        return {
+            'user': { 'id': token[len(StubProvider.PREFIX):] },
+            'expires': expires.isoformat(),
+        }
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class TokenInfoClient(object):
+    ''' token info from the identity provider of settings.TOKEN_INFO
+
+    Results are cached until the token expires. Concurrent lookups of the same
+    token share one request to the provider.
+    '''
+    DEFAULT_PROVIDER = 'player.tokeninfo.IizsNetProvider'
+    # provider 응답을 기다리는 다른 요청들이 포기하기까지의 시간
+    WAIT_TIMEOUT = 10
+
+    def __init__(self, provider=None, options=None):
+        if provider == None:
+            conf = getattr(settings, 'TOKEN_INFO', {})
+            provider = conf.get('PROVIDER', TokenInfoClient.DEFAULT_PROVIDER)
+            options = conf.get('OPTIONS', {})
+        self.provider = import_string(provider)(**(options or {}))
+        self._cache = TTLCache(ttl=0)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def get_token_info(self, token):
+        ''' can raise (AccessToken.Invalid, TokenInfoClient.Unavailable) '''
+        info = self._cache.get(token)
+        if info is not TTLCache.MISS:
+            return info
+
+        with self._lock:
+            call = self._calls.get(token, None)
+            leader = call == None
+            if leader:
+                call = _Call()
+                self._calls[token] = call
+
+        if not leader:
+            if not call.done.wait(TokenInfoClient.WAIT_TIMEOUT):
+                raise TokenInfoClient.Unavailable('timed out waiting for token info')
+            if call.error != None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self.provider.get_token_info(token)
+            expires = parse_datetime(call.result.get('expires', None) or '')
+            if expires != None:
+                if timezone.is_naive(expires):
+                    expires = timezone.make_aware(expires, timezone.utc)
+                self._cache.set(token, call.result, (expires - timezone.now()).total_seconds())
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[token]
+            call.done.set()
+
+    def invalidate(self, token):
+        self._cache.delete(token)
+
+    class Unavailable(Exception):
+        def __init__(self, message):
+            self.message = message
+        def __unicode__(self):
+            return repr(self.message)
+
+token_info_client = TokenInfoClient()
@@ -8,10 +8,11 @@ from django.utils.dateparse import parse_datetime
 from django.utils.datastructures import MultiValueDictKeyError
 
 import json
-import requests
 
 from player.models import Player, AccessToken
 from player.decorators import requires_access_token
+from player.cache import token_cache
+from player.tokeninfo import token_info_client, TokenInfoClient
 
 # this can raise IntegrityError
 def _create_player(user_id, name=None, email=None, auth_provider=Player.IIZS_NET):
@@ -23,14 +24,6 @@ def _create_player(user_id, name=None, email=None, auth_provider=Player.IIZS_NET
     p.save()
     return p
 
-def _get_token_info(token, auth_provider=Player.IIZS_NET):
-    payloads = { 'token': token }
-    r = requests.get("https://iizs.net/auth/tokeninfo", params=payloads, verify=False)
-    # TODO add validity check
-    if r.status_code != 200:
-        raise AccessToken.Invalid( 'AccessToken, \'' + token + '\' not found from iizs.net')
-    return r.json()
-
 @csrf_exempt
 def create(request):
     response_data = {}
@@ -75,7 +68,7 @@ def registerToken(request):
     try:
         # get token info 
         token_param = request.GET['token']
-        token_info = _get_token_info(token_param)
+        token_info = token_info_client.get_token_info(token_param)
 
         user_id = token_info['user']['id']
         expires = token_info['expires']
@@ -83,6 +76,7 @@ def registerToken(request):
         p = Player.objects.get(user_id=user_id)
         try:
             t = AccessToken.objects.get(player=p)
+            token_cache.delete(t.token)
         except AccessToken.DoesNotExist:
             t = AccessToken()
             t.player = p
@@ -92,10 +86,12 @@ def registerToken(request):
 
         # TODO expired token은 등록하지 말까? 
         t.save()
+        # 등록 전에 조회되어 unknown 으로 캐시되었을 수 있다.
+        token_cache.delete(t.token)
 
         response_data['success'] = True
 
-    except (AccessToken.Invalid, Player.DoesNotExist, MultiValueDictKeyError) as e:
+    except (AccessToken.Invalid, TokenInfoClient.Unavailable, Player.DoesNotExist, MultiValueDictKeyError) as e:
         response_data['success'] = False
         response_data['errmsg'] = type(e).__name__ + ": " + e.message
 
@@ -3,11 +3,26 @@ from django.forms import SelectMultiple
 from django.db import models
 
 from rule.models import Edition, Commodity, Province, Water, Advance, HistoryCard, EventCard, LeaderCard, CommodityCard
+from rule.catalog import invalidate_catalog
 
-class CommodityAdmin(admin.ModelAdmin):
+class RuleAdmin(admin.ModelAdmin):
+    ''' drops the cached rule catalogs whenever rule data is changed '''
+    def save_model(self, request, obj, form, change):
+        super(RuleAdmin, self).save_model(request, obj, form, change)
+        invalidate_catalog()
+
+    def save_related(self, request, form, formsets, change):
+        super(RuleAdmin, self).save_related(request, form, formsets, change)
+        invalidate_catalog()
+
+    def delete_model(self, request, obj):
+        super(RuleAdmin, self).delete_model(request, obj)
+        invalidate_catalog()
+
+class CommodityAdmin(RuleAdmin):
     list_display = ('full_name', 'short_name', 'unit_price', 'dice_roll')
 
-class ProvinceAdmin(admin.ModelAdmin):
+class ProvinceAdmin(RuleAdmin):
     list_display = (
         'full_name', 
         'area', 
@@ -24,7 +39,7 @@ class ProvinceAdmin(admin.ModelAdmin):
         models.ManyToManyField: {'widget': SelectMultiple(attrs={'size':'10'}) },
     }
 
-class WaterAdmin(admin.ModelAdmin):
+class WaterAdmin(RuleAdmin):
     list_display = (
         'full_name', 
         'area', 
@@ -38,7 +53,7 @@ class WaterAdmin(admin.ModelAdmin):
         models.ManyToManyField: {'widget': SelectMultiple(attrs={'size':'10'}) },
     }
 
-class AdvanceAdmin(admin.ModelAdmin):
+class AdvanceAdmin(RuleAdmin):
     list_display = (
         'short_name', 
         'full_name', 
@@ -53,7 +68,7 @@ class AdvanceAdmin(admin.ModelAdmin):
         models.ManyToManyField: {'widget': SelectMultiple(attrs={'size':'10'}) },
     }
 
-class EventCardAdmin(admin.ModelAdmin):
+class EventCardAdmin(RuleAdmin):
     fieldsets = [
         ('None',    {'fields': [
                         'edition', 
@@ -75,7 +90,7 @@ class EventCardAdmin(admin.ModelAdmin):
         'edition', 
     )
 
-class LeaderCardAdmin(admin.ModelAdmin):
+class LeaderCardAdmin(RuleAdmin):
     fieldsets = [
         ('None',    {   'fields': [
                             'edition', 
@@ -112,7 +127,7 @@ class LeaderCardAdmin(admin.ModelAdmin):
         models.ManyToManyField: {'widget': SelectMultiple(attrs={'size':'10'}) },
     }
 
-class CommodityCardAdmin(admin.ModelAdmin):
+class CommodityCardAdmin(RuleAdmin):
     fieldsets = [
         ('None',    {'fields': [
                         'edition', 
@@ -139,7 +154,7 @@ class CommodityCardAdmin(admin.ModelAdmin):
     }
 
 
-admin.site.register(Edition)
+admin.site.register(Edition, RuleAdmin)
 admin.site.register(Commodity, CommodityAdmin)
 admin.site.register(Province, ProvinceAdmin)
 admin.site.register(Water, WaterAdmin)
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import threading
+import hashlib
+import json
+
+from rule.models import Edition, Commodity, Advance, HistoryCard, EventCard, LeaderCard, CommodityCard, Province, Water
+
+# Rule data never changes during a game, so the game engine reads it from an
+# in-process catalog instead of querying the rule tables on every action.
+# Records are namedtuples and relations are frozensets / tuples of short names;
+# the containing dicts must be treated as read-only.
+
+ProvinceRule = namedtuple('ProvinceRule', [
+    'short_name', 'full_name', 'area', 'province_type', 'market_size',
+    'commodities', 'supports', 'connected', 'coasts',
+])
+
+WaterRule = namedtuple('WaterRule', [
+    'short_name', 'full_name', 'area', 'water_type', 'coast_of', 'connected',
+])
+
+CommodityRule = namedtuple('CommodityRule', [
+    'short_name', 'full_name', 'unit_price', 'dice_roll', 'provinces',
+])
+
+AdvanceRule = namedtuple('AdvanceRule', [
+    'short_name', 'full_name', 'category', 'points', 'credits', 'prerequisites',
+])
+
+HistoryCardRule = namedtuple('HistoryCardRule', [
+    'short_name', 'full_name', 'epoch', 'recycles', 'shuffle_later', 'card_type',
+])
+
+LeaderCardRule = namedtuple('LeaderCardRule', HistoryCardRule._fields + (
+    'discount', 'advances', 'event', 'discount_on_event', 'discount_after_event', 'discount_during_event',
+))
+
+CommodityCardRule = namedtuple('CommodityCardRule', HistoryCardRule._fields + (
+    'commodities',
+))
+
+class RuleCatalog(object):
+    EVENT_CARD = 'E'
+    LEADER_CARD = 'L'
+    COMMODITY_CARD = 'C'
+
+    def __init__(self, edition):
+        self.edition = edition
+        self.provinces = {}
+        self.waters = {}
+        self.commodities = {}
+        self.commodity_names = {}   # full_name -> short_name
+        self.advances = {}
+        self.advance_categories = {}
+        self.cards = {}             # every history card, in the order of its id
+        self.card_order = ()
+        self.event_cards = {}
+        self.leader_cards = {}
+        self.commodity_cards = {}
+        self._content_hash = None
+
+    @staticmethod
+    def load(edition_name):
+        ''' build a catalog from the rule tables; can raise Edition.DoesNotExist '''
+        edition = Edition.objects.get(name=edition_name)
+        c = RuleCatalog(edition.name)
+
+        coasts = {}
+        for w in Water.objects.filter(edition=edition).select_related('coast_of').prefetch_related('connected'):
+            coast_of = w.coast_of.short_name if w.coast_of != None else None
+            c.waters[w.short_name] = WaterRule(
+                    short_name=w.short_name,
+                    full_name=w.full_name,
+                    area=w.area,
+                    water_type=w.water_type,
+                    coast_of=coast_of,
+                    connected=frozenset([x.short_name for x in w.connected.all()]),
+            )
+            if coast_of != None:
+                coasts.setdefault(coast_of, set()).add(w.short_name)
+
+        producers = {}
+        provinces = Province.objects.filter(edition=edition) \
+                        .prefetch_related('commodities', 'supports', 'connected')
+        for p in provinces:
+            commodities = frozenset([x.short_name for x in p.commodities.all()])
+            for x in commodities:
+                producers.setdefault(x, set()).add(p.short_name)
+            c.provinces[p.short_name] = ProvinceRule(
+                    short_name=p.short_name,
+                    full_name=p.full_name,
+                    area=p.area,
+                    province_type=p.province_type,
+                    market_size=p.market_size,
+                    commodities=commodities,
+                    supports=frozenset([x.short_name for x in p.supports.all()]),
+                    connected=frozenset([x.short_name for x in p.connected.all()]),
+                    coasts=frozenset(coasts.get(p.short_name, ())),
+            )
+
+        # Commodity 는 edition 구분이 없다.
+        for x in Commodity.objects.all():
+            c.commodities[x.short_name] = CommodityRule(
+                    short_name=x.short_name,
+                    full_name=x.full_name,
+                    unit_price=x.unit_price,
+                    dice_roll=x.dice_roll,
+                    provinces=frozenset(producers.get(x.short_name, ())),
+            )
+            c.commodity_names[x.full_name] = x.short_name
+
+        categories = {}
+        for a in Advance.objects.filter(edition=edition).prefetch_related('prerequisites'):
+            c.advances[a.short_name] = AdvanceRule(
+                    short_name=a.short_name,
+                    full_name=a.full_name,
+                    category=a.category,
+                    points=a.points,
+                    credits=a.credits,
+                    prerequisites=frozenset([x.short_name for x in a.prerequisites.all()]),
+            )
+            categories.setdefault(a.category, set()).add(a.short_name)
+        for k in categories:
+            c.advance_categories[k] = frozenset(categories[k])
+
+        for x in LeaderCard.objects.filter(edition=edition).select_related('event').prefetch_related('advances'):
+            c.leader_cards[x.short_name] = LeaderCardRule(
+                    short_name=x.short_name,
+                    full_name=x.full_name,
+                    epoch=x.epoch,
+                    recycles=x.recycles,
+                    shuffle_later=x.shuffle_later,
+                    card_type=RuleCatalog.LEADER_CARD,
+                    discount=x.discount,
+                    advances=frozenset([a.short_name for a in x.advances.all()]),
+                    event=x.event.short_name if x.event != None else None,
+                    discount_on_event=x.discount_on_event,
+                    discount_after_event=x.discount_after_event,
+                    discount_during_event=x.discount_during_event,
+            )
+
+        for x in CommodityCard.objects.filter(edition=edition).prefetch_related('commodities'):
+            c.commodity_cards[x.short_name] = CommodityCardRule(
+                    short_name=x.short_name,
+                    full_name=x.full_name,
+                    epoch=x.epoch,
+                    recycles=x.recycles,
+                    shuffle_later=x.shuffle_later,
+                    card_type=RuleCatalog.COMMODITY_CARD,
+                    commodities=frozenset([m.short_name for m in x.commodities.all()]),
+            )
+
+        for x in EventCard.objects.filter(edition=edition):
+            c.event_cards[x.short_name] = HistoryCardRule(
+                    short_name=x.short_name,
+                    full_name=x.full_name,
+                    epoch=x.epoch,
+                    recycles=x.recycles,
+                    shuffle_later=x.shuffle_later,
+                    card_type=RuleCatalog.EVENT_CARD,
+            )
+
+        order = []
+        for x in HistoryCard.objects.filter(edition=edition).order_by('id'):
+            for d in (c.event_cards, c.leader_cards, c.commodity_cards):
+                if x.short_name in d:
+                    c.cards[x.short_name] = d[x.short_name]
+                    break
+            else:
+                c.cards[x.short_name] = HistoryCardRule(
+                        short_name=x.short_name,
+                        full_name=x.full_name,
+                        epoch=x.epoch,
+                        recycles=x.recycles,
+                        shuffle_later=x.shuffle_later,
+                        card_type=None,
+                )
+            order.append(x.short_name)
+        c.card_order = tuple(order)
+
+        return c
+
+    @staticmethod
+    def from_fixture(path, edition_name):
+        ''' build a catalog from a rule fixture (e.g. rule/init_data.json) without touching the database '''
+        with open(path) as f:
+            records = json.load(f)
+
+        objects = {}
+        for r in records:
+            objects.setdefault(r['model'], {})[r['pk']] = r['fields']
+
+        def table(model):
+            return objects.get('rule.' + model, {})
+
+        editions = [pk for (pk, e) in table('edition').items() if e['name'] == edition_name]
+        if not editions:
+            raise Edition.DoesNotExist('Edition matching query does not exist.')
+        edition = editions[0]
+
+        def symmetric(model):
+            # ManyToManyField('self') 는 대칭이므로 fixture 에 한쪽만 있어도 양쪽으로 연결된다.
+            links = {}
+            for (pk, x) in table(model).items():
+                for other in x['connected']:
+                    links.setdefault(pk, set()).add(other)
+                    links.setdefault(other, set()).add(pk)
+            return links
+
+        c = RuleCatalog(edition_name)
+        provinces = dict([(pk, x) for (pk, x) in table('province').items() if x['edition'] == edition])
+        waters = dict([(pk, x) for (pk, x) in table('water').items() if x['edition'] == edition])
+        commodities = table('commodity')
+        advances = dict([(pk, x) for (pk, x) in table('advance').items() if x['edition'] == edition])
+
+        water_links = symmetric('water')
+        coasts = {}
+        for (pk, w) in waters.items():
+            coast_of = provinces[w['coast_of']]['short_name'] if w['coast_of'] != None else None
+            c.waters[w['short_name']] = WaterRule(
+                    short_name=w['short_name'],
+                    full_name=w['full_name'],
+                    area=w['area'],
+                    water_type=w['water_type'],
+                    coast_of=coast_of,
+                    connected=frozenset([waters[x]['short_name'] for x in water_links.get(pk, ()) if x in waters]),
+            )
+            if coast_of != None:
+                coasts.setdefault(coast_of, set()).add(w['short_name'])
+
+        province_links = symmetric('province')
+        supports = {}
+        for (pk, x) in provinces.items():
+            for other in x['supports']:
+                supports.setdefault(pk, set()).add(other)
+                supports.setdefault(other, set()).add(pk)
+        producers = {}
+        for (pk, p) in provinces.items():
+            produced = frozenset([commodities[x]['short_name'] for x in p['commodities']])
+            for x in produced:
+                producers.setdefault(x, set()).add(p['short_name'])
+            c.provinces[p['short_name']] = ProvinceRule(
+                    short_name=p['short_name'],
+                    full_name=p['full_name'],
+                    area=p['area'],
+                    province_type=p['province_type'],
+                    market_size=p['market_size'],
+                    commodities=produced,
+                    supports=frozenset([provinces[x]['short_name'] for x in supports.get(pk, ()) if x in provinces]),
+                    connected=frozenset([provinces[x]['short_name'] for x in province_links.get(pk, ()) if x in provinces]),
+                    coasts=frozenset(coasts.get(p['short_name'], ())),
+            )
+
+        for x in commodities.values():
+            c.commodities[x['short_name']] = CommodityRule(
+                    short_name=x['short_name'],
+                    full_name=x['full_name'],
+                    unit_price=x['unit_price'],
+                    dice_roll=x['dice_roll'],
+                    provinces=frozenset(producers.get(x['short_name'], ())),
+            )
+            c.commodity_names[x['full_name']] = x['short_name']
+
+        categories = {}
+        for a in advances.values():
+            c.advances[a['short_name']] = AdvanceRule(
+                    short_name=a['short_name'],
+                    full_name=a['full_name'],
+                    category=a['category'],
+                    points=a['points'],
+                    credits=a['credits'],
+                    prerequisites=frozenset([advances[x]['short_name'] for x in a['prerequisites']]),
+            )
+            categories.setdefault(a['category'], set()).add(a['short_name'])
+        for k in categories:
+            c.advance_categories[k] = frozenset(categories[k])
+
+        # EventCard, LeaderCard, CommodityCard 는 HistoryCard 를 상속하므로 같은 pk 를 쓴다.
+        cards = dict([(pk, x) for (pk, x) in table('historycard').items() if x['edition'] == edition])
+        for pk in sorted(cards.keys()):
+            h = cards[pk]
+            base = dict(
+                    short_name=h['short_name'],
+                    full_name=h['full_name'],
+                    epoch=h['epoch'],
+                    recycles=h['recycles'],
+                    shuffle_later=h['shuffle_later'],
+            )
+            if pk in table('leadercard'):
+                x = table('leadercard')[pk]
+                rule = LeaderCardRule(
+                        card_type=RuleCatalog.LEADER_CARD,
+                        discount=x['discount'],
+                        advances=frozenset([table('advance')[a]['short_name'] for a in x['advances']]),
+                        event=cards[x['event']]['short_name'] if x['event'] != None else None,
+                        discount_on_event=x['discount_on_event'],
+                        discount_after_event=x['discount_after_event'],
+                        discount_during_event=x['discount_during_event'],
+                        **base)
+                c.leader_cards[rule.short_name] = rule
+            elif pk in table('commoditycard'):
+                x = table('commoditycard')[pk]
+                rule = CommodityCardRule(
+                        card_type=RuleCatalog.COMMODITY_CARD,
+                        commodities=frozenset([commodities[m]['short_name'] for m in x['commodities']]),
+                        **base)
+                c.commodity_cards[rule.short_name] = rule
+            elif pk in table('eventcard'):
+                rule = HistoryCardRule(card_type=RuleCatalog.EVENT_CARD, **base)
+                c.event_cards[rule.short_name] = rule
+            else:
+                rule = HistoryCardRule(card_type=None, **base)
+            c.cards[rule.short_name] = rule
+        c.card_order = tuple([cards[pk]['short_name'] for pk in sorted(cards.keys())])
+
+        return c
+
+    def get_commodity(self, name):
+        ''' name can be either short_name or full_name; returns None if not found '''
+        if name in self.commodities:
+            return self.commodities[name]
+        if name in self.commodity_names:
+            return self.commodities[self.commodity_names[name]]
+        return None
+
+    def get_history_cards(self, epoch, shuffle_later=None):
+        cards = []
+        for key in self.card_order:
+            c = self.cards[key]
+            if c.epoch != epoch:
+                continue
+            if shuffle_later != None and c.shuffle_later != shuffle_later:
+                continue
+            cards.append(key)
+        return cards
+
+    def get_provinces_in_area(self, area):
+        ''' short names of the provinces in area, smaller markets first '''
+        provinces = [p for p in self.provinces.values() if p.area == area]
+        provinces.sort(key=lambda p: (p.market_size, p.short_name))
+        return [p.short_name for p in provinces]
+
+    def is_coastal(self, province_name):
+        return len(self.provinces[province_name].coasts) > 0
+
+    def get_content_hash(self):
+        ''' digest of every rule record of the edition, usable as an ETag '''
+        if self._content_hash == None:
+            h = hashlib.md5(self.edition.encode('utf-8'))
+            for d in (self.provinces, self.waters, self.commodities, self.advances, self.cards):
+                for key in sorted(d.keys()):
+                    # frozenset 은 순서가 정해져 있지 않으므로 정렬해서 넣는다.
+                    values = [sorted(v) if type(v) is frozenset else v for v in d[key]]
+                    h.update(repr(values))
+            h.update(repr(self.card_order))
+            self._content_hash = h.hexdigest()
+        return self._content_hash
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(edition_name):
+    c = _catalogs.get(edition_name, None)
+    if c == None:
+        with _catalogs_lock:
+            c = _catalogs.get(edition_name, None)
+            if c == None:
+                c = RuleCatalog.load(edition_name)
+                _catalogs[edition_name] = c
+    return c
+
+def register_catalog(catalog):
+    ''' make catalog the one get_catalog() returns for its edition, e.g. one built by from_fixture() '''
+    with _catalogs_lock:
+        _catalogs[catalog.edition] = catalog
+
+def invalidate_catalog(edition_name=None):
+    ''' drop cached catalogs; they are rebuilt on the next get_catalog() '''
+    with _catalogs_lock:
+        if edition_name == None:
+            _catalogs.clear()
+        elif edition_name in _catalogs:
+            del _catalogs[edition_name]
@@ -1,3 +1,34 @@
+import os
+
+from django.conf import settings
 from django.test import TestCase
 
-# Create your tests here.
+from rule.catalog import RuleCatalog, get_catalog, invalidate_catalog
+from rule.models import Edition
+
+FIXTURE = os.path.join(settings.BASE_DIR, 'rule', 'init_data.json')
+
+class RuleCatalogTest(TestCase):
+    fixtures = [ FIXTURE ]
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def tearDown(self):
+        invalidate_catalog()
+
+    def test_fixture_matches_tables(self):
+        loaded = RuleCatalog.load('european')
+        self.assertTrue(loaded.provinces)
+        self.assertEqual(loaded.get_content_hash(), RuleCatalog.from_fixture(FIXTURE, 'european').get_content_hash())
+
+    def test_cached(self):
+        c = get_catalog('european')
+        with self.assertNumQueries(0):
+            self.assertTrue(get_catalog('european') is c)
+        invalidate_catalog('european')
+        self.assertFalse(get_catalog('european') is c)
+
+    def test_unknown_edition(self):
+        self.assertRaises(Edition.DoesNotExist, get_catalog, 'none')
+        self.assertRaises(Edition.DoesNotExist, RuleCatalog.from_fixture, FIXTURE, 'none')
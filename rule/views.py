@@ -1,11 +1,20 @@
 from django.shortcuts import render
 from django.http import HttpResponse
 from django.core import serializers
+from django.views.decorators.http import condition
 
 from rule.models import Edition, Commodity, Province, Water
+from rule.catalog import get_catalog
 
 import json
 
+def _map_etag(request):
+    try:
+        return get_catalog(request.GET.get('edition', 'none')).get_content_hash()
+    except Edition.DoesNotExist:
+        return None
+
+@condition(etag_func=_map_etag)
 def getMap(request):
     param_edition = request.GET.get('edition', 'none')
 